@@ -0,0 +1,522 @@
+"""
+Paintings for the Art Gallery page: a description of a scene in a style, and an image of it.
+
+A painting takes two requests one after the other (the description, then the image), each taking a
+few seconds. GalleryPrefetcher keeps a session's next paintings coming ahead of its clicks: once a
+gallery is entered it generates the next few in the background on the shared event loop (see
+genai_processor.background_loop), so clicking for a new painting shows one that is already done and
+another starts in its place.
+
+Images are kept in the local image store (see image_store.py) and passed around by their key there.
+Requests go through a RetryPolicy and a CircuitBreaker like the processors' (see resilience.py), and a
+painting whose request fails raises its error.
+
+GalleryPool keeps paintings of every style ready for all sessions, so a whole class entering a gallery at
+once is served from disk rather than by a burst of requests. It is refilled in the background as it is
+used, and can be filled ahead of a class with:
+
+Usage: OPENAI_API_KEY=... python art_gallery.py warm-up [--depth 20] [--style Renaissance ...]
+       python art_gallery.py stats
+"""
+
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from genai_processor import run_async, submit_async, wait_async
+from image_store import STORE_PATH as IMAGE_STORE_PATH
+from resilience import CircuitBreaker, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+POOL_PATH = os.environ.get("GALLERY_POOL_PATH", os.path.join(IMAGE_STORE_PATH, "gallery_pool.db"))
+
+# The styles offered on the page and what each is known for, which goes into the image prompt
+STYLE_CHARACTERISTICS = {
+    "Renaissance": "Realistic, detailed, perspective-focused",
+    "Abstract Expressionism": "Spontaneous, emotional, non-representational",
+    "Art Deco": "Geometric, streamlined, decorative",
+    "Art Nouveau": "Flowing, organic, ornamental",
+    "Avant-garde": "Innovative, non-traditional, experimental",
+    "Baroque": "Dramatic, intense, detailed",
+    "Classicism": "Harmonious, proportionate, idealized",
+    "Digital Art": "Pixel-based, computer-generated, versatile",
+    "Expressionism": "Distorted, subjective, emotive",
+    "Futurism": "Dynamic, mechanical, motion-focused",
+    "Harlem Renaissance": "Cultural, vibrant, expressive",
+}
+
+
+class ArtGallery:
+    image_model = "dall-e-2"
+    image_size = "256x256"
+
+    # Images take longer than chat completions, so an attempt gets more time
+    retry_policy = RetryPolicy(timeout=60.0, deadline=120.0)
+
+    def __init__(self, client, image_store):
+        """
+        Parameters:
+        - client (openai.AsyncOpenAI): The client to make requests with, shared by every session (see
+          resources.get_art_gallery).
+        - image_store (ImageStore): Where generated images are kept.
+        """
+        self.client = client
+        self.image_store = image_store
+        self.circuit_breaker = CircuitBreaker("the OpenAI image gallery")
+
+    async def generate_image_prompt(self, style):
+        """
+        Returns a description of a scene in the style.
+
+        Raises:
+        - CircuitOpenError, TimeoutError or the provider's error, if the request fails.
+        """
+        system_instructions = f"Craft Dall-E prompt for easily recognizable paintings in {style} style, for an image description game for English learners. Focus on a clear, simple noun (thing, or animal), avoid people. Use straightforward English and easy vocabulary to aid guessing and understanding, as if explaining the art to someone who hasn't seen it. Follow these steps. Step 1: Provide a descriptive title. Step 2: Provide a simple but comprehensive description of what is happening in the painting in 15 words or less. Do not list steps."
+
+        user_prompt = "Create an art gallery piece scene description."
+
+        def complete():
+            return self.client.chat.completions.create(
+                model="gpt-4-turbo-preview",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": system_instructions,
+                    },
+                    {"role": "user", "content": user_prompt},
+                ],
+                max_tokens=50,
+                temperature=0.9,
+            )
+
+        response = await self.retry_policy.call(complete, self.circuit_breaker)
+        return response.choices[0].message.content
+
+    async def generate_artwork(self, prompt, style, style_characteristics, variant=0):
+        """
+        Returns the key in the image store of an image of the prompt, generating it only if the store
+        doesn't have one.
+
+        Parameters:
+        - variant (int): Which of several images of the same prompt, e.g. 1 for a second one.
+
+        Raises:
+        - CircuitOpenError, TimeoutError or the provider's error, if the request fails.
+        """
+        key = self.image_store.make_key(style, prompt, self.image_model, self.image_size, variant)
+        if key in self.image_store:
+            return key
+
+        def generate():
+            return self.client.images.generate(
+                model=self.image_model,
+                prompt=f"Create an image that clearly and vividly represents the following scene in the style of {style}, "
+                f"which is known for its {style_characteristics}. The scene description is: '{prompt}'. "
+                "Ensure the image is simple enough to be guessed or described by someone learning English, "
+                "focus on the elements in the description only. There should be no words in the image",
+                size=self.image_size,
+                quality="standard",
+                n=1,
+                # The image itself rather than a URL to it, which would expire after an hour
+                response_format="b64_json",
+            )
+
+        response = await self.retry_policy.call(generate, self.circuit_breaker)
+        self.image_store.add(key, base64.b64decode(response.data[0].b64_json))
+        return key
+
+    async def generate_painting(self, style, style_characteristics):
+        """
+        Generates a new description in the style and an image of it.
+
+        Returns:
+        - tuple: (description, image key), both None if the model gave no description.
+
+        Raises:
+        - CircuitOpenError, TimeoutError or the provider's error, if a request fails.
+        """
+        description = await self.generate_image_prompt(style)
+        if not description:
+            return None, None
+        return description, await self.generate_artwork(description, style, style_characteristics)
+
+
+class GalleryPool:
+    """
+    Paintings of each style generated ahead of time and shared by every session, each session seeing
+    each painting at most once.
+
+    Every style is kept at `depth` paintings: drawing from a style below it starts generating more in
+    the background. Paintings generated live for a session that has seen all of a style's are added
+    too, so the pool grows with use up to max_paintings per style.
+
+    Parameters:
+    - gallery (ArtGallery): Generates the paintings and holds their images.
+    - path (str): SQLite file of the pool.
+    - depth (int): Paintings kept per style.
+    - max_paintings (int): Most paintings kept per style, the oldest are dropped beyond it.
+    - concurrency (int): Most paintings of a style generated at once in the background.
+    """
+
+    def __init__(self, gallery, path=POOL_PATH, depth=20, max_paintings=100, concurrency=2):
+        self.gallery = gallery
+        self.depth = depth
+        self.max_paintings = max_paintings
+        self.concurrency = concurrency
+        self.hits = 0
+        self.misses = 0
+        self._generating = {}  # Style -> number of its paintings being generated in the background
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS paintings ("
+            " style TEXT, image_key TEXT, description TEXT, created REAL,"
+            " PRIMARY KEY (style, image_key)) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    def count(self, style):
+        with self._lock:
+            (count,) = self._db.execute(
+                "SELECT COUNT(*) FROM paintings WHERE style = ?", (style,)
+            ).fetchone()
+        return count
+
+    def _unseen(self, style, seen):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT image_key, description FROM paintings WHERE style = ?", (style,)
+            ).fetchall()
+        return [(image_key, description) for image_key, description in rows if image_key not in seen]
+
+    def unseen(self, style, seen):
+        """
+        Returns the number of the style's paintings whose image key is not in seen.
+        """
+        return len(self._unseen(style, seen))
+
+    def draw(self, style, seen):
+        """
+        Returns a random painting of the style that the session hasn't seen, and adds it to seen.
+
+        Parameters:
+        - style (str): A style of STYLE_CHARACTERISTICS.
+        - seen (set): Image keys of the paintings the session has been shown.
+
+        Returns:
+        - tuple: (description, image key), or None if the session has seen all of the style's.
+        """
+        painting = None
+        candidates = self._unseen(style, seen)
+        random.shuffle(candidates)
+        for image_key, description in candidates:
+            if image_key in self.gallery.image_store:
+                painting = (description, image_key)
+                break
+            # Its image was evicted from the image store
+            with self._lock:
+                self._db.execute(
+                    "DELETE FROM paintings WHERE style = ? AND image_key = ?", (style, image_key)
+                )
+                self._db.commit()
+
+        if painting is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            seen.add(painting[1])
+        self.replenish(style)
+        return painting
+
+    def add(self, style, description, image_key):
+        """
+        Adds a painting to the style's, dropping the oldest beyond max_paintings.
+        """
+        if not (description and image_key):
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO paintings VALUES (?, ?, ?, ?)",
+                (style, image_key, description, time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM paintings WHERE style = ? AND image_key IN ("
+                " SELECT image_key FROM paintings WHERE style = ?"
+                " ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (style, style, self.max_paintings),
+            )
+            self._db.commit()
+
+    def replenish(self, style):
+        """
+        Starts generating paintings of the style in the background if it has fewer than `depth`, at
+        most `concurrency` at a time. Each one that succeeds starts the next, until the style is full.
+        """
+        count = self.count(style)
+        with self._lock:
+            generating = self._generating.get(style, 0)
+            missing = min(self.depth - count - generating, self.concurrency - generating)
+            if missing <= 0:
+                return
+            self._generating[style] = generating + missing
+
+        for _ in range(missing):
+            painting = self.gallery.generate_painting(style, STYLE_CHARACTERISTICS[style])
+            submit_async(painting).add_done_callback(lambda future: self._generated(style, future))
+
+    def _generated(self, style, future):
+        added = False
+        try:
+            if future.cancelled():
+                pass
+            elif future.exception() is not None:
+                logger.warning("Could not generate a %s painting: %r", style, future.exception())
+            else:
+                description, image_key = future.result()
+                self.add(style, description, image_key)
+                added = bool(description and image_key)
+        finally:
+            with self._lock:
+                self._generating[style] -= 1
+        # A failed painting doesn't start another, so a provider that is down isn't called in a loop
+        if added:
+            self.replenish(style)
+
+    async def warm_up(self, styles=None, concurrency=4, on_painting=None):
+        """
+        Generates paintings until every style has `depth`, e.g. before a class.
+
+        Parameters:
+        - styles (list of str): The styles to fill, defaults to all of STYLE_CHARACTERISTICS.
+        - concurrency (int): Most paintings generated at once.
+        - on_painting (callable): Called with the style and whether it succeeded after each painting.
+
+        Returns:
+        - int: Number of paintings added.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate(style):
+            async with semaphore:
+                try:
+                    description, image_key = await self.gallery.generate_painting(
+                        style, STYLE_CHARACTERISTICS[style]
+                    )
+                except Exception:
+                    logger.exception("Could not generate a %s painting", style)
+                    description = image_key = None
+            self.add(style, description, image_key)
+            added = bool(description and image_key)
+            if on_painting is not None:
+                on_painting(style, added)
+            return added
+
+        jobs = [
+            generate(style)
+            for style in styles or STYLE_CHARACTERISTICS
+            for _ in range(max(0, self.depth - self.count(style)))
+        ]
+        return sum(await asyncio.gather(*jobs))
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            counts = dict(
+                self._db.execute("SELECT style, COUNT(*) FROM paintings GROUP BY style").fetchall()
+            )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "paintings": counts,
+        }
+
+
+class GalleryPrefetcher:
+    """
+    One session's queue of paintings generated ahead of its clicks, for one style.
+
+    With a pool, paintings the session hasn't seen are drawn from it, and only what the pool can't
+    cover is generated for the session (and then added to the pool). Paintings generated for a session
+    that never asks for them are paid for all the same, so depth should stay small.
+
+    Parameters:
+    - gallery (ArtGallery): Generates the paintings.
+    - style (str): The style of the gallery, e.g. "Baroque".
+    - style_characteristics (str): What the style is known for, e.g. "Dramatic, intense, detailed".
+    - depth (int): Number of new paintings kept ready or in progress.
+    - pool (GalleryPool): Paintings shared by every session, None generates them all for the session.
+    - seen (set): Image keys of the paintings the session has been shown, shared by its prefetchers so
+      a style it comes back to doesn't repeat itself.
+    """
+
+    def __init__(self, gallery, style, style_characteristics, depth=2, pool=None, seen=None):
+        self.gallery = gallery
+        self.style = style
+        self.style_characteristics = style_characteristics
+        self.depth = depth
+        self.pool = pool
+        self.seen = seen if seen is not None else set()
+        self._paintings = deque()  # Futures of (description, image key), oldest first
+        self._more = None  # (description, variant, future of the image key of another image of it)
+        self._variants = {}  # Description -> variant of the next image of it to show
+
+    def fill(self):
+        """
+        Starts generating paintings until `depth` are ready or in progress (counting the ones the pool
+        has for the session), after throwing away any that failed.
+        """
+        self._paintings = deque(future for future in self._paintings if not self._failed(future))
+        pooled = self.pool.unseen(self.style, self.seen) if self.pool is not None else 0
+        while len(self._paintings) + pooled < self.depth:
+            self._start_painting()
+
+    def _start_painting(self):
+        painting = self.gallery.generate_painting(self.style, self.style_characteristics)
+        self._paintings.append(submit_async(painting))
+
+    @staticmethod
+    def _failed(future):
+        if not future.done():
+            return False
+        if future.cancelled() or future.exception() is not None:
+            return True
+        description, image_key = future.result()
+        return not (description and image_key)
+
+    def ready(self):
+        """
+        Returns the number of paintings that can be shown without waiting.
+        """
+        return sum(future.done() for future in self._paintings)
+
+    def next_painting(self, on_wait=None):
+        """
+        Returns the next new painting, waiting for it if none is ready, and starts another in its place.
+
+        Parameters:
+        - on_wait (callable): Called every half second while waiting, see genai_processor.wait_async.
+
+        Returns:
+        - tuple: (description, image key), both None if the model gave no description.
+
+        Raises:
+        - The error of the painting's request, see ArtGallery.generate_painting.
+        """
+        self.fill()
+        # A painting generated for the session that is done, or else one from the pool, or else the
+        # painting that was started first
+        index = next((i for i, future in enumerate(self._paintings) if future.done()), None)
+        painting = None
+        if index is None and self.pool is not None:
+            painting = self.pool.draw(self.style, self.seen)
+        if painting is not None:
+            description, image_key = painting
+            self.fill()
+        else:
+            if not self._paintings:
+                self._start_painting()
+            future = self._paintings[index or 0]
+            del self._paintings[index or 0]
+            self.fill()
+            description, image_key = wait_async(future, on_wait)
+            if image_key:
+                self.seen.add(image_key)
+                if self.pool is not None:
+                    self.pool.add(self.style, description, image_key)
+        if description:
+            self._variants[description] = 1
+            self.prefetch_more(description)
+        return description, image_key
+
+    def prefetch_more(self, description):
+        """
+        Starts generating another image of the description for more_like, unless one is already ready
+        or in progress.
+        """
+        variant = self._variants.get(description, 1)
+        if self._more is not None and self._more[:2] == (description, variant):
+            return
+        self.cancel_more()
+        artwork = self.gallery.generate_artwork(
+            description, self.style, self.style_characteristics, variant
+        )
+        self._more = (description, variant, submit_async(artwork))
+
+    def more_like(self, description, on_wait=None):
+        """
+        Returns another image of the description, waiting for it if the prefetched one isn't ready, and
+        starts the one after it.
+
+        Returns:
+        - str: The image key.
+
+        Raises:
+        - The error of the image's request, see ArtGallery.generate_artwork.
+        """
+        self.prefetch_more(description)
+        _, variant, future = self._more
+        self._more = None
+        image_key = wait_async(future, on_wait)
+        if image_key:
+            self._variants[description] = variant + 1
+        self.prefetch_more(description)
+        return image_key
+
+    def cancel_more(self):
+        if self._more is not None:
+            self._more[2].cancel()
+            self._more = None
+
+    def cancel(self):
+        """
+        Stops generating paintings that haven't been shown, e.g. when the style changes.
+        """
+        for future in self._paintings:
+            future.cancel()
+        self._paintings.clear()
+        self.cancel_more()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["warm-up", "stats"])
+    parser.add_argument("--depth", type=int, default=20, help="Paintings to have per style")
+    parser.add_argument(
+        "--style", action="append", choices=list(STYLE_CHARACTERISTICS), help="Only fill these styles"
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Most paintings generated at once")
+    parser.add_argument("--pool", default=POOL_PATH, help="SQLite file of the pool")
+    parser.add_argument("--store", default=IMAGE_STORE_PATH, help="Directory of the image store")
+    args = parser.parse_args()
+
+    from genai_processor import openai
+    from image_store import ImageStore
+
+    client = None
+    if args.command == "warm-up":
+        if not os.environ.get("OPENAI_API_KEY"):
+            parser.error("Set OPENAI_API_KEY to generate paintings")
+        client = openai.AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    pool = GalleryPool(ArtGallery(client, ImageStore(args.store)), args.pool, depth=args.depth)
+    if args.command == "warm-up":
+        start = time.perf_counter()
+
+        def report(style, added):
+            print(f"{style}: {pool.count(style)} of {args.depth}" + ("" if added else " (failed)"))
+
+        added = run_async(pool.warm_up(args.style, args.concurrency, report))
+        print(f"Added {added} paintings in {time.perf_counter() - start:.0f}s")
+    for style, count in sorted(pool.stats()["paintings"].items()):
+        print(f"{style}: {count} paintings")
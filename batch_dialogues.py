@@ -0,0 +1,372 @@
+"""
+Generates Conversation Dictionary dialogues for a whole word list offline, through a provider's batch
+interface instead of one request at a time.
+
+The input is a CSV with a header row and the columns word, language, level and context (and optionally
+formality). Each row becomes a create_convo_prompt prompt, the prompts are submitted in batches, and the
+dialogues are appended to a JSONL store as batches complete. Progress is checkpointed next to the store,
+so an interrupted run picks up where it stopped: finished rows are skipped and batches that were
+already submitted are polled again rather than resubmitted.
+
+Usage: python batch_dialogues.py words.csv dialogues.jsonl [--backend openai|local] [--parquet PATH]
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+from genai_processor import (
+    ChatGPTProcessor,
+    FakeProcessor,
+    LanguageModelProcessor,
+    RequestSettings,
+    openai,
+)
+from response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+# OpenAI accepts up to 50,000 requests per batch, smaller batches make progress visible sooner
+BATCH_SIZE = 1000
+
+
+def read_requests(csv_path, settings=None):
+    """
+    Reads the word list and renders one dialogue prompt per row.
+
+    Parameters:
+    - csv_path (str): CSV with the columns word, language, level, context and optionally formality.
+    - settings (dict): Processor settings shared by every row (preferred_language, translation_on, ...).
+
+    Returns:
+    - list: One dict per row with the row's settings, the word, its prompt and the max_tokens for the
+      dialogue.
+    """
+    settings = RequestSettings.from_dict(settings or {})
+    processor = LanguageModelProcessor("", "")
+
+    requests = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            word = (row.get("word") or "").strip()
+            if not word:
+                continue
+            row_settings = settings.replace(
+                practice_language=(row.get("language") or "").strip(),
+                learner_level=(row.get("level") or "").strip(),
+                conversation_context=(row.get("context") or "").strip(),
+                formality=(row.get("formality") or "").strip() or settings.formality,
+            )
+            requests.append(
+                {
+                    "word": word,
+                    "practice_language": row_settings.practice_language,
+                    "learner_level": row_settings.learner_level,
+                    "conversation_context": row_settings.conversation_context,
+                    "formality": row_settings.formality,
+                    "preferred_language": row_settings.preferred_language,
+                    "translation_on": row_settings.translation_on,
+                    "highlight_mistakes_on": row_settings.highlight_mistakes_on,
+                    "prompt": processor.create_convo_prompt(word, row_settings),
+                    "max_tokens": processor.expected_output_tokens(
+                        "generate_convo", settings=row_settings
+                    ),
+                }
+            )
+    return requests
+
+
+class OpenAIBatchBackend:
+    """
+    Submits chat completions through the OpenAI Batch API, which runs them within 24 hours at half the
+    price of live requests.
+
+    Parameters:
+    - api_key (str): OpenAI API key.
+    - model (str): Chat model to use.
+    - sampling_params (dict): Sampling parameters sent with every request.
+    """
+
+    provider = "openai"
+
+    def __init__(self, api_key, model=ChatGPTProcessor.model, sampling_params=None):
+        self.client = openai.OpenAI(api_key=api_key)
+        self.model = model
+        self.sampling_params = sampling_params or dict(ChatGPTProcessor.default_sampling_params)
+
+    def submit(self, requests):
+        """
+        Uploads requests as a batch input file and starts the batch.
+
+        Parameters:
+        - requests (list of dict): Each with an "id", a "prompt" and optionally "max_tokens".
+
+        Returns:
+        - str: The batch ID.
+        """
+        lines = []
+        for request in requests:
+            body = {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": request["prompt"]},
+                ],
+                **self.sampling_params,
+            }
+            if request.get("max_tokens"):
+                body["max_tokens"] = request["max_tokens"]
+            line = {"custom_id": request["id"], "method": "POST", "url": "/v1/chat/completions"}
+            lines.append(json.dumps({**line, "body": body}))
+        input_file = self.client.files.create(
+            file=("batch_input.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        """
+        Returns "completed", "failed" (the batch will never finish) or "pending".
+        """
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return "completed"
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "pending"
+
+    def results(self, batch_id):
+        """
+        Returns the responses of a completed batch as a dict of request ID -> text. Requests that failed
+        are left out.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        if not batch.output_file_id:
+            return results
+
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            response = output.get("response") or {}
+            if output.get("error") or response.get("status_code") != 200:
+                continue
+            results[output["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return results
+
+
+class LocalBatchBackend:
+    """
+    Stand-in for a provider's batch interface that answers with a local processor, so batch jobs can be
+    tried and tested without API keys, network access or cost.
+
+    Batches are kept as files in a directory, like a provider's batch files, so a job can be resumed from
+    another process. Every batch completes as soon as it is submitted.
+
+    Parameters:
+    - path (str): Directory for the batch files.
+    - processor (LanguageModelProcessor): Answers each prompt. Defaults to a FakeProcessor with no delay.
+    """
+
+    provider = "local"
+
+    def __init__(self, path, processor=None):
+        self.path = path
+        self.processor = processor or FakeProcessor(first_token_delay=0, delay=0)
+        self.model = self.processor.model
+        self.sampling_params = {}
+        os.makedirs(path, exist_ok=True)
+
+    def submit(self, requests):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        results = {}
+        for request in requests:
+            try:
+                results[request["id"]] = self.processor.generate_convo(request["prompt"], cache=False)
+            except Exception:
+                # Left out of the results, so it is resubmitted on the next run like a failed request of
+                # an OpenAI batch
+                logger.warning("Local batch request %s failed", request["id"], exc_info=True)
+
+        output_path = os.path.join(self.path, f"{batch_id}.json")
+        with open(output_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        os.replace(output_path + ".tmp", output_path)
+        return batch_id
+
+    def status(self, batch_id):
+        return "completed" if os.path.exists(os.path.join(self.path, f"{batch_id}.json")) else "failed"
+
+    def results(self, batch_id):
+        with open(os.path.join(self.path, f"{batch_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+
+class BatchJob:
+    """
+    Generates a dialogue for every request through a batch backend, appending the results to a JSONL
+    store and checkpointing the submitted batches in `<store>.checkpoint.json`.
+
+    Parameters:
+    - backend (OpenAIBatchBackend or LocalBatchBackend): Where the batches are sent.
+    - store_path (str): JSONL file the dialogues are appended to, one record per line.
+    - batch_size (int): Number of requests per batch.
+    - poll_interval (float): Seconds to wait between checks on pending batches.
+    """
+
+    def __init__(self, backend, store_path, batch_size=BATCH_SIZE, poll_interval=60):
+        self.backend = backend
+        self.store_path = store_path
+        self.checkpoint_path = store_path + ".checkpoint.json"
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def request_id(self, request):
+        # The same key the response cache uses, so a row that has not changed is never generated twice
+        return ResponseCache.make_key(
+            self.backend.provider, self.backend.model, request["prompt"], **self.backend.sampling_params
+        )
+
+    def run(self, requests):
+        """
+        Submits every request that is not in the store yet and waits for all pending batches to finish.
+
+        Returns:
+        - int: Number of requests still without a dialogue (failed requests are retried on the next run).
+        """
+        requests = {self.request_id(request): request for request in requests}
+        done = self.load_done()
+        checkpoint = self.load_checkpoint()
+        pending = {request_id for ids in checkpoint["batches"].values() for request_id in ids}
+
+        todo = [request_id for request_id in requests if request_id not in done | pending]
+        print(
+            f"{len(requests)} requests: {len(done & requests.keys())} done, {len(pending)} pending, "
+            f"{len(todo)} to submit"
+        )
+        for start in range(0, len(todo), self.batch_size):
+            ids = todo[start : start + self.batch_size]
+            batch = [dict(requests[request_id], id=request_id) for request_id in ids]
+            batch_id = self.backend.submit(batch)
+            checkpoint["batches"][batch_id] = ids
+            self.save_checkpoint(checkpoint)
+            print(f"Submitted {batch_id} with {len(ids)} requests")
+
+        while checkpoint["batches"]:
+            for batch_id, ids in list(checkpoint["batches"].items()):
+                status = self.backend.status(batch_id)
+                if status == "pending":
+                    continue
+                if status == "completed":
+                    results = self.backend.results(batch_id)
+                    self.append_results(
+                        (request_id, requests.get(request_id), response)
+                        for request_id, response in results.items()
+                    )
+                    done.update(results)
+                    print(f"Finished {batch_id}: {len(results)} of {len(ids)} requests succeeded")
+                else:
+                    print(f"Batch {batch_id} failed, its requests will be resubmitted on the next run")
+                del checkpoint["batches"][batch_id]
+                self.save_checkpoint(checkpoint)
+
+            if checkpoint["batches"]:
+                time.sleep(self.poll_interval)
+
+        return len(requests.keys() - done)
+
+    def load_done(self):
+        done = set()
+        if os.path.exists(self.store_path):
+            with open(self.store_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        done.add(json.loads(line)["id"])
+        return done
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"batches": {}}
+
+    def save_checkpoint(self, checkpoint):
+        with open(self.checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def append_results(self, results):
+        created = time.time()
+        with open(self.store_path, "a", encoding="utf-8") as f:
+            for request_id, request, response in results:
+                # A pending batch from an earlier run may hold rows that are no longer in the CSV
+                request = request or {}
+                record = {
+                    "id": request_id,
+                    "word": request.get("word"),
+                    "practice_language": request.get("practice_language"),
+                    "learner_level": request.get("learner_level"),
+                    "conversation_context": request.get("conversation_context"),
+                    "formality": request.get("formality"),
+                    "preferred_language": request.get("preferred_language"),
+                    "translation_on": request.get("translation_on"),
+                    "highlight_mistakes_on": request.get("highlight_mistakes_on"),
+                    "provider": self.backend.provider,
+                    "model": self.backend.model,
+                    "response": response,
+                    "created": created,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def export_parquet(store_path, parquet_path):
+    """
+    Writes the JSONL store out as a Parquet file.
+    """
+    import pandas as pd
+
+    pd.read_json(store_path, lines=True).to_parquet(parquet_path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate dialogues for a word list in bulk.")
+    parser.add_argument("csv_path", help="CSV with the columns word, language, level, context")
+    parser.add_argument("store_path", help="JSONL file the dialogues are appended to")
+    parser.add_argument("--backend", choices=["openai", "local"], default="openai")
+    parser.add_argument("--preferred-language", default="English")
+    parser.add_argument("--formality", default="Balanced")
+    parser.add_argument("--translation", action="store_true", help="Ask for a translation")
+    parser.add_argument("--mistakes", action="store_true", help="Ask for common mistakes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=60)
+    parser.add_argument("--parquet", help="Also export the store to this Parquet file once done")
+    args = parser.parse_args()
+
+    if args.backend == "openai":
+        backend = OpenAIBatchBackend(os.environ["OPENAI_API_KEY"])
+    else:
+        backend = LocalBatchBackend(args.store_path + ".batches")
+
+    requests = read_requests(
+        args.csv_path,
+        {
+            "preferred_language": args.preferred_language,
+            "formality": args.formality,
+            "translation_on": args.translation,
+            "highlight_mistakes_on": args.mistakes,
+        },
+    )
+    job = BatchJob(backend, args.store_path, args.batch_size, args.poll_interval)
+    remaining = job.run(requests)
+    if args.parquet:
+        export_parquet(args.store_path, args.parquet)
+    print(f"{remaining} requests without a dialogue")
+    sys.exit(1 if remaining else 0)
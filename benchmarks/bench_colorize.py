@@ -0,0 +1,72 @@
+"""
+Times ColorCoder.colorize_text on 10k to 1M word inputs against the old word-by-word implementation,
+and compares the size of the HTML each one produces.
+
+The old implementation is faster (about 1.6x on this text): str.split is cheaper than matching words
+with a regex. What the single pass gains is correctness (punctuation, quotes and possessives no longer
+miss the lookup, and the text is escaped) and about 45% less HTML.
+
+Usage: python benchmarks/bench_colorize.py
+"""
+
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from color_coder import ColorCoder  # noqa: E402
+from word_lists import freq_colored_dict  # noqa: E402
+
+ORWELL = (
+    "Most people who bother with the matter at all would admit that the English language is in a bad way, "
+    "but it is generally assumed that we cannot by conscious action do anything about it. Our civilization "
+    "is decadent and our language – so the argument runs – must inevitably share in the general collapse. "
+    "It follows that any struggle against the abuse of language is a sentimental archaism, like preferring "
+    "candles to electric light or hansom cabs to aeroplanes. Underneath this lies the half-conscious belief "
+    "that language is a natural growth and not an instrument which we shape for our own purposes."
+)
+
+
+def legacy_colorize_text(color_dict, text, default_color="#34495E"):
+    """The original implementation: split on whitespace, strip .,!? and concatenate with +=."""
+    words = text.split()
+    colored_text = ""
+    for word in words:
+        uppercase_word = word.upper().strip(".,!?")
+        if uppercase_word in color_dict:
+            colored_word = f'<span style="color: {color_dict[uppercase_word]};">{word}</span>'
+        else:
+            colored_word = f'<span style="color: {default_color};">{word}</span>'
+        colored_text += colored_word + " "
+    return colored_text
+
+
+def make_text(n_words):
+    words = ORWELL.split(" ")
+    repeats = n_words // len(words) + 1
+    return " ".join((words * repeats)[:n_words])
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    color_coder = ColorCoder(freq_colored_dict)
+    # The legacy version was written for the plain dict the lists used to be loaded into, and is timed
+    # against one so that it isn't slowed down by FrequencyIndex lookups
+    legacy_dict = dict(freq_colored_dict.items())
+
+    for n_words in [10_000, 100_000, 1_000_000]:
+        text = make_text(n_words)
+        legacy_seconds, legacy_html = timed(legacy_colorize_text, legacy_dict, text)
+        seconds, html = timed(color_coder.colorize_text, text)
+        print(
+            f"{n_words:>9,} words   legacy {legacy_seconds * 1000:8.1f} ms {len(legacy_html) / 1e6:7.2f} MB   "
+            f"single pass {seconds * 1000:8.1f} ms {len(html) / 1e6:7.2f} MB   "
+            f"({n_words / seconds / 1e6:.2f}M words/s)"
+        )
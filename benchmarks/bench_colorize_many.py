@@ -0,0 +1,51 @@
+"""
+Reports the throughput of ColorCoder.colorize_many and colorize_stream, in words per second, for a
+reading pack of articles colorized in this process and fanned out across worker processes.
+
+Usage: python benchmarks/bench_colorize_many.py [articles] [words_per_article]
+"""
+
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bench_colorize import make_text  # noqa: E402
+from color_coder import ColorCoder  # noqa: E402
+from word_lists import freq_colored_dict  # noqa: E402
+
+
+def report(name, n_words, fn):
+    start = time.perf_counter()
+    results = fn()
+    seconds = time.perf_counter() - start
+    print(f"{name:<28} {seconds:7.2f} s   {n_words / seconds / 1e6:6.2f}M words/s")
+    return results
+
+
+if __name__ == "__main__":
+    n_articles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    words_per_article = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    # Offset each article so they are not all identical
+    texts = [make_text(words_per_article + i % 7) for i in range(n_articles)]
+    n_words = sum(len(text.split()) for text in texts)
+    print(f"{n_articles} articles, {n_words:,} words, {os.cpu_count()} CPUs")
+
+    sequential = report(
+        "colorize_many (1 process)",
+        n_words,
+        lambda: ColorCoder(freq_colored_dict).colorize_many(texts, 1),
+    )
+    parallel = report(
+        f"colorize_many ({os.cpu_count()} processes)",
+        n_words,
+        lambda: ColorCoder(freq_colored_dict).colorize_many(texts, os.cpu_count()),
+    )
+    streamed = report(
+        f"colorize_stream ({os.cpu_count()} processes)",
+        n_words,
+        lambda: list(ColorCoder(freq_colored_dict).colorize_stream(iter(texts), os.cpu_count())),
+    )
+    assert sequential == parallel == streamed, "results differ or are out of order"
@@ -0,0 +1,103 @@
+"""
+Measures the cold start of each page with `python -X importtime` and fails if it regresses.
+
+Each page's top-level imports are run in a fresh interpreter. The report shows the cumulative import time
+of every module the page imports, and the script exits with an error if a page pulls in a module from
+LAZY_MODULES at import time or if the repo's own modules go over IMPORT_BUDGET_MS.
+
+Usage: python benchmarks/bench_import_time.py [runs]
+"""
+
+import ast
+import glob
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported once a code path needs them.
+LAZY_MODULES = ["openai", "google.generativeai"]
+
+# Budget for the modules in this repo, on top of streamlit and anything the page imports by itself.
+IMPORT_BUDGET_MS = 50
+
+# Pages that talk to a provider on every run and so are allowed to import its SDK up front.
+EAGER_PAGES = {}
+
+
+def page_imports(path):
+    """Returns the page's top-level import statements as source code."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in imports)
+
+
+def import_times(source):
+    """
+    Runs source in a fresh interpreter under -X importtime.
+
+    Returns:
+    - dict: Cumulative import time in microseconds for every module imported, keyed by module name.
+    - set: The modules imported directly by source rather than by another module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", source],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    top_level = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+        if not name.startswith("  "):  # Nested imports are indented under the module importing them
+            top_level.add(name.strip())
+    return times, top_level
+
+
+def local_modules():
+    return {
+        os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(REPO_DIR, "*.py"))
+    }
+
+
+def bench_page(path, runs):
+    name = os.path.basename(path)
+    source = page_imports(path)
+    own_modules = local_modules()
+
+    samples = [import_times(source) for _ in range(runs)]
+    total_ms = statistics.median(sum(t[m] for m in top) for t, top in samples) / 1000
+    own_ms = statistics.median(sum(t[m] for m in top if m in own_modules) for t, top in samples) / 1000
+    print(f"{name:<40} total {total_ms:8.1f} ms   repo modules {own_ms:6.1f} ms")
+
+    problems = []
+    allowed = EAGER_PAGES.get(name, [])
+    for module in LAZY_MODULES:
+        if module in samples[0][0] and module not in allowed:
+            problems.append(f"{name} imports {module} at start up")
+    if own_ms > IMPORT_BUDGET_MS:
+        problems.append(f"{name} repo modules took {own_ms:.1f} ms (budget {IMPORT_BUDGET_MS} ms)")
+    return problems
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    pages = [os.path.join(REPO_DIR, "Welcome.py")] + sorted(
+        glob.glob(os.path.join(REPO_DIR, "pages", "*.py"))
+    )
+
+    problems = []
+    for page in pages:
+        problems += bench_page(page, runs)
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,29 @@
+"""
+Times LexicalProfiler.profile on 10k to 1M word documents.
+
+Usage: python benchmarks/bench_lexical_profile.py
+"""
+
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bench_colorize import make_text  # noqa: E402
+from lexical_profile import LexicalProfiler  # noqa: E402
+
+if __name__ == "__main__":
+    profiler = LexicalProfiler()
+    profiler.profile("Load the word lists first.")
+
+    for n_words in [10_000, 100_000, 1_000_000]:
+        text = make_text(n_words)
+        start = time.perf_counter()
+        profile = profiler.profile(text)
+        seconds = time.perf_counter() - start
+        print(
+            f"{n_words:>9,} words   {seconds * 1000:8.1f} ms   ({n_words / seconds / 1e6:.2f}M words/s)   "
+            f"95% at {profile['coverage_95']}K, 98% at {profile['coverage_98']}K"
+        )
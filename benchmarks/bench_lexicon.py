@@ -0,0 +1,41 @@
+"""
+Compares word lookups through FrequencyIndex and the Lexicon arrays, which share the word -> position
+dict built when the index is first loaded, and times counting the bands of a long text.
+
+Usage: python benchmarks/bench_lexicon.py [n_words]
+"""
+
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bench_colorize import make_text  # noqa: E402
+from word_lists import FrequencyIndex, Lexicon  # noqa: E402
+
+
+def timed(name, n_words, fn):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    rate = f"   {n_words / seconds / 1e6:6.2f}M words/s" if n_words else ""
+    print(f"{name:<36} {seconds * 1000:8.1f} ms{rate}")
+    return result
+
+
+if __name__ == "__main__":
+    n_words = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    words = [word.strip(".,!?–").upper() for word in make_text(n_words).split()]
+
+    index = FrequencyIndex()
+    lexicon = Lexicon()
+    timed("load Lexicon", None, lambda: lexicon.band("A"))
+
+    timed("FrequencyIndex.band_id", n_words, lambda: [index.band_id(word) for word in words])
+    timed("FrequencyIndex.headword", n_words, lambda: [index.headword(word) for word in words])
+    timed("Lexicon.band", n_words, lambda: [lexicon.band(word) for word in words])
+    timed("Lexicon.headword", n_words, lambda: [lexicon.headword(word) for word in words])
+    counts = timed("Lexicon.band_counts", n_words, lambda: lexicon.band_counts(words))
+    print("words per band (0 = off-list):", counts.tolist())
@@ -0,0 +1,68 @@
+"""
+Times Streamlit reruns of each page with the AppTest harness: the first run of a new session, and the
+reruns that follow every widget change, which should do no more than draw the page again.
+
+No model is called (nothing is submitted), so no API keys or network are needed.
+
+Usage: python benchmarks/bench_rerun.py [reruns]
+"""
+
+import glob
+import os
+import statistics
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)
+
+import streamlit as st  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+# AppTest runs a page on its own, without the multipage app st.page_link needs to find Welcome.py
+st.page_link = lambda *args, **kwargs: None
+
+SESSIONS = 3
+
+
+def new_session(page):
+    at = AppTest.from_file(page, default_timeout=60)
+    at.secrets["GOOGLE_API_KEY"] = "benchmark"
+    at.secrets["OPENAI_API_KEY"] = "benchmark"
+    return at
+
+
+def timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return elapsed
+
+
+def main():
+    reruns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pages = sorted(glob.glob(os.path.join(REPO_DIR, "pages", "*.py")))
+
+    print(
+        f"{'page':40s} {'1st session':>12s} {'new session':>12s} {'rerun p50':>10s} {'rerun max':>10s}"
+    )
+    for page in pages:
+        session_times = []
+        rerun_times = []
+        for _ in range(SESSIONS):
+            at = new_session(page)
+            session_times.append(timed_run(at))
+            rerun_times.extend(timed_run(at) for _ in range(reruns))
+
+        print(
+            f"{os.path.basename(page):40s} {session_times[0] * 1000:10.1f}ms "
+            f"{statistics.median(session_times[1:]) * 1000:10.1f}ms "
+            f"{statistics.median(rerun_times) * 1000:8.1f}ms {max(rerun_times) * 1000:8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
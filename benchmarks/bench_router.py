@@ -0,0 +1,97 @@
+"""
+Load tests the Auto router against two local stand-in servers (local_llm_server.py): a fast one that
+fails a share of its requests and a slower reliable one, halfway through swapping their latencies.
+Prints where the router sent requests, how many failed and their median and p95 latency, next to always
+using either server.
+
+Usage: python benchmarks/bench_router.py [requests] [concurrency]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from genai_processor import AsyncLocalProcessor, RoutedProcessor, run_async  # noqa: E402
+from local_llm_server import serve  # noqa: E402
+from resilience import RetryPolicy  # noqa: E402
+
+PROMPT = "Dialogue: A: Hola, ¿qué tal? B: Muy bien, gracias."
+
+
+def start_server(latency, error_rate):
+    server = serve(port=0, latency=latency, delay=0.0, error_rate=error_rate, block=False)
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))] if values else float("nan")
+
+
+async def run(processor, requests, concurrency, on_halfway=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def request(i):
+        nonlocal failures
+        async with semaphore:
+            if i == requests // 2 and on_halfway is not None:
+                on_halfway()
+            start = time.perf_counter()
+            try:
+                await processor.generate_convo(PROMPT, cache=False)
+            except Exception:
+                failures += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(request(i) for i in range(requests)))
+    return latencies, failures
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    fast, fast_url = start_server(latency=0.05, error_rate=0.2)
+    slow, slow_url = start_server(latency=0.15, error_rate=0.0)
+
+    def swap_latencies():
+        fast.RequestHandlerClass.latency, slow.RequestHandlerClass.latency = 0.3, 0.05
+
+    def reset_latencies():
+        fast.RequestHandlerClass.latency, slow.RequestHandlerClass.latency = 0.05, 0.15
+
+    print(f"{requests} requests, {concurrency} at a time, the latencies swap halfway\n")
+    for name in ("always fast", "always slow", "auto"):
+        reset_latencies()
+        # New provider names, so each run starts without latency history or open circuit breakers
+        a = AsyncLocalProcessor(base_url=fast_url, provider=f"fast-{name}")
+        b = AsyncLocalProcessor(base_url=slow_url, provider=f"slow-{name}")
+        for processor in (a, b):
+            processor.retry_policy = RetryPolicy(base_delay=0.05)
+            processor.token_usage = deque()  # Every request, to count where they went
+        processor = {"always fast": a, "always slow": b}.get(name) or RoutedProcessor([a, b])
+
+        start = time.perf_counter()
+        latencies, failures = run_async(run(processor, requests, concurrency, swap_latencies))
+        total = time.perf_counter() - start
+        routed = f"fast {len(a.token_usage)}, slow {len(b.token_usage)}"
+        p50, p95 = percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000
+        print(
+            f"{name:12s} {total:6.2f}s  failed {failures:3d}  p50 {p50:6.0f} ms  p95 {p95:6.0f} ms"
+            f"  answered by {routed}"
+        )
+
+    fast.shutdown()
+    slow.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares the cold import time and resident memory of word_lists.py against the old module, which built
+freq_colored_dict from a ~1 MB dict literal. Memory is read from /proc, so it runs on Linux.
+
+Usage: python benchmarks/bench_word_lists.py [runs]
+"""
+
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from word_lists import BAND_COLORS, read_word_lists  # noqa: E402
+
+
+# Imports word_lists, does one lookup like the Comprehensible-izer, and reports seconds and the growth of
+# the resident set in KiB. VmRSS is read rather than ru_maxrss, which is a high-water mark carried over
+# from the parent process and so hides anything below it.
+PROBE = """
+import time
+
+def rss_kib():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+
+before = rss_kib()
+start = time.perf_counter()
+from word_lists import freq_colored_dict
+freq_colored_dict.get("ABILITY")
+elapsed = time.perf_counter() - start
+print(elapsed, rss_kib() - before)
+"""
+
+
+def write_legacy_module(directory):
+    """Writes the old single-line dict literal version of word_lists.py into directory."""
+    entries = {}
+    for word, band_id in read_word_lists():
+        entries.setdefault(word, BAND_COLORS[band_id])
+    with open(os.path.join(directory, "word_lists.py"), "w", encoding="utf-8") as f:
+        f.write("# BNC/COCA word family frequency lists\n\n")
+        f.write(f"freq_colored_dict = {entries!r}\n")
+
+
+def write_current_module(directory):
+    for name in ["word_lists.py", "word_lists.txt", "word_lists.idx"]:
+        shutil.copy(os.path.join(REPO_DIR, name), directory)
+
+
+def probe(directory):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=directory, capture_output=True, text=True, check=True
+    ).stdout
+    seconds, rss_kib = output.split()
+    return float(seconds), int(rss_kib)
+
+
+def bench(name, write_module, runs):
+    with tempfile.TemporaryDirectory() as directory:
+        write_module(directory)
+        cold_seconds, cold_rss = probe(directory)  # No __pycache__ yet, so this includes compiling
+        cached = [probe(directory) for _ in range(runs)]
+
+    cached_seconds = statistics.median(seconds for seconds, _ in cached)
+    cached_rss = statistics.median(rss for _, rss in cached)
+    print(
+        f"{name:<10} first import {cold_seconds * 1000:8.1f} ms  (+{cold_rss / 1024:5.1f} MiB)   "
+        f"cached import {cached_seconds * 1000:8.1f} ms  (+{cached_rss / 1024:5.1f} MiB)"
+    )
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    bench("dict", write_legacy_module, runs)
+    bench("mmap", write_current_module, runs)
@@ -0,0 +1,295 @@
+"""
+Local store of pre-generated Conversation Dictionary dialogues.
+
+Dialogues are keyed on the vocabulary word as entered (up to case and spacing), the practice language,
+the learner level, the formality, a normalised form of the context, and the extras asked for (the
+preferred language, translation and common mistakes). Other forms of a word are not
+shared: a dialogue for ABILITY uses that form and would not do for ABILITIES, let alone for UNABLE, which
+the word lists count in the same family. They are kept zlib-compressed in a SQLite table clustered on
+that key, so a lookup is a single index seek. A store written by an earlier version is upgraded when it
+is opened: dialogues keyed on the word are moved to the current key, others are kept in a table of their
+own, as they can't be.
+
+The store is filled by the page as it generates dialogues, and in bulk from the output of
+batch_dialogues.py:
+
+Usage: python dialogue_store.py import dialogues.jsonl [--store PATH]
+       python dialogue_store.py stats [--store PATH]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from genai_processor import RequestSettings, submit_async
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.environ.get(
+    "DIALOGUE_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dialogues.db")
+)
+
+# The columns a dialogue is stored under, then its variant number, text and creation time
+_KEY_COLUMNS = [
+    "word",
+    "practice_language",
+    "learner_level",
+    "formality",
+    "context",
+    "preferred_language",
+    "translation_on",
+    "highlight_mistakes_on",
+]
+_COLUMNS = _KEY_COLUMNS + ["variant", "dialogue", "created"]
+_MATCH_KEY = " AND ".join(f"{column} = ?" for column in _KEY_COLUMNS)
+
+# The columns of stores written before the extras were part of the key. The page only used the store
+# without extras then, so their dialogues are moved under the default ones
+_PLAIN_COLUMNS = _KEY_COLUMNS[:5] + ["variant", "dialogue", "created"]
+
+# Settings that change what a dialogue holds besides the dialogue itself
+_EXTRAS = ("preferred_language", "translation_on", "highlight_mistakes_on")
+
+# Words too common to tell two contexts apart ("at the restaurant" and "restaurant" are the same context)
+_CONTEXT_STOPWORDS = {"a", "an", "and", "at", "for", "in", "my", "of", "on", "the", "to", "with", "your"}
+
+
+def context_bucket(conversation_context):
+    """
+    Normalises a free-text context so that small differences in wording share dialogues.
+
+    Parameters:
+    - conversation_context (str): The context as entered, e.g. "Ordering food at a restaurant".
+
+    Returns:
+    - str: The distinct content words in alphabetical order, e.g. "food ordering restaurant".
+    """
+    words = re.findall(r"[^\W\d_]+", (conversation_context or "").lower())
+    return " ".join(sorted({word for word in words if word not in _CONTEXT_STOPWORDS}))
+
+
+class DialogueStore:
+    """
+    Pre-generated dialogues served before falling back to a live model call.
+
+    Parameters:
+    - path (str): SQLite file holding the dialogues.
+    - variants (int): Number of dialogues kept per key, a lookup returns one of them at random.
+    - max_age (float): Seconds after which a key's oldest dialogue is regenerated in the background.
+    """
+
+    def __init__(self, path=STORE_PATH, variants=3, max_age=30 * 24 * 3600):
+        self.path = path
+        self.variants = variants
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._refreshing = set()  # Keys with a background refresh in flight
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(dialogues)")]
+        if columns and columns != _COLUMNS:
+            self._upgrade(columns)
+        else:
+            self._create_table()
+            self._db.commit()
+
+    @staticmethod
+    def make_key(word, settings):
+        """
+        Returns the key a dialogue is stored under.
+
+        Parameters:
+        - word (str): The vocabulary word.
+        - settings (RequestSettings): The settings the dialogue is generated with.
+        """
+        return (
+            " ".join(word.split()).upper(),
+            settings.practice_language.strip().lower(),
+            settings.learner_level,
+            settings.formality,
+            context_bucket(settings.conversation_context),
+            settings.preferred_language.strip().lower(),
+            int(bool(settings.translation_on)),
+            int(bool(settings.highlight_mistakes_on)),
+        )
+
+    def get(self, word, settings):
+        """
+        Returns a stored dialogue for the request, or None if there is none yet.
+        """
+        key = self.make_key(word, settings)
+        with self._lock:
+            rows = self._db.execute(f"SELECT dialogue FROM dialogues WHERE {_MATCH_KEY}", key).fetchall()
+            if not rows:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(random.choice(rows)[0]).decode("utf-8")
+
+    def add(self, word, settings, dialogue):
+        """
+        Stores a dialogue, replacing the key's oldest one once it holds `variants` dialogues.
+        """
+        if not dialogue:
+            return
+        self._add(self.make_key(word, settings), dialogue)
+
+    def add_many(self, records):
+        """
+        Stores dialogues in bulk.
+
+        Parameters:
+        - records (iterable of dict): Each with the word, the response and the settings it was generated
+          with (practice_language, learner_level, formality, conversation_context, preferred_language,
+          translation_on and highlight_mistakes_on), like the lines written by batch_dialogues.py.
+          Records without the extras (from an older batch_dialogues.py) are skipped, it can't be told
+          whether their dialogues include them.
+
+        Returns:
+        - int: Number of dialogues stored.
+        """
+        count = 0
+        for record in records:
+            if not record.get("response") or not all(name in record for name in _EXTRAS):
+                continue
+            settings = RequestSettings(
+                practice_language=record.get("practice_language") or "",
+                learner_level=record.get("learner_level") or "",
+                formality=record.get("formality") or "",
+                conversation_context=record.get("conversation_context") or "",
+                preferred_language=record["preferred_language"] or "",
+                translation_on=bool(record["translation_on"]),
+                highlight_mistakes_on=bool(record["highlight_mistakes_on"]),
+            )
+            self._add(
+                self.make_key(record["word"], settings),
+                record["response"],
+                record.get("created"),
+                commit=False,
+            )
+            count += 1
+        with self._lock:
+            self._db.commit()
+        return count
+
+    def refresh(self, word, settings, generate):
+        """
+        Generates a new dialogue for the request in the background if its key holds fewer than `variants`
+        dialogues or its oldest one is older than max_age. Does nothing if a refresh of the key is
+        already running.
+
+        Parameters:
+        - generate (callable): Returns a coroutine that resolves to the new dialogue, or raises if it
+          can't be generated, which is logged. Run on the shared background event loop.
+        """
+        key = self.make_key(word, settings)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            count, oldest = self._db.execute(
+                f"SELECT COUNT(*), MIN(created) FROM dialogues WHERE {_MATCH_KEY}", key
+            ).fetchone()
+            if count >= self.variants and oldest > time.time() - self.max_age:
+                return
+            self._refreshing.add(key)
+
+        def store(future):
+            try:
+                if future.cancelled():
+                    return
+                if future.exception() is not None:
+                    logger.warning("Could not refresh the dialogue of %r: %r", word, future.exception())
+                    return
+                self._add(key, future.result())
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        submit_async(generate()).add_done_callback(store)
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            (keys,) = self._db.execute(
+                f"SELECT COUNT(*) FROM (SELECT DISTINCT {', '.join(_KEY_COLUMNS)} FROM dialogues)"
+            ).fetchone()
+            (dialogues,) = self._db.execute("SELECT COUNT(*) FROM dialogues").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "keys": keys,
+            "dialogues": dialogues,
+        }
+
+    def _create_table(self):
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dialogues ("
+            " word TEXT, practice_language TEXT, learner_level TEXT, formality TEXT, context TEXT,"
+            " preferred_language TEXT, translation_on INTEGER, highlight_mistakes_on INTEGER,"
+            f" variant INTEGER, dialogue BLOB, created REAL, PRIMARY KEY ({', '.join(_KEY_COLUMNS)},"
+            " variant)) WITHOUT ROWID"
+        )
+
+    def _upgrade(self, columns):
+        # A table written by an earlier version is moved aside, and its dialogues copied under the
+        # current key where they can be
+        old_table = f"dialogues_{time.strftime('%Y%m%d%H%M%S')}"
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(f"ALTER TABLE dialogues RENAME TO {old_table}")
+            self._create_table()
+            if columns != _PLAIN_COLUMNS:
+                logger.warning(
+                    "The dialogues in %s were stored under an older key that can't be moved to the "
+                    "current one, they are kept in the table %s",
+                    self.path,
+                    old_table,
+                )
+                return
+            # Only the default extras were stored under the plain key
+            count = self._db.execute(
+                f"INSERT INTO dialogues SELECT {', '.join(_KEY_COLUMNS[:5])}, 'english', 0, 0,"
+                f" variant, dialogue, created FROM {old_table}"
+            ).rowcount
+            self._db.execute(f"DROP TABLE {old_table}")
+        logger.warning("Moved %d dialogues in %s to the current key", count, self.path)
+
+    def _add(self, key, dialogue, created=None, commit=True):
+        if not dialogue:
+            return
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT variant FROM dialogues WHERE {_MATCH_KEY} ORDER BY created", key
+            ).fetchall()
+            variant = len(rows) if len(rows) < self.variants else rows[0][0]
+            self._db.execute(
+                f"INSERT OR REPLACE INTO dialogues VALUES ({', '.join('?' * len(_COLUMNS))})",
+                (*key, variant, zlib.compress(dialogue.encode("utf-8")), created or time.time()),
+            )
+            if commit:
+                self._db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the pre-generated dialogue store.")
+    parser.add_argument("command", choices=["import", "stats"])
+    parser.add_argument("jsonl_path", nargs="?", help="Dialogues written by batch_dialogues.py")
+    parser.add_argument("--store", default=STORE_PATH)
+    args = parser.parse_args()
+
+    store = DialogueStore(args.store)
+    if args.command == "import":
+        with open(args.jsonl_path, encoding="utf-8") as f:
+            count = store.add_many(json.loads(line) for line in f if line.strip())
+        print(f"Imported {count} dialogues into {args.store}")
+    stats = store.stats()
+    print(f"{stats['dialogues']} dialogues for {stats['keys']} keys in {args.store}")
@@ -1,163 +1,797 @@
-import openai
-import google.generativeai as gemini
-import streamlit as st
+import asyncio
+import concurrent.futures
+import hashlib
+import importlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field, fields, replace
 
+from prompt_templates import compile_template
+from rate_limiter import RateLimiter, current_session
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    RetryPolicy,
+    hedged,
+    hedged_stream,
+)
+from response_cache import ResponseCache
+from token_counter import token_counter
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    Stands in for a module and only imports it on first attribute access.
+
+    The provider SDKs take around a second to import, so pages that never call a model (or have not yet)
+    should not pay for them on every cold start.
+    """
+
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        if self._module is None:
+            object.__setattr__(self, "_module", importlib.import_module(self._name))
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+openai = LazyModule("openai")
+glm = LazyModule("google.ai.generativelanguage")
+httpx = LazyModule("httpx")
+
+# Connections kept open per client by the async processors
+MAX_CONNECTIONS = 20
+
+# API keys whose clients and rate limiters are kept. Learners can bring their own keys, so without a
+# limit a long-running process would keep one of each for every key it has ever seen.
+MAX_API_KEYS = 256
+
+
+def hash_api_key(api_key):
+    """
+    Returns a digest of an API key, so objects made per key are found without keeping the key itself
+    as a dict key.
+    """
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()
+
+
+class ApiKeyCache:
+    """
+    Thread-safe LRU of objects made per API key, such as clients and rate limiters, keyed on a hash of
+    the key.
+
+    Parameters:
+    - max_entries (int): Number of keys kept, the least recently used is dropped first.
+    """
+
+    def __init__(self, max_entries=MAX_API_KEYS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (scope, hash of the API key) -> object
+        self._lock = threading.Lock()
+
+    def get(self, api_key, scope=""):
+        """
+        Returns the object for api_key within scope (e.g. a provider), or None.
+        """
+        key = (scope, hash_api_key(api_key))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_or_create(self, api_key, create, scope=""):
+        """
+        Returns the object for api_key within scope, calling create() to make it if there is none.
+        """
+        entry = self.get(api_key, scope)
+        if entry is not None:
+            return entry
+        # Made outside the lock, since the first client imports its SDK
+        created = create()
+        key = (scope, hash_api_key(api_key))
+        with self._lock:
+            entry = self._entries.setdefault(key, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def gemini_request(model, prompt, generation_config=None):
+    """
+    Builds the GenerateContentRequest of a single-turn Gemini prompt.
+    """
+    request = glm.GenerateContentRequest(
+        model=f"models/{model}", contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])]
+    )
+    if generation_config:
+        request.generation_config = glm.GenerationConfig(generation_config)
+    return request
+
+
+def gemini_text(response):
+    """
+    Returns the text of a GenerateContentResponse (or one chunk of a stream).
+
+    Raises:
+    - ValueError: If the response has no candidate, e.g. because the prompt was blocked.
+    """
+    if not response.candidates:
+        raise ValueError(f"Gemini returned no response: {response.prompt_feedback}")
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def background_loop():
+    """
+    Returns the event loop shared by the async processors, started in a daemon thread on first use.
+
+    Streamlit runs each script in its own thread, so the async clients (and their pooled connections)
+    live on this one long-lived loop rather than on a new loop per rerun.
+    """
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            loop_thread = threading.Thread(target=_background_loop.run_forever, daemon=True)
+            loop_thread.start()
+    return _background_loop
+
+
+def submit_async(coro):
+    """
+    Schedules a coroutine on the background loop from any thread. The coroutine runs for the caller's
+    current_session, so its requests queue in the rate limiters as that session's.
+
+    Returns:
+    - concurrent.futures.Future: The future result of the coroutine.
+    """
+    wrapped = _in_session(coro, current_session.get())
+    future = asyncio.run_coroutine_threadsafe(wrapped, background_loop())
+    # So that cancel_async can find its task
+    future.coro = wrapped
+    return future
+
+
+async def _in_session(awaitable, session):
+    current_session.set(session)
+    return await awaitable
+
+
+def run_async(coro, timeout=None):
+    """
+    Runs a coroutine on the background loop and waits for its result.
+    """
+    return submit_async(coro).result(timeout)
+
+
+def cancel_async(future):
+    """
+    Cancels a future from submit_async and waits until its coroutine has stopped, rather than only until
+    the cancellation has been requested, e.g. so that the async generator it was advancing can be closed.
+    """
+    if future.cancel():
+        run_async(_stopped(future.coro))
+
+
+async def _stopped(coro):
+    # The task's cancellation was scheduled before this coroutine, so the task is cancelling or done
+    tasks = [task for task in asyncio.all_tasks() if task.get_coro() is coro]
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+def wait_async(future, on_wait=None, poll_interval=0.5):
+    """
+    Waits for the result of a future from submit_async, calling on_wait() every poll_interval seconds
+    until it is done (e.g. to show the session's place in the rate limiter's queue). If on_wait raises
+    (e.g. Streamlit stopping the script for a rerun), the future is cancelled and the error re-raised.
+    """
+    if on_wait is not None:
+        try:
+            while not concurrent.futures.wait([future], poll_interval).done:
+                on_wait()
+        except BaseException:
+            cancel_async(future)
+            raise
+    return future.result()
+
+
+def completed_async(futures, on_wait=None, poll_interval=0.5):
+    """
+    Yields futures from submit_async as they complete, like concurrent.futures.as_completed, calling
+    on_wait() every poll_interval seconds in which none does. If on_wait raises, the futures still pending
+    are cancelled and the error re-raised.
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(
+            pending, poll_interval if on_wait else None, concurrent.futures.FIRST_COMPLETED
+        )
+        if not done:
+            try:
+                on_wait()
+            except BaseException:
+                for future in pending:
+                    cancel_async(future)
+                raise
+        yield from done
+
+
+def iter_async(async_iterator, on_wait=None, poll_interval=0.5):
+    """
+    Iterates an async generator (e.g. AsyncChatGPTProcessor.stream_convo) from synchronous code, calling
+    on_wait() every poll_interval seconds while waiting for the next item. If on_wait raises, the item it
+    was waiting for is cancelled before the generator is closed, and the error re-raised.
+    """
+    try:
+        while True:
+            try:
+                yield wait_async(submit_async(async_iterator.__anext__()), on_wait, poll_interval)
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(async_iterator.aclose())
+
+
+class PromptTooLongError(ValueError):
+    """
+    Raised before a request is sent when its prompt leaves too little of the context window for a
+    response.
+    """
+
+
+def error_message(error):
+    """
+    Returns what to tell a learner about a request that failed with error.
+
+    Parameters:
+    - error (Exception): Raised by a processor, e.g. PromptTooLongError, CircuitOpenError, TimeoutError
+      or the provider's own error.
+    """
+    if isinstance(error, PromptTooLongError):
+        return f"The prompt is too long for this model. {error}."
+    if isinstance(error, CircuitOpenError):
+        return f"The model is not answering at the moment, {error}."
+    if isinstance(error, TimeoutError):
+        return "The model took too long to answer, try again in a moment."
+    return f"The model could not answer ({type(error).__name__}: {error}). It may be busy, try again in a moment."
+
+
+@dataclass(frozen=True)
+class RequestSettings:
+    """
+    A learner's settings, passed with each request to the processor methods that use them. They are
+    frozen and never stored on a processor, so one processor can serve many sessions at once, each
+    request with its own settings and API key.
+
+    Parameters:
+    - custom_api_key (str): The learner's own API key, used instead of the processor's.
+    """
+
+    conversation_context: str = ""
+    formality: str = "Balanced"
+    preferred_language: str = "English"
+    translation_on: bool = False
+    highlight_mistakes_on: bool = False
+    practice_language: str = ""
+    learner_level: str = ""
+    llm_choice: str = ""
+    custom_api_key: str = field(default="", repr=False)
+
+    @classmethod
+    def from_dict(cls, settings_dict):
+        """
+        Settings from a dict of setting name -> value, ignoring other keys and None values.
+        """
+        names = {setting.name for setting in fields(cls)}
+        return cls(**{k: v for k, v in settings_dict.items() if k in names and v is not None})
+
+    def replace(self, **changes):
+        return replace(self, **changes)
 
 
 class LanguageModelProcessor:
+    provider = ""
+    model = ""
+
+    # Tokens of prompt and response the model takes, and the most it will write
+    context_window = 4096
+    max_output_tokens = 4096
+
+    # A prompt must leave at least this many tokens of the context window for the response
+    min_output_tokens = 100
+
+    # Expected response sizes in tokens: a dialogue of 100-150 words in the practice language with its
+    # scenario, plus the optional translation and common mistakes. Simplified text gets up to twice the
+    # size of its prompt.
+    convo_tokens = 500
+    translation_tokens = 400
+    mistakes_tokens = 300
+
+    # Shared by every processor in the process. Set LLM_CACHE_PATH to also keep responses on disk.
+    response_cache = ResponseCache(path=os.environ.get("LLM_CACHE_PATH"))
+
+    # Timeouts and retries of every request sent to a model, see resilience.py
+    retry_policy = RetryPolicy()
+
+    # Client-side rate limits per API key, set below the provider's so bursts wait in the queue of
+    # rate_limiter.py rather than fail with 429s
+    requests_per_minute = 60
+    tokens_per_minute = 40_000
+
+    # provider -> CircuitBreaker and LatencyTracker, shared by every processor in the process
+    _circuit_breakers = {}
+    _latencies = {}
+    # (provider, API key) -> RateLimiter, whose queue is only touched from the background loop
+    _rate_limiters = ApiKeyCache()
+
     def __init__(self, google_api_key, openai_api_key):
         self.google_api_key = google_api_key
         self.openai_api_key = openai_api_key
-        self.settings = {
-            "conversation_context": "",
-            "formality": "Balanced",
-            "preferred_language": "English",
-            "translation_on": False,
-            "highlight_mistakes_on": False,
-            "practice_language": "",
-            "learner_level": "",
-            "llm_choice": "",
-            "custom_api_key": "",
-        }
+        # Settings of requests made without any, see set_settings
+        self.settings = RequestSettings()
+        # Time to first token and total time of recent streamed requests, newest last
+        self.request_timings = deque(maxlen=50)
+        # Token counts of recent requests sent to the model (not served from the cache), newest last
+        self.token_usage = deque(maxlen=200)
+
+    def set_settings(self, settings_dict):
+        """
+        Changes the settings used by requests made without settings of their own, for a processor with a
+        single user such as a script. A processor shared between sessions should be given each
+        session's RequestSettings with every request instead.
+        """
+        self.settings = RequestSettings.from_dict({**asdict(self.settings), **settings_dict})
 
+    def request_settings(self, settings=None):
+        """
+        Returns the settings of a request: settings, or the processor's own if None.
+        """
+        return self.settings if settings is None else settings
 
+    def record_stream(self, request, deltas, timing=None):
+        """
+        Passes streamed text deltas through unchanged, recording how long the first one took to arrive
+        and how long the whole response took in self.request_timings.
 
-    def set_settings(self, settings_dict):
-        for key, value in settings_dict.items():
-            if key in self.settings:
-                self.settings[key] = value
-        
-        self.google_api_key = (
-            self.settings["custom_api_key"] if self.settings["custom_api_key"] else self.google_api_key
-        )
-        self.openai_api_key = (
-            self.settings["custom_api_key"] if self.settings["custom_api_key"] else self.openai_api_key
-        )
-
-
-    def create_convo_prompt(self, vocab):
-        preferred_language = self.settings["preferred_language"]
-        translation_on = self.settings["translation_on"]
-        highlight_mistakes_on = self.settings["highlight_mistakes_on"]
-        practice_language = self.settings["practice_language"]
-        learner_level = self.settings["learner_level"]
-        conversation_context = self.settings["conversation_context"]
-        formality = self.settings["formality"]
-
-        translation_request = (
-            f"Proivde a translation into the learner's preferred language ({preferred_language}). Emphasize clarity and accuracy in your translation. Where relevant, include brief annotations or explanations to highlight cultural or contextual nuances. These insights should elucidate expressions, idioms, or cultural references that may not directly translate but are crucial for understanding the dialogue's deeper meanings and implications."
-            if translation_on
-            else "Provide the dialogue with no translations. Focus on ensuring the dialogue is engaging and educational within the parameters set, allowing the learner to immerse fully in the practice language without direct translation. This approach encourages deeper language intuition and context-based understanding."
-        )
-        mistakes_request = (
-            f"Identify common errors learners might commit when using the vocabulary word '{vocab}'. Illuminate these mistakes by providing a brief explanation of why they are incorrect. Enhance this learning moment by crafting 2-3 model sentences that demonstrate the correct usage of '{vocab}'. These sentences should not only rectify the identified mistakes but also serve as clear examples for learners to emulate, helping them to internalize the correct application of the word in various contexts."
-            if highlight_mistakes_on
-            else ""
+        Parameters:
+        - request (str): Name of the request, e.g. "simplify_text".
+        - deltas (iterable of str): The text deltas from the provider.
+        - timing (dict): Filled in with the times as well, so a caller can read its own while other
+          sessions stream through the same processor.
+        """
+        timing = timing if timing is not None else {}
+        timing.update({"request": request, "time_to_first_token": None, "total_time": None})
+        self.request_timings.append(timing)
+        start = time.perf_counter()
+
+        for delta in deltas:
+            if timing["time_to_first_token"] is None:
+                timing["time_to_first_token"] = time.perf_counter() - start
+            yield delta
+
+        timing["total_time"] = time.perf_counter() - start
+
+    @property
+    def circuit_breaker(self):
+        breaker = self._circuit_breakers.get(self.provider)
+        if breaker is None:
+            breaker = self._circuit_breakers.setdefault(self.provider, CircuitBreaker(self.provider))
+        return breaker
+
+    @property
+    def latency(self):
+        """
+        Recent latencies and failures of requests sent to this provider.
+        """
+        tracker = self._latencies.get(self.provider)
+        if tracker is None:
+            tracker = self._latencies.setdefault(self.provider, LatencyTracker())
+        return tracker
+
+    def api_key(self, settings=None):
+        """
+        The API key a request with these settings is sent with: the learner's own, or the processor's.
+        """
+        return None
+
+    def rate_limiter(self, api_key):
+        """
+        The RateLimiter for requests to this processor's provider with api_key.
+        """
+        return self._rate_limiters.get_or_create(
+            api_key,
+            lambda: RateLimiter(self.provider, self.requests_per_minute, self.tokens_per_minute),
+            self.provider,
+        )
+
+    def queue_position(self, settings=None):
+        """
+        Returns how many other sessions are ahead of the current session in the rate limiter's queue, or
+        None if none of its requests are waiting there.
+        """
+        limiter = self._rate_limiters.get(self.api_key(settings), self.provider)
+        return limiter.position(current_session.get()) if limiter is not None else None
+
+    def request_tokens(self, prompt, sampling_params):
+        """
+        Tokens a request counts against tokens_per_minute: its prompt and the most it may generate, as
+        the providers count them.
+        """
+        max_tokens = sampling_params.get("max_tokens") or self.expected_output_tokens("generate_convo")
+        return self.count_tokens(prompt) + max_tokens
+
+    def count_tokens(self, text):
+        """
+        Counts the tokens of text for this processor's provider and model, see token_counter.py.
+        """
+        return token_counter(self.provider, self.model).count(text)
+
+    def expected_output_tokens(self, request, prompt="", settings=None):
+        """
+        Returns the expected size of the response to a request in tokens.
+
+        Parameters:
+        - request (str): "generate_convo", sized from the settings, or "simplify_text", sized from the
+          prompt.
+        - prompt (str): The prompt of the request.
+        - settings (RequestSettings): The settings of the request.
+        """
+        if request == "simplify_text":
+            return max(self.min_output_tokens, 2 * self.count_tokens(prompt))
+
+        settings = self.request_settings(settings)
+        tokens = self.convo_tokens
+        if settings.translation_on:
+            tokens += self.translation_tokens
+        if settings.highlight_mistakes_on:
+            tokens += self.mistakes_tokens
+        return tokens
+
+    def fit_max_tokens(self, prompt, max_tokens=None, request="generate_convo", settings=None):
+        """
+        Returns the max_tokens to send with a prompt: max_tokens (or the expected size of the response if
+        None), capped by max_output_tokens and by what the prompt leaves of the context window.
+
+        Raises:
+        - PromptTooLongError: If the prompt leaves fewer than min_output_tokens for the response.
+        """
+        if max_tokens is None:
+            max_tokens = self.expected_output_tokens(request, prompt, settings)
+        prompt_tokens = self.count_tokens(prompt)
+        room = self.context_window - prompt_tokens
+        if room < self.min_output_tokens:
+            raise PromptTooLongError(
+                f"The prompt is about {prompt_tokens:,} tokens, {self.model} takes at most "
+                f"{self.context_window - self.min_output_tokens:,}"
+            )
+        return min(max_tokens, self.max_output_tokens, room)
+
+    def record_usage(self, prompt, response, sampling_params, total_time):
+        """
+        Records the token counts and time of a request sent to the model in self.token_usage, and logs
+        them.
+        """
+        self.latency.add(total_time)
+        usage = {
+            "provider": self.provider,
+            "model": self.model,
+            "prompt_tokens": self.count_tokens(prompt),
+            "completion_tokens": self.count_tokens(response or ""),
+            "max_tokens": sampling_params.get("max_tokens"),
+            "total_time": total_time,
+        }
+        self.token_usage.append(usage)
+        logger.info(
+            "%s %s request: %d prompt tokens, %d completion tokens in %.2fs",
+            usage["provider"],
+            usage["model"],
+            usage["prompt_tokens"],
+            usage["completion_tokens"],
+            total_time,
         )
 
-        prompt = f"""
-        "Create a dialogue in {practice_language}, tailored specifically to the CEFR level {learner_level}. Your objective is to seamlessly incorporate the target vocabulary word '{vocab}' into a conversation that is relevant to the given theme or context, '{conversation_context}'. Please adhere to the following guidelines to ensure a high-quality learning experience:
+    def cached_completion(
+        self, prompt, complete, cache=True, variants=1, api_key=None, **sampling_params
+    ):
+        """
+        Returns the cached response to this request, or calls complete() and caches what it returns.
+
+        Parameters:
+        - prompt (str): The prompt sent to the model.
+        - complete (callable): Makes the request and returns the response text. Retried according to
+          retry_policy.
+        - cache (bool): False always calls complete() and leaves the cache untouched.
+        - variants (int): Number of different responses to collect for this request before reusing them.
+        - api_key (str): The key the request is sent with, which picks its rate limiter.
+        - sampling_params: The sampling parameters of the request, which are part of the cache key.
+        """
+        if cache:
+            key = ResponseCache.make_key(self.provider, self.model, prompt, **sampling_params)
+            response = self.response_cache.get(key, variants)
+            if response is not None:
+                return response
+
+        run_async(self.rate_limiter(api_key).acquire(self.request_tokens(prompt, sampling_params)))
+        start = time.perf_counter()
+        try:
+            response = self.retry_policy.call_sync(complete, self.circuit_breaker)
+        except Exception as e:
+            self.latency.add_error()
+            logger.warning("%s request failed: %r", self.provider, e)
+            raise
+        self.record_usage(prompt, response, sampling_params, time.perf_counter() - start)
+        if cache:
+            self.response_cache.add(key, response, variants)
+        return response
+
+    def cached_stream(self, prompt, stream, cache=True, variants=1, api_key=None, **sampling_params):
+        """
+        Streaming version of cached_completion. A cached response is yielded as a single delta, otherwise
+        the deltas from stream() are passed through and cached once the response is complete.
+        """
+        if cache:
+            key = ResponseCache.make_key(self.provider, self.model, prompt, **sampling_params)
+            response = self.response_cache.get(key, variants)
+            if response is not None:
+                yield response
+                return
+
+        run_async(self.rate_limiter(api_key).acquire(self.request_tokens(prompt, sampling_params)))
+        start = time.perf_counter()
+        deltas = []
+        try:
+            for delta in stream():
+                deltas.append(delta)
+                yield delta
+        except Exception as e:
+            self.latency.add_error()
+            logger.warning("%s stream failed: %r", self.provider, e)
+            raise
+        response = "".join(deltas)
+        self.record_usage(prompt, response, sampling_params, time.perf_counter() - start)
+        if cache:
+            self.response_cache.add(key, response, variants)
+
+    # The dialogue prompt is a preamble that only depends on the settings, so it is the same for every
+    # word (and can be cached by providers that cache prompt prefixes), followed by a short per-word tail.
+    convo_preamble_template = """Create a dialogue in {practice_language}, tailored specifically to the CEFR level {learner_level}. Your objective is to seamlessly incorporate the target vocabulary word given at the end into a conversation that is relevant to the given theme or context, '{conversation_context}'. Please adhere to the following guidelines to ensure a high-quality learning experience:
 
-        Scenario Introduction: Begin with a concise description of the scenario in the learner's preferred language, '{preferred_language}'. This description should be engaging and clear, setting the stage for the dialogue. Briefly outline the setting, characters involved, and the situation they are in, making sure it aligns with the theme/context '{conversation_context}'.
+Scenario Introduction: Begin with a concise description of the scenario in the learner's preferred language, '{preferred_language}'. This description should be engaging and clear, setting the stage for the dialogue. Briefly outline the setting, characters involved, and the situation they are in, making sure it aligns with the theme/context.
 
-        Dialogue Construction:
+Dialogue Construction:
+Compose 3-5 exchanges between characters, ensuring the dialogue is realistic and relevant to the learners' experiences.
+Integrate the target vocabulary word naturally into the conversation. Use the word in different forms or contexts if possible to show its versatility.
+Adjust the dialogue to the CEFR level, considering sentence complexity, vocabulary, and grammatical structures appropriate for that level.
+Formality Register: Ensure the dialogue reflects the requested level of formality ('{formality}'). This could range from informal, using colloquial language and contractions, to formal, employing polite forms, professional terminology, and complete sentences.
 
-        Compose 3-5 exchanges between characters in {practice_language}, ensuring the dialogue is realistic and relevant to the learners' experiences.
-        Integrate the target vocabulary word '{vocab}' naturally into the conversation. Use the word in different forms or contexts if possible to show its versatility.
-        Adjust the dialogue to match the specified {practice_language} CEFR level '{learner_level}', considering sentence complexity, vocabulary, and grammatical structures appropriate for that level.
-        Formality Register: Ensure the dialogue reflects the requested level of formality ('{formality}'). This could range from informal, using colloquial language and contractions, to formal, employing polite forms, professional terminology, and complete sentences.
+Dialogue Length and Complexity: Aim for a total word count of approximately 100-150 words for the entire dialogue. This ensures enough {practice_language} content for educational value without overwhelming the learner. Sentences should vary in length and complexity according to the CEFR level.
 
-        Dialogue Length and Complexity: Aim for a total word count of approximately 100-150 words for the entire dialogue. This ensures enough {practice_language} content for educational value without overwhelming the learner. Sentences should vary in length and complexity according to the CEFR level specified.
+Ensure that your {practice_language} dialogue is not only a learning tool but also a means for reflection and deeper engagement with the language. The goal is to make each dialogue a stepping stone towards fluency, providing learners with practical language skills they can apply in real-world situations.
+
+{translation_request}
+"""
+    convo_tail_template = """{mistakes_request}
+Target vocabulary word: '{vocab}'
+"""
+    translation_template = "Proivde a translation into the learner's preferred language ({preferred_language}). Emphasize clarity and accuracy in your translation. Where relevant, include brief annotations or explanations to highlight cultural or contextual nuances. These insights should elucidate expressions, idioms, or cultural references that may not directly translate but are crucial for understanding the dialogue's deeper meanings and implications."
+    no_translation_template = "Provide the dialogue with no translations. Focus on ensuring the dialogue is engaging and educational within the parameters set, allowing the learner to immerse fully in the practice language without direct translation. This approach encourages deeper language intuition and context-based understanding."
+    mistakes_template = "Identify common errors learners might commit when using the vocabulary word '{vocab}'. Illuminate these mistakes by providing a brief explanation of why they are incorrect. Enhance this learning moment by crafting 2-3 model sentences that demonstrate the correct usage of '{vocab}'. These sentences should not only rectify the identified mistakes but also serve as clear examples for learners to emulate, helping them to internalize the correct application of the word in various contexts.\n"
+
+    # Placeholders that dialogue templates, including the ones users write, can use
+    convo_fields = (
+        "practice_language",
+        "learner_level",
+        "conversation_context",
+        "formality",
+        "preferred_language",
+        "vocab",
+        "mistakes_request",
+        "translation_request",
+    )
+
+    def convo_values(self, vocab, settings=None):
+        """
+        Returns the value of every convo_fields placeholder for a word with the settings.
+        """
+        settings = self.request_settings(settings)
+        values = {name: getattr(settings, name, "") for name in self.convo_fields}
+        values["vocab"] = vocab
+        values["translation_request"] = compile_template(
+            self.translation_template if settings.translation_on else self.no_translation_template
+        ).render(values)
+        values["mistakes_request"] = (
+            compile_template(self.mistakes_template).render(values)
+            if settings.highlight_mistakes_on
+            else ""
+        )
+        return values
 
-        Ensure that your {practice_language} dialogue is not only a learning tool but also a means for reflection and deeper engagement with the language. The goal is to make each dialogue a stepping stone towards fluency, providing learners with practical language skills they can apply in real-world situations.
+    def create_convo_preamble(self, settings=None):
+        """
+        The part of the dialogue prompt shared by every word with the settings.
+        """
+        return compile_template(self.convo_preamble_template, self.convo_fields).render(
+            self.convo_values("", settings)
+        )
 
-        {mistakes_request}
+    def create_convo_prompt(self, vocab, settings=None):
+        values = self.convo_values(vocab, settings)
+        preamble = compile_template(self.convo_preamble_template, self.convo_fields).render(values)
+        tail = compile_template(self.convo_tail_template, self.convo_fields).render(values)
+        return preamble + "\n" + tail
 
-        {translation_request}
+    def render_user_template(self, template, vocab, settings=None):
         """
+        Fills in a dialogue template written by the user.
 
-        return prompt
+        Parameters:
+        - template (str): The template, which can use the convo_fields placeholders.
+        - vocab (str): The vocabulary word.
+        - settings (RequestSettings): The settings of the request.
 
+        Raises:
+        - prompt_templates.TemplateError: If the template can't be parsed or uses other placeholders.
+        """
+        return compile_template(template, self.convo_fields).render(self.convo_values(vocab, settings))
 
-    def create_compre_prompt(self, text):
-        learner_level = self.settings["learner_level"]
-        practice_language = self.settings["practice_language"]
-        # Tailor the prompt based on the learner level
-        level_prompt = {
-            "A1 Beginner": "very simple English",
-            "A2 Pre-intermediate": "simple English",
-            "B1 Intermediate": "moderately simple English",
-            "B2 Upper-Intermediate": "intermediate English",
-            "C1 Advanced": "advanced English",
-            "C2 Mastery": "highly advanced English",
-        }.get(
-            learner_level
-        ) 
+    # Tailor the simplification prompts based on the learner level
+    compre_levels = {
+        "A1 Beginner": "very simple English",
+        "A2 Pre-intermediate": "simple English",
+        "B1 Intermediate": "moderately simple English",
+        "B2 Upper-Intermediate": "intermediate English",
+        "C1 Advanced": "advanced English",
+        "C2 Mastery": "highly advanced English",
+    }
+    compre_template = (
+        "Simplify this text into {level_prompt} for {practice_language} language learners: {text}"
+    )
+    compre_passage_template = (
+        "Simplify this passage into {level_prompt} for {practice_language} language learners. "
+        "Keep its meaning and reply with only the simplified passage.\n"
+        "Context: {context}\n"
+        "Passage: {passage}"
+    )
 
-        prompt = f"Simplify this text into {level_prompt} for {practice_language} language learners: {text}"
+    def create_compre_prompt(self, text, settings=None):
+        settings = self.request_settings(settings)
+        return compile_template(self.compre_template).render(
+            {
+                "level_prompt": self.compre_levels.get(settings.learner_level),
+                "practice_language": settings.practice_language,
+                "text": text,
+            }
+        )
 
-        return prompt
+    def create_compre_passage_prompt(self, passage, context="", settings=None):
+        """
+        Prompt to simplify one passage (a few sentences) of a longer text, which is simplified a passage
+        at a time.
 
+        Parameters:
+        - passage (str): The sentences to simplify.
+        - context (str): The passage with the sentences around it, so the rewrite fits the text.
+        - settings (RequestSettings): The settings of the request.
+        """
+        settings = self.request_settings(settings)
+        return compile_template(self.compre_passage_template).render(
+            {
+                "level_prompt": self.compre_levels.get(settings.learner_level),
+                "practice_language": settings.practice_language,
+                "passage": passage,
+                "context": context,
+            }
+        )
 
 
 class ChatGPTProcessor(LanguageModelProcessor):
-    def __init__(self, google_api_key, openai_api_key):
-        super().__init__(google_api_key, openai_api_key)
-        openai.api_key = self.openai_api_key
+    provider = "openai"
+    model = "gpt-3.5-turbo"
+    context_window = 16385
+    max_output_tokens = 4096
+    requests_per_minute = 3000
+    tokens_per_minute = 50_000
+    # max_tokens is set per request by fit_max_tokens
+    default_sampling_params = dict(
+        temperature=0.7, top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0
+    )
 
+    # API key -> openai.OpenAI, shared by every ChatGPTProcessor in the process
+    _clients = ApiKeyCache()
+
+    def api_key(self, settings=None):
+        return self.request_settings(settings).custom_api_key or self.openai_api_key
+
+    def client(self, api_key):
+        """
+        The client for an API key, rather than the global one of the openai module, which every session
+        would share.
+        """
+        # Retries are left to retry_policy
+        return self._clients.get_or_create(
+            api_key, lambda: openai.OpenAI(api_key=api_key, max_retries=0)
+        )
 
     def generate_convo(
-        self, 
+        self,
         prompt,
         temperature=0.7,
-        max_tokens=100,
+        max_tokens=None,
         top_p=1.0,
         frequency_penalty=0.0,
         presence_penalty=0.0,
-        ):
+        cache=True,
+        variants=1,
+        settings=None,
+    ):
         """
         Uses ChatGPT to generate a response.
 
         Parameters:
         - text (str): The text to be simplified.
         - temperature (float): Controls randomness in the output.
-        - max_tokens (int): The maximum number of tokens to generate.
+        - max_tokens (int): The maximum number of tokens to generate, None for the expected size of the
+          response (see fit_max_tokens).
         - top_p (float): Nucleus sampling parameter alternative to temprature.
         - frequency_penalty (float): Number between -2.0 and 2.0. Positive values penalize new tokens based on their existing frequency in the text so far, decreasing the model's likelihood to repeat the same line verbatim.
         - presence_penalty (float): Number between -2.0 and 2.0. Positive values penalize new tokens based on whether they appear in the text so far, increasing the model's likelihood to talk about new topics.
+        - cache (bool): Reuse the response to an identical earlier request.
+        - variants (int): Number of different responses to collect for this request before reusing them.
+        - settings (RequestSettings): The learner's settings, None for the processor's.
 
         Returns:
         - str: The simplified text.
-        """
-
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-            )
-
-            return response.choices[0].message.content
-        
-        except Exception as e:
-            print(f"Error in generating conversation: {e}")
 
+        Raises:
+        - PromptTooLongError, CircuitOpenError, TimeoutError or the provider's error, if the request fails.
+        """
+        api_key = self.api_key(settings)
+        sampling_params = dict(
+            temperature=temperature,
+            max_tokens=self.fit_max_tokens(prompt, max_tokens, "generate_convo", settings),
+            top_p=top_p,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+        )
+        complete = lambda: self._complete(prompt, api_key, **sampling_params)  # noqa: E731
+        return self.cached_completion(prompt, complete, cache, variants, api_key, **sampling_params)
 
     def simplify_text(
         self,
         prompt,
         temperature=0.7,
-        max_tokens=100,
+        max_tokens=None,
         top_p=1.0,
         frequency_penalty=0.0,
         presence_penalty=0.0,
+        cache=True,
+        variants=1,
+        settings=None,
     ):
         """
         Uses ChatGPT to simplify the given text to make it more comprehensible for English language learners, taking into account the learner's proficiency level.
@@ -166,58 +800,752 @@ class ChatGPTProcessor(LanguageModelProcessor):
         - text (str): The text to be simplified.
         - learner_level (str): The proficiency level of the learner (e.g., "A1 Beginner", "B2 Upper-Intermediate").
         - temperature (float): Controls randomness in the output.
-        - max_tokens (int): The maximum number of tokens to generate.
+        - max_tokens (int): The maximum number of tokens to generate, None for the expected size of the
+          response (see fit_max_tokens).
         - top_p (float): Nucleus sampling parameter alternative to temprature.
         - frequency_penalty (float): Number between -2.0 and 2.0. Positive values penalize new tokens based on their existing frequency in the text so far, decreasing the model's likelihood to repeat the same line verbatim.
         - presence_penalty (float): Number between -2.0 and 2.0. Positive values penalize new tokens based on whether they appear in the text so far, increasing the model's likelihood to talk about new topics.
+        - cache (bool): Reuse the response to an identical earlier request.
+        - variants (int): Number of different responses to collect for this request before reusing them.
+        - settings (RequestSettings): The learner's settings, None for the processor's.
 
         Returns:
         - str: The simplified text.
+
+        Raises:
+        - PromptTooLongError, CircuitOpenError, TimeoutError or the provider's error, if the request fails.
         """
+        api_key = self.api_key(settings)
+        sampling_params = dict(
+            temperature=temperature,
+            max_tokens=self.fit_max_tokens(prompt, max_tokens, "simplify_text", settings),
+            top_p=top_p,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+        )
+        complete = lambda: self._complete(prompt, api_key, **sampling_params)  # noqa: E731
+        return self.cached_completion(prompt, complete, cache, variants, api_key, **sampling_params)
 
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-            )
-            return response.choices[0].message.content
-        
-        except Exception as e:
-            print(f"Error in simplifying text: {e}")
+    def stream_convo(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        """
+        Streaming version of generate_convo, yields the text of the dialogue as it is generated.
+
+        Takes the same parameters as generate_convo, raises PromptTooLongError straight away and other
+        errors as they end the stream.
+        """
+        api_key = self.api_key(settings)
+        sampling_params = {**self.default_sampling_params, **sampling_params}
+        sampling_params["max_tokens"] = self.fit_max_tokens(
+            prompt, sampling_params.get("max_tokens"), "generate_convo", settings
+        )
+        stream = lambda: self._stream(prompt, api_key, **sampling_params)  # noqa: E731
+        deltas = self.cached_stream(prompt, stream, cache, variants, api_key, **sampling_params)
+        return self.record_stream("generate_convo", deltas)
+
+    def stream_simplify_text(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        """
+        Streaming version of simplify_text, yields the simplified text as it is generated.
+
+        Takes the same parameters as simplify_text, raises PromptTooLongError straight away and other
+        errors as they end the stream.
+        """
+        api_key = self.api_key(settings)
+        sampling_params = {**self.default_sampling_params, **sampling_params}
+        sampling_params["max_tokens"] = self.fit_max_tokens(
+            prompt, sampling_params.get("max_tokens"), "simplify_text", settings
+        )
+        stream = lambda: self._stream(prompt, api_key, **sampling_params)  # noqa: E731
+        deltas = self.cached_stream(prompt, stream, cache, variants, api_key, **sampling_params)
+        return self.record_stream("simplify_text", deltas)
+
+    def _complete(self, prompt, api_key, **sampling_params):
+        response = self.client(api_key).chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            timeout=self.retry_policy.timeout,
+            **sampling_params,
+        )
+        return response.choices[0].message.content
+
+    def _stream(self, prompt, api_key, **sampling_params):
+        stream = self.client(api_key).chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            stream=True,
+            timeout=self.retry_policy.timeout,
+            **sampling_params,
+        )
+
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 
 class GeminiProcessor(LanguageModelProcessor):
-    def __init__(self, google_api_key, openai_api_key):
-        super().__init__(google_api_key, openai_api_key)
-        gemini.configure(api_key=self.google_api_key)
+    provider = "gemini"
+    model = "gemini-pro"
+    context_window = 30720
+    max_output_tokens = 2048
+    requests_per_minute = 60
+    tokens_per_minute = 30_000
 
+    # API key -> glm.GenerativeServiceClient, shared by every GeminiProcessor in the process
+    _clients = ApiKeyCache()
 
-    def generate_convo(self, prompt):
-        model = gemini.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
+    def api_key(self, settings=None):
+        return self.request_settings(settings).custom_api_key or self.google_api_key
 
-        return response.text
+    def client(self, api_key):
+        """
+        The client for an API key, rather than the one set up by google.generativeai.configure, which
+        is global to the process.
+        """
+        return self._clients.get_or_create(
+            api_key, lambda: glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        )
 
+    def generate_convo(self, prompt, cache=True, variants=1, settings=None):
+        api_key = self.api_key(settings)
+        complete = lambda: self._complete(prompt, api_key)  # noqa: E731
+        return self.cached_completion(prompt, complete, cache, variants, api_key)
 
     def clean_response(self, text):
-        text = text.replace("*", "").replace("_", "").replace(":", " :").replace(";", " ;")  # Escape potential formatting
+        # Escape potential formatting
+        text = text.replace("*", "").replace("_", "").replace(":", " :").replace(";", " ;")
         return text
 
-
     def simplify_text(
         self,
         prompt,
+        cache=True,
+        variants=1,
+        settings=None,
     ):
-        model = gemini.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
-        cleaned_response = self.clean_response(response.text)
+        api_key = self.api_key(settings)
+        complete = lambda: self._complete(prompt, api_key)  # noqa: E731
+        response = self.cached_completion(prompt, complete, cache, variants, api_key)
+        cleaned_response = self.clean_response(response)
 
         return cleaned_response
+
+    def stream_convo(self, prompt, cache=True, variants=1, settings=None):
+        """
+        Streaming version of generate_convo, yields the text of the dialogue as it is generated.
+        """
+        api_key = self.api_key(settings)
+        stream = lambda: self._stream(prompt, api_key)  # noqa: E731
+        deltas = self.cached_stream(prompt, stream, cache, variants, api_key)
+        return self.record_stream("generate_convo", deltas)
+
+    def stream_simplify_text(self, prompt, cache=True, variants=1, settings=None):
+        """
+        Streaming version of simplify_text, yields the cleaned simplified text as it is generated.
+        """
+        api_key = self.api_key(settings)
+        deltas = self.cached_stream(
+            prompt, lambda: self._stream(prompt, api_key), cache, variants, api_key
+        )
+        return self.record_stream("simplify_text", (self.clean_response(delta) for delta in deltas))
+
+    def _complete(self, prompt, api_key):
+        response = self.client(api_key).generate_content(
+            request=gemini_request(self.model, prompt), timeout=self.retry_policy.timeout
+        )
+
+        return gemini_text(response)
+
+    def _stream(self, prompt, api_key):
+        response = self.client(api_key).stream_generate_content(
+            request=gemini_request(self.model, prompt), timeout=self.retry_policy.timeout
+        )
+        for chunk in response:
+            yield gemini_text(chunk)
+
+
+class AsyncLanguageModelProcessor(LanguageModelProcessor):
+    """
+    Base class of the asyncio processors. Each one holds a single long-lived client with a connection
+    pool for its provider and API key, so it should be created once per key (e.g. with st.cache_resource)
+    and shared by every session. Run its coroutines on the shared loop with run_async, submit_async or
+    iter_async.
+
+    Requests first wait in the rate limiter of their provider and API key, taking turns with other
+    sessions, then at most max_concurrency requests per provider are in flight at once, across every
+    processor and session in the process.
+
+    A provider's subclass implements _complete(prompt, api_key, **sampling_params), which returns the
+    response, and _stream(...), which yields its deltas. A request that fails raises its error (after the
+    retries of retry_policy) and logs it, rather than returning None.
+    """
+
+    max_concurrency = 8
+
+    # Sampling parameters of every request unless it gives its own, max_tokens is set by fit_max_tokens
+    default_sampling_params = {}
+
+    # provider -> asyncio.Semaphore, only touched from the background loop
+    _provider_semaphores = {}
+
+    @property
+    def provider_semaphore(self):
+        semaphore = self._provider_semaphores.get(self.provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._provider_semaphores[self.provider] = semaphore
+        return semaphore
+
+    async def cached_completion_async(
+        self, prompt, complete, cache=True, variants=1, api_key=None, **sampling_params
+    ):
+        """
+        Async version of cached_completion, complete() returns an awaitable.
+        """
+        if cache:
+            key = ResponseCache.make_key(self.provider, self.model, prompt, **sampling_params)
+            response = self.response_cache.get(key, variants)
+            if response is not None:
+                return response
+
+        await self.rate_limiter(api_key).acquire(self.request_tokens(prompt, sampling_params))
+        async with self.provider_semaphore:
+            start = time.perf_counter()
+            try:
+                response = await self.retry_policy.call(complete, self.circuit_breaker)
+            except Exception as e:
+                self.latency.add_error()
+                logger.warning("%s request failed: %r", self.provider, e)
+                raise
+            except BaseException:
+                # Including a request cancelled before it answered (e.g. it lost a hedge), or a provider
+                # that never answers would never be judged
+                self.latency.add_error()
+                raise
+        self.record_usage(prompt, response, sampling_params, time.perf_counter() - start)
+        if cache:
+            self.response_cache.add(key, response, variants)
+        return response
+
+    async def cached_stream_async(
+        self, prompt, stream, cache=True, variants=1, api_key=None, **sampling_params
+    ):
+        """
+        Async version of cached_stream, stream() returns an async iterator.
+        """
+        if cache:
+            key = ResponseCache.make_key(self.provider, self.model, prompt, **sampling_params)
+            response = self.response_cache.get(key, variants)
+            if response is not None:
+                yield response
+                return
+
+        await self.rate_limiter(api_key).acquire(self.request_tokens(prompt, sampling_params))
+        deltas = []
+        async with self.provider_semaphore:
+            start = time.perf_counter()
+            try:
+                async for delta in self.retry_policy.stream(stream, self.circuit_breaker):
+                    deltas.append(delta)
+                    yield delta
+            except Exception as e:
+                self.latency.add_error()
+                logger.warning("%s stream failed: %r", self.provider, e)
+                raise
+            except BaseException:
+                # Cancelled or closed before its first delta (e.g. it lost a hedge), see
+                # cached_completion_async. A reader leaving in the middle of a stream says nothing.
+                if not deltas:
+                    self.latency.add_error()
+                raise
+        response = "".join(deltas)
+        self.record_usage(prompt, response, sampling_params, time.perf_counter() - start)
+        if cache:
+            self.response_cache.add(key, response, variants)
+
+    def clean_response(self, text):
+        """
+        Returns simplified text as it is shown, for providers whose responses need tidying up.
+        """
+        return text
+
+    async def generate_convo(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        """
+        Async version of ChatGPTProcessor.generate_convo, takes the same parameters.
+
+        Raises:
+        - PromptTooLongError, CircuitOpenError, TimeoutError or the provider's error, if the request fails.
+        """
+        return await self._send("generate_convo", prompt, cache, variants, settings, sampling_params)
+
+    async def simplify_text(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        """
+        Async version of ChatGPTProcessor.simplify_text, takes the same parameters and raises the same
+        errors as generate_convo.
+        """
+        response = await self._send("simplify_text", prompt, cache, variants, settings, sampling_params)
+        return self.clean_response(response)
+
+    async def stream_convo(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        """
+        Async version of ChatGPTProcessor.stream_convo, yields the dialogue as it is generated.
+        """
+        deltas = self._send_stream("generate_convo", prompt, cache, variants, settings, sampling_params)
+        async for delta in deltas:
+            yield delta
+
+    async def stream_simplify_text(
+        self, prompt, cache=True, variants=1, settings=None, **sampling_params
+    ):
+        """
+        Async version of ChatGPTProcessor.stream_simplify_text, yields the text as it is generated.
+        """
+        deltas = self._send_stream("simplify_text", prompt, cache, variants, settings, sampling_params)
+        async for delta in deltas:
+            yield self.clean_response(delta)
+
+    def _prepare(self, request, prompt, settings, sampling_params):
+        # The API key and sampling parameters of a request, raises PromptTooLongError
+        sampling_params = {**self.default_sampling_params, **sampling_params}
+        sampling_params["max_tokens"] = self.fit_max_tokens(
+            prompt, sampling_params.get("max_tokens"), request, settings
+        )
+        return self.api_key(settings), sampling_params
+
+    async def _send(self, request, prompt, cache, variants, settings, sampling_params):
+        api_key, sampling_params = self._prepare(request, prompt, settings, sampling_params)
+        complete = lambda: self._complete(prompt, api_key, **sampling_params)  # noqa: E731
+        return await self.cached_completion_async(
+            prompt, complete, cache, variants, api_key, **sampling_params
+        )
+
+    def _send_stream(self, request, prompt, cache, variants, settings, sampling_params):
+        api_key, sampling_params = self._prepare(request, prompt, settings, sampling_params)
+        stream = lambda: self._stream(prompt, api_key, **sampling_params)  # noqa: E731
+        return self.cached_stream_async(prompt, stream, cache, variants, api_key, **sampling_params)
+
+
+class AsyncChatGPTProcessor(AsyncLanguageModelProcessor):
+    provider = ChatGPTProcessor.provider
+    model = ChatGPTProcessor.model
+    context_window = ChatGPTProcessor.context_window
+    max_output_tokens = ChatGPTProcessor.max_output_tokens
+    requests_per_minute = ChatGPTProcessor.requests_per_minute
+    tokens_per_minute = ChatGPTProcessor.tokens_per_minute
+    api_key = ChatGPTProcessor.api_key
+    default_sampling_params = ChatGPTProcessor.default_sampling_params
+    # None for OpenAI's API, or the URL of another server with the same API
+    base_url = None
+
+    def __init__(self, google_api_key, openai_api_key):
+        super().__init__(google_api_key, openai_api_key)
+        # API key -> openai.AsyncOpenAI, each with its own pool of connections
+        self._clients = ApiKeyCache()
+
+    def client(self, api_key):
+        return self._clients.get_or_create(
+            api_key,
+            lambda: openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=self.base_url,
+                max_retries=0,  # Retries are left to retry_policy
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS
+                    )
+                ),
+            ),
+        )
+
+    async def _complete(self, prompt, api_key, **sampling_params):
+        response = await self.client(api_key).chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            **sampling_params,
+        )
+        return response.choices[0].message.content
+
+    async def _stream(self, prompt, api_key, **sampling_params):
+        stream = await self.client(api_key).chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            stream=True,
+            **sampling_params,
+        )
+
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class AsyncLocalProcessor(AsyncChatGPTProcessor):
+    """
+    AsyncChatGPTProcessor for a local server with OpenAI's chat completions API, such as the stand-in in
+    local_llm_server.py, for trying the pages offline and load testing them without spending on a
+    provider. Its URL is taken from LOCAL_LLM_URL.
+
+    Parameters:
+    - base_url (str): Overrides LOCAL_LLM_URL.
+    - provider (str): Overrides the provider name, under which the server's latency, rate limit and
+      circuit breaker are tracked, e.g. to run two local servers side by side.
+    """
+
+    provider = "local"
+    model = "local"
+    requests_per_minute = 1_000_000
+    tokens_per_minute = 1_000_000_000
+
+    def __init__(self, google_api_key="", openai_api_key="", base_url=None, provider=None):
+        super().__init__(google_api_key, openai_api_key)
+        self.base_url = base_url or os.environ.get("LOCAL_LLM_URL", "http://127.0.0.1:8000/v1")
+        if provider is not None:
+            self.provider = provider
+
+    def api_key(self, settings=None):
+        # The server doesn't check it, but the client needs one
+        return "local"
+
+
+class AsyncGeminiProcessor(AsyncLanguageModelProcessor):
+    provider = GeminiProcessor.provider
+    model = GeminiProcessor.model
+    context_window = GeminiProcessor.context_window
+    max_output_tokens = GeminiProcessor.max_output_tokens
+    requests_per_minute = GeminiProcessor.requests_per_minute
+    tokens_per_minute = GeminiProcessor.tokens_per_minute
+    api_key = GeminiProcessor.api_key
+    clean_response = GeminiProcessor.clean_response
+
+    def __init__(self, google_api_key, openai_api_key):
+        super().__init__(google_api_key, openai_api_key)
+        self._clients = ApiKeyCache()  # API key -> glm.GenerativeServiceAsyncClient
+
+    def client(self, api_key):
+        # Its own client for the API key instead of the one set up by google.generativeai.configure,
+        # which is global to the process
+        return self._clients.get_or_create(
+            api_key, lambda: glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+        )
+
+    @staticmethod
+    def generation_config(sampling_params):
+        # Gemini calls max_tokens max_output_tokens, the other names are the same
+        config = dict(sampling_params)
+        if "max_tokens" in config:
+            config["max_output_tokens"] = config.pop("max_tokens")
+        return config or None
+
+    async def _complete(self, prompt, api_key, **sampling_params):
+        response = await self.client(api_key).generate_content(
+            request=gemini_request(self.model, prompt, self.generation_config(sampling_params))
+        )
+        return gemini_text(response)
+
+    async def _stream(self, prompt, api_key, **sampling_params):
+        response = await self.client(api_key).stream_generate_content(
+            request=gemini_request(self.model, prompt, self.generation_config(sampling_params))
+        )
+        async for chunk in response:
+            yield gemini_text(chunk)
+
+
+class HedgedProcessor:
+    """
+    Sends each request to a primary processor and, if it hasn't answered within the time that `percentile`
+    of its recent requests took (or fails sooner), to a secondary processor as well, using whichever
+    answers first. Streams are hedged the same way until their first words. If both fail, the error of
+    the one that failed last is raised.
+
+    Everything else (count_tokens, fit_max_tokens, ...) is the primary's.
+
+    Parameters:
+    - primary, secondary (AsyncLanguageModelProcessor): E.g. processors for two providers.
+    - percentile (float): Share of the primary's recent requests that finish before the hedge is sent.
+    - default_delay (float): Seconds before the hedge is sent while the primary has too few recent
+      requests for a percentile, defaults to HedgedProcessor.default_delay.
+    - hedge (bool): False only sends a request to the secondary once the primary has failed it.
+    """
+
+    default_delay = 10.0
+
+    def __init__(self, primary, secondary, percentile=0.95, default_delay=None, hedge=True):
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        if default_delay is not None:
+            self.default_delay = default_delay
+        self.hedge = hedge
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def hedge_delay(self):
+        if not self.hedge:
+            return None
+        delay = self.primary.latency.percentile(self.percentile)
+        return delay if delay is not None else self.default_delay
+
+    async def generate_convo(self, prompt, **kwargs):
+        return await hedged(
+            lambda: self.primary.generate_convo(prompt, **kwargs),
+            lambda: self.secondary.generate_convo(prompt, **kwargs),
+            self.hedge_delay(),
+        )
+
+    async def simplify_text(self, prompt, **kwargs):
+        return await hedged(
+            lambda: self.primary.simplify_text(prompt, **kwargs),
+            lambda: self.secondary.simplify_text(prompt, **kwargs),
+            self.hedge_delay(),
+        )
+
+    async def stream_convo(self, prompt, **kwargs):
+        async for delta in self._stream_with_fallback("stream_convo", prompt, kwargs):
+            yield delta
+
+    async def stream_simplify_text(self, prompt, **kwargs):
+        async for delta in self._stream_with_fallback("stream_simplify_text", prompt, kwargs):
+            yield delta
+
+    async def _stream_with_fallback(self, method, prompt, kwargs):
+        deltas = hedged_stream(
+            lambda: getattr(self.primary, method)(prompt, **kwargs),
+            lambda: getattr(self.secondary, method)(prompt, **kwargs),
+            self.hedge_delay(),
+        )
+        async for delta in deltas:
+            yield delta
+
+
+class RoutedProcessor:
+    """
+    Sends each request to whichever of several processors should answer it soonest: the median latency
+    of its recent requests divided by the share of them that succeeded. Processors whose circuit breaker
+    is open go last, and so do those failing more than max_error_rate of their recent requests (a
+    request cancelled because another processor answered it first counts as failed). Processors with too
+    few recent requests to judge come after the healthy ones that can be judged, and a share of requests
+    (`explore`) goes to another processor, so those get judged and the numbers of the ones not chosen
+    stay current.
+
+    A request the chosen processor fails is sent to the next best one and so on (see HedgedProcessor),
+    and so is one it is slow to answer with hedge. A processor with too few recent requests to judge is
+    always hedged, as soon as the next one would usually have answered.
+
+    Parameters:
+    - processors (list of AsyncLanguageModelProcessor): E.g. one per provider.
+    - hedge (bool): Also send slow requests to the next best processor.
+    - explore (float): Share of requests sent to a random processor other than the best.
+    - max_error_rate (float): Share of failed recent requests above which a processor is unhealthy.
+    """
+
+    def __init__(self, processors, hedge=False, explore=0.05, max_error_rate=0.5):
+        self.processors = list(processors)
+        self.hedge = hedge
+        self.explore = explore
+        self.max_error_rate = max_error_rate
+
+    def __getattr__(self, name):
+        return getattr(self.processors[0], name)
+
+    def ranked(self):
+        """
+        Returns the processors, the one to send the next request to first.
+        """
+
+        def rank(processor):
+            median = processor.latency.percentile(0.5)
+            error_rate = processor.latency.error_rate()
+            unhealthy = processor.circuit_breaker.state == "open" or error_rate > self.max_error_rate
+            expected = median / max(1 - error_rate, 0.01) if median is not None else 0.0
+            return (unhealthy, median is None, expected)
+
+        ranked = sorted(self.processors, key=rank)
+        if len(ranked) > 1 and random.random() < self.explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def route(self):
+        """
+        Returns the processor for the next request, falling back on the others in order.
+        """
+        ranked = self.ranked()
+        processor = ranked[-1]
+        for better in reversed(ranked[:-1]):
+            # A processor without enough recent requests to judge may be down, so it is always hedged,
+            # and given only as long as the next one usually takes rather than the default delay
+            hedge = self.hedge or better.latency.percentile(0.5) is None
+            default_delay = processor.latency.percentile(0.95)
+            processor = HedgedProcessor(better, processor, hedge=hedge, default_delay=default_delay)
+        return processor
+
+    def fit_max_tokens(self, prompt, max_tokens=None, request="generate_convo", settings=None):
+        """
+        The smallest max_tokens of the processors the prompt fits, see LanguageModelProcessor.
+        """
+        fits = []
+        error = None
+        for processor in self.processors:
+            try:
+                fits.append(processor.fit_max_tokens(prompt, max_tokens, request, settings))
+            except PromptTooLongError as e:
+                error = e
+        if not fits:
+            raise error
+        return min(fits)
+
+    def queue_position(self, settings=None):
+        positions = [processor.queue_position(settings) for processor in self.processors]
+        return min((position for position in positions if position is not None), default=None)
+
+    async def generate_convo(self, prompt, **kwargs):
+        return await self.route().generate_convo(prompt, **kwargs)
+
+    async def simplify_text(self, prompt, **kwargs):
+        return await self.route().simplify_text(prompt, **kwargs)
+
+    async def stream_convo(self, prompt, **kwargs):
+        async for delta in self.route().stream_convo(prompt, **kwargs):
+            yield delta
+
+    async def stream_simplify_text(self, prompt, **kwargs):
+        async for delta in self.route().stream_simplify_text(prompt, **kwargs):
+            yield delta
+
+
+class FakeProcessor(LanguageModelProcessor):
+    """
+    Offline stand-in for a provider that streams back a canned response word by word, so the pages and
+    the streaming code can be tried without API keys or network access.
+
+    Parameters:
+    - response (str): The text to respond with. Defaults to echoing the prompt.
+    - first_token_delay (float): Seconds to wait before the first word, like a provider's latency.
+    - delay (float): Seconds to wait between words.
+    """
+
+    provider = "fake"
+    model = "fake"
+    context_window = 1_000_000
+    max_output_tokens = 1_000_000
+    requests_per_minute = 1_000_000
+    tokens_per_minute = 1_000_000_000
+
+    def __init__(
+        self, google_api_key="", openai_api_key="", response=None, first_token_delay=0.2, delay=0.02
+    ):
+        super().__init__(google_api_key, openai_api_key)
+        self.response = response
+        self.first_token_delay = first_token_delay
+        self.delay = delay
+
+    def generate_convo(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        return self.cached_completion(
+            prompt, lambda: "".join(self._stream(prompt)), cache, variants, **sampling_params
+        )
+
+    def simplify_text(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        return self.cached_completion(
+            prompt, lambda: "".join(self._stream(prompt)), cache, variants, **sampling_params
+        )
+
+    def stream_convo(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        stream = lambda: self._stream(prompt)  # noqa: E731
+        deltas = self.cached_stream(prompt, stream, cache, variants, **sampling_params)
+        return self.record_stream("generate_convo", deltas)
+
+    def stream_simplify_text(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        stream = lambda: self._stream(prompt)  # noqa: E731
+        deltas = self.cached_stream(prompt, stream, cache, variants, **sampling_params)
+        return self.record_stream("simplify_text", deltas)
+
+    def _stream(self, prompt):
+        text = self.response if self.response is not None else prompt
+        time.sleep(self.first_token_delay)
+        for i, word in enumerate(re.findall(r"\s*\S+\s*", text)):
+            if i:
+                time.sleep(self.delay)
+            yield word
+
+
+class AsyncFakeProcessor(AsyncChatGPTProcessor):
+    """
+    Async version of FakeProcessor, a stand-in for the async processors the pages use. Only the provider
+    is fake: requests go through the same rate limiter, retries, circuit breaker, latency tracking and
+    response cache as a real provider's, so the pages, HedgedProcessor and RoutedProcessor can be tested
+    against it.
+
+    Parameters:
+    - response (str): The text to respond with. Defaults to echoing the prompt.
+    - first_token_delay (float): Seconds to wait before the first word, like a provider's latency.
+    - delay (float): Seconds to wait between words.
+    - provider (str): Overrides the provider name, under which its latency, rate limit and circuit
+      breaker are tracked, e.g. to route between two fakes.
+    """
+
+    provider = "fake"
+    model = "fake"
+    context_window = FakeProcessor.context_window
+    max_output_tokens = FakeProcessor.max_output_tokens
+    requests_per_minute = FakeProcessor.requests_per_minute
+    tokens_per_minute = FakeProcessor.tokens_per_minute
+
+    def __init__(
+        self,
+        google_api_key="",
+        openai_api_key="",
+        response=None,
+        first_token_delay=0.2,
+        delay=0.02,
+        provider=None,
+    ):
+        super().__init__(google_api_key, openai_api_key)
+        self.response = response
+        self.first_token_delay = first_token_delay
+        self.delay = delay
+        if provider is not None:
+            self.provider = provider
+
+    def api_key(self, settings=None):
+        return "fake"
+
+    async def _complete(self, prompt, api_key, **sampling_params):
+        return "".join([delta async for delta in self._stream(prompt, api_key)])
+
+    async def _stream(self, prompt, api_key, **sampling_params):
+        text = self.response if self.response is not None else prompt
+        await asyncio.sleep(self.first_token_delay)
+        for i, word in enumerate(re.findall(r"\s*\S+\s*", text)):
+            if i:
+                await asyncio.sleep(self.delay)
+            yield word
+
+
+# The models offered in the pages: label -> async processor class, taking the Google and OpenAI API keys
+PROVIDERS = {
+    "Google Gemini-Pro": AsyncGeminiProcessor,
+    "OpenAI GPT-3.5 Turbo": AsyncChatGPTProcessor,
+}
+
+# Offered as well, routes each request to one of PROVIDERS (see RoutedProcessor)
+AUTO_PROVIDER = "Auto"
+
+
+def register_provider(label, processor_class):
+    """
+    Offers another model in the pages, e.g. an AsyncLanguageModelProcessor for a new provider.
+    """
+    PROVIDERS[label] = processor_class
+
+
+if os.environ.get("LOCAL_LLM_URL"):
+    register_provider("Local stand-in", AsyncLocalProcessor)
@@ -0,0 +1,228 @@
+"""
+Local store of Art Gallery images.
+
+Each image is generated once and kept on disk under a key hashed from its style, prompt, model and size
+(and variant, for several images of one prompt), so a gallery never depends on the provider's image
+URLs, which expire, and a description that was already painted is shown again without paying for a new
+image. The most recently used images are also kept in memory, so reruns that show the same gallery
+again don't read the files each time.
+
+Both tiers are capped in bytes and evict the least recently used images first.
+
+Usage: python image_store.py stats [--store PATH]
+       python image_store.py clear [--store PATH]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+STORE_PATH = os.environ.get(
+    "IMAGE_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artwork")
+)
+
+
+class ImageStore:
+    """
+    Images on disk with an index in SQLite, and an LRU of the most recently used in memory.
+
+    Parameters:
+    - path (str): Directory holding the images and their index.
+    - max_bytes (int): Size of the images kept on disk, the least recently used are deleted first.
+    - max_memory_bytes (int): Size of the images kept in memory.
+    """
+
+    def __init__(self, path=STORE_PATH, max_bytes=500 * 2**20, max_memory_bytes=32 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()  # key -> image bytes, least recently used first
+        self._memory_bytes = 0
+        # key -> time of its last use from memory, written to the index before evicting so that images
+        # shown from memory aren't taken for unused ones
+        self._used = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " key TEXT PRIMARY KEY, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(style, prompt, model, size, variant=0):
+        """
+        Hashes an image request into a key. Case and whitespace in the prompt are normalised, so two
+        learners typing the same description share an image.
+
+        Parameters:
+        - style (str): The style of the painting, e.g. "Baroque".
+        - prompt (str): The description the image is generated from.
+        - model (str): The image model, e.g. "dall-e-2".
+        - size (str): The size of the image, e.g. "256x256".
+        - variant (int): Which of several images of the same request.
+        """
+        request = {
+            "style": style,
+            "prompt": " ".join(prompt.lower().split()),
+            "model": model,
+            "size": size,
+            "variant": variant,
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def file_path(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.png")
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._memory:
+                return True
+            return self._db.execute("SELECT 1 FROM images WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key):
+        """
+        Returns the image stored under key as bytes, or None if there is none.
+        """
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self._used[key] = time.time()
+                self.hits += 1
+                return image
+
+            row = self._db.execute("SELECT 1 FROM images WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                try:
+                    with open(self.file_path(key), "rb") as f:
+                        image = f.read()
+                except OSError:
+                    # Deleted by hand or by another process
+                    self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+                    self._db.commit()
+            if image is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE images SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._used.pop(key, None)
+            self._remember(key, image)
+            self.hits += 1
+            self.disk_hits += 1
+            return image
+
+    def add(self, key, image):
+        """
+        Stores an image (bytes) under key, deleting the least recently used images once the store is
+        over max_bytes.
+        """
+        if not image:
+            return
+
+        file_path = self.file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Written under another name first, so a reader never sees half an image
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(image)
+        os.replace(temp_path, file_path)
+
+        with self._lock:
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", (key, len(image), now, now)
+            )
+            self._used.pop(key, None)
+            self._evict()
+            self._db.commit()
+            self._remember(key, image)
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            images, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "images": images,
+                "bytes": size,
+                "memory_images": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            for (key,) in self._db.execute("SELECT key FROM images").fetchall():
+                self._delete_file(key)
+            self._db.execute("DELETE FROM images")
+            self._db.commit()
+            self._memory.clear()
+            self._used.clear()
+            self._memory_bytes = 0
+
+    def _remember(self, key, image):
+        self._memory_bytes -= len(self._memory.pop(key, b""))
+        self._memory[key] = image
+        self._memory_bytes += len(image)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict(self):
+        (size,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()
+        if size <= self.max_bytes:
+            return
+        self._db.executemany(
+            "UPDATE images SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in self._used.items()],
+        )
+        self._used.clear()
+        evicted = []
+        for key, image_size in self._db.execute("SELECT key, size FROM images ORDER BY last_used"):
+            if size <= self.max_bytes:
+                break
+            evicted.append(key)
+            size -= image_size
+        self._db.executemany("DELETE FROM images WHERE key = ?", [(key,) for key in evicted])
+        for key in evicted:
+            self._delete_file(key)
+            self._memory_bytes -= len(self._memory.pop(key, b""))
+
+    def _delete_file(self, key):
+        try:
+            os.remove(self.file_path(key))
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--store", default=STORE_PATH, help="Directory of the image store")
+    args = parser.parse_args()
+
+    store = ImageStore(args.store)
+    if args.command == "stats":
+        for name, value in store.stats().items():
+            print(f"{name}: {value}")
+    else:
+        store.clear()
+        print(f"Cleared {args.store}")
@@ -0,0 +1,178 @@
+"""
+A stand-in for OpenAI's chat completions API, for running the app offline and load testing it without
+spending on a provider. It answers every request by echoing the prompt (or a fixed response) word by
+word, streamed or not, after a set latency, and can fail a share of requests with 503s.
+
+Usage:
+    python local_llm_server.py --port 8000 --latency 0.5 --error-rate 0.05
+    LOCAL_LLM_URL=http://127.0.0.1:8000/v1 streamlit run Welcome.py
+
+The pages then offer "Local stand-in" as a model (see AsyncLocalProcessor in genai_processor.py).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keeps connections open between requests, like a provider
+
+    # Set by serve()
+    response = None
+    latency = 0.2
+    delay = 0.02
+    error_rate = 0.0
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "local", "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": f"No route {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": {"message": "The body is not JSON"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"No route {self.path}"}})
+            return
+
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.send_json(503, {"error": {"message": "The stand-in failed this request on purpose"}})
+            return
+
+        words = self.response_words(request)
+        model = request.get("model", "local")
+        if request.get("stream"):
+            self.stream(words, model)
+        else:
+            text = "".join(words)
+            self.send_json(
+                200,
+                {
+                    "id": "chatcmpl-local",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": 0},
+                },
+            )
+
+    def response_words(self, request):
+        """
+        Returns the words of the response: the fixed response, or the last message of the request, cut
+        to max_tokens words.
+        """
+        text = self.response
+        if text is None:
+            messages = request.get("messages") or [{"content": ""}]
+            text = messages[-1].get("content") or ""
+        words = re.findall(r"\s*\S+\s*", text)
+        max_tokens = request.get("max_tokens")
+        return words[:max_tokens] if max_tokens else words
+
+    def stream(self, words, model):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunk = {
+            "id": "chatcmpl-local",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+        }
+        for i, word in enumerate(words + [None]):
+            if i and self.delay:
+                time.sleep(self.delay)
+            if word is None:
+                choice = {"index": 0, "delta": {}, "finish_reason": "stop"}
+            else:
+                choice = {"index": 0, "delta": {"content": word}, "finish_reason": None}
+            self.wfile.write(f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # A line per request drowns out everything else under load
+
+
+def serve(
+    host="127.0.0.1", port=8000, response=None, latency=0.2, delay=0.02, error_rate=0.0, block=True
+):
+    """
+    Starts the stand-in server.
+
+    Parameters:
+    - host, port: Where to listen, port 0 picks a free port.
+    - response (str): Text to respond with, None echoes the prompt.
+    - latency (float): Seconds before each response starts.
+    - delay (float): Seconds between the words of a streamed response.
+    - error_rate (float): Share of requests answered with a 503.
+    - block (bool): Serve in this thread until interrupted, False serves from a daemon thread.
+
+    Returns:
+    - ThreadingHTTPServer: The server, its URL is http://{host}:{server.server_port}/v1.
+    """
+    handler = type(
+        "ConfiguredStandInHandler",
+        (StandInHandler,),
+        {"response": response, "latency": latency, "delay": delay, "error_rate": error_rate},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if block:
+        print(f"Serving on http://{host}:{server.server_port}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    else:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--response", help="Text to respond with instead of echoing the prompt")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before each response starts")
+    parser.add_argument("--delay", type=float, default=0.02, help="Seconds between streamed words")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of requests failed with 503"
+    )
+    args = parser.parse_args()
+    serve(args.host, args.port, args.response, args.latency, args.delay, args.error_rate)
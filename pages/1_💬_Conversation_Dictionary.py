@@ -1,5 +1,25 @@
+import re
+import uuid
+from functools import partial
+
 import streamlit as st
-from genai_processor import LanguageModelProcessor, ChatGPTProcessor, GeminiProcessor
+from rate_limiter import current_session
+from resources import get_async_processor, get_dialogue_store, show_queue_position
+from prompt_templates import TemplateError, compile_template
+from genai_processor import (
+    LanguageModelProcessor,
+    PromptTooLongError,
+    RequestSettings,
+    AUTO_PROVIDER,
+    PROVIDERS,
+    completed_async,
+    error_message,
+    iter_async,
+    submit_async,
+)
+
+# Most words that can be submitted at once, each one is its own request
+MAX_WORDS = 50
 
 st.page_link("Welcome.py", label="Home", icon="🏠")
 
@@ -54,13 +74,14 @@ with st.sidebar:
         # LLM Selection
         llm_choice = st.selectbox(
             "Choose your Language Model",
-            [
-                "Google Gemini-Pro",
-                "OpenAI ChatGPT 4",
-                # "Meta LLama 2",
-            ],  # Add other LLMs as needed
+            [*PROVIDERS, AUTO_PROVIDER],  # Add other LLMs with register_provider
             index=0,  # Default to the first option
-            help="Select the Language Model to generate conversations.",
+            help="Select the Language Model to generate conversations. Auto uses whichever is answering "
+            "fastest.",
+        )
+        hedge_requests = st.toggle(
+            "Back up with the other model",
+            help="If the chosen model is slow or failing, also ask the other one and use whichever answers first.",
         )
 
         template_editing = st.expander("Edit Prompt Template", expanded=False)
@@ -71,12 +92,18 @@ with st.sidebar:
 "Construct a dialogue in {practice_language}, tailored to CEFR level {learner_level}, consisting of 3-5 exchanges. Your task is to weave the target word '{vocab}' into a scenario that fits the theme/context {conversation_context}. Aim for a {formality} formality register. Begin with a brief description of the scenario in the students preferred_language ({preferred_language}). This setup should establish the theme/context and provide a backdrop for the dialogue. Make sure it's clear and engaging, setting the stage for the language interaction. {mistakes_request} {translation_request} "
 """,
                 height=300,
-                help="Modify the template as needed. This template will be used for generating conversations based on your settings. Do not change the {settings} in curly braces.",
+                help="Modify the template as needed. This template will be used for generating conversations based on your settings. Do not change the {settings} in curly braces, write any other braces as {{ and }}.",
             )
             if st.button("Save Template"):
-                # Save the user modified template to session state or use it directly for generation
-                st.session_state["user_template"] = user_template
-                st.success("Template saved successfully!")
+                # Check the placeholders once here, so a bad template never reaches the model
+                try:
+                    compile_template(user_template, LanguageModelProcessor.convo_fields)
+                except TemplateError as e:
+                    st.error(f"The template was not saved. {e}")
+                else:
+                    # Save the user modified template to session state or use it directly for generation
+                    st.session_state["user_template"] = user_template
+                    st.success("Template saved successfully!")
 
 
 col1, col2, col3 = st.columns(3)
@@ -109,39 +136,39 @@ with col2:
 
 # UI for input outside of the settings, so users can submit words anytime.
 with st.form("myform"):
-    vocab_text = st.text_input(
+    vocab_text = st.text_area(
         "Enter the word or words you want to see used in a conversation:",
         placeholder="Vocabulary",
-        help="Additional options in the sidebar located at the top left",
+        help=(
+            f"Separate words with commas or new lines (up to {MAX_WORDS}), each gets its own dialogue. "
+            "Additional options in the sidebar located at the top left"
+        ),
+        height=68,
     )
     submitted = st.form_submit_button("Submit")
 
 
-def process_user_template(template, settings):
+def split_vocab(vocab_text):
     """
-    Replace placeholders in the user template with actual settings values.
-
-    :param template: The user-defined template string with placeholders.
-    :param settings: A dictionary of settings values.
-    :return: The processed template with placeholders filled in.
+    Splits a comma or newline separated list of vocabulary into words, dropping blanks and repeats.
     """
-    for key, value in settings.items():
-        placeholder = f"{{{key}}}"  # Placeholders are expected in {key} format.
-        if placeholder in template:
-            template = template.replace(placeholder, str(value))
-    return template
+    words = []
+    for word in re.split(r"[,;\n]", vocab_text):
+        word = word.strip()
+        if word and word not in words:
+            words.append(word)
+    return words
 
 
+# Requests from this session take turns with other sessions' in the rate limiters
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+current_session.set(st.session_state["session_id"])
+
 if "responses" not in st.session_state:
     st.session_state["responses"] = []
 
-# Ensure consistent use of keys and proper initialization
-if "llm_processor" not in st.session_state:
-    st.session_state["llm_processor"] = LanguageModelProcessor(
-        st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"]
-    )
-
-# Updated to reflect the current settings
+# This session's settings, passed with each request to the processor shared by every session
 current_settings = {
     "conversation_context": conversation_context,
     "formality": formality,
@@ -154,8 +181,7 @@ current_settings = {
     "custom_api_key": None,  # or the appropriate value
 }
 
-# Apply the settings to your processor
-st.session_state["llm_processor"].set_settings(current_settings)
+settings = RequestSettings.from_dict(current_settings)
 
 # Generating conversation using the corrected instance
 if submitted:
@@ -165,30 +191,148 @@ if submitted:
     if not practice_language.strip():
         st.warning("Set your target langauge in the sidebar located at the top left.")
 
+    words = split_vocab(vocab_text)
+    if len(words) > MAX_WORDS:
+        st.warning(f"Only the first {MAX_WORDS} words will be used.")
+        words = words[:MAX_WORDS]
+
     with st.spinner("Creating your dialogue..."):
-        if "user_template" in st.session_state:  # Check for user prompt
-            user_template = st.session_state["user_template"]
-            prompt = process_user_template(user_template, current_settings)
-        else:
-            prompt = st.session_state["llm_processor"].create_convo_prompt(vocab_text)
-
-        # Run LLM model
-        if llm_choice == "Google Gemini-Pro":
-            gemini_processor = GeminiProcessor(
-                st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"]
+        processor = get_async_processor(
+            llm_choice, st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"], hedge_requests
+        )
+        queue_status = st.empty()
+        show_position = partial(show_queue_position, queue_status, processor, llm_choice, settings)
+
+        prompts = []
+        for word in words:
+            if "user_template" in st.session_state:  # Check for user prompt
+                user_template = st.session_state["user_template"]
+                prompt = processor.render_user_template(user_template, word, settings)
+            else:
+                prompt = processor.create_convo_prompt(word, settings)
+            prompts.append(prompt)
+
+        # Room for the dialogue and the extras asked for, and no more. Prompts that don't fit in the
+        # model's context window (e.g. from a long custom template) are rejected before anything is sent.
+        max_tokens = processor.expected_output_tokens("generate_convo", settings=settings)
+        try:
+            max_tokens = min(
+                (
+                    processor.fit_max_tokens(prompt, max_tokens, "generate_convo", settings)
+                    for prompt in prompts
+                ),
+                default=max_tokens,
             )
-            response = gemini_processor.generate_convo(prompt)
-        elif llm_choice == "OpenAI ChatGPT 4":
-            chatgpt_processor = ChatGPTProcessor(
-                st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"]
+        except PromptTooLongError as e:
+            st.error(f"The prompt is too long for this model. {e}.")
+            st.stop()
+
+        # Dialogues for the default prompt are served from the dialogue store when it has one for these
+        # settings, and refreshed in the background. Custom templates always go to the model.
+        dialogue_store = get_dialogue_store()
+        use_store = "user_template" not in st.session_state
+
+        stored_responses = {}  # Index of the word -> dialogue from the store
+        if use_store:
+            for i, (word, prompt) in enumerate(zip(words, prompts)):
+                stored = dialogue_store.get(word, settings)
+                if stored is not None:
+                    stored_responses[i] = stored
+                    dialogue_store.refresh(
+                        word,
+                        settings,
+                        lambda prompt=prompt: processor.generate_convo(
+                            prompt, cache=False, settings=settings, max_tokens=max_tokens
+                        ),
+                    )
+        live_prompts = [prompt for i, prompt in enumerate(prompts) if i not in stored_responses]
+
+        new_responses = []
+        if len(live_prompts) == 1:
+            # Resubmitting the same word should give a new dialogue, so keep a few per word in the cache
+            deltas = iter_async(
+                processor.stream_convo(
+                    live_prompts[0], variants=3, settings=settings, max_tokens=max_tokens
+                ),
+                on_wait=show_position,
             )
-            response = chatgpt_processor.generate_convo(prompt)
 
-        # Append new response to the start of the list so it appears at the top
-        st.session_state["responses"].insert(0, response)
+            # Show the dialogue as it is written, it moves into the list of responses below once complete
+            live_response = st.empty()
+            timing = {}
+            try:
+                with live_response.container():
+                    response = st.write_stream(processor.record_stream("generate_convo", deltas, timing))
+            except Exception as e:
+                response = e
+            live_response.empty()
+            queue_status.empty()
+            new_responses.append(response)
+
+            if timing["time_to_first_token"] is not None:
+                st.caption(
+                    f"First words after {timing['time_to_first_token']:.1f}s, finished in {timing['total_time']:.1f}s"
+                )
+
+        elif live_prompts:
+            # Send every word at once (the processor limits how many run concurrently) and show each
+            # dialogue as soon as it is ready
+            futures = [
+                submit_async(
+                    processor.generate_convo(
+                        prompt, variants=3, settings=settings, max_tokens=max_tokens
+                    )
+                )
+                for prompt in live_prompts
+            ]
+            live_responses = st.empty()
+            with live_responses.container():
+                progress = st.progress(0.0, text=f"0 of {len(futures)} dialogues ready")
+                completed = completed_async(futures, on_wait=show_position)
+                for done, future in enumerate(completed, start=1):
+                    if future.exception() is None and future.result():
+                        st.info(future.result())
+                    progress.progress(
+                        done / len(futures), text=f"{done} of {len(futures)} dialogues ready"
+                    )
+            live_responses.empty()
+            queue_status.empty()
+            # The dialogue of each word, or the error its request failed with
+            new_responses = [future.exception() or future.result() for future in futures]
+
+        # Put the stored and new dialogues back in the order the words were entered in, leaving out words
+        # whose request failed
+        generated = iter(new_responses)
+        new_responses = []
+        failed_words = []
+        errors = []
+        for i, word in enumerate(words):
+            if i in stored_responses:
+                new_responses.append(stored_responses[i])
+                continue
+            response = next(generated)
+            if isinstance(response, Exception):
+                errors.append(response)
+            if isinstance(response, Exception) or not response:
+                failed_words.append(word)
+                continue
+            if use_store:
+                dialogue_store.add(word, settings, response)
+            new_responses.append(response)
+        if failed_words:
+            # An empty dialogue has no error to explain it
+            reason = "The model may be busy, try again in a moment."
+            if errors:
+                reason = error_message(errors[0])
+            st.error(f"No dialogue could be generated for {', '.join(failed_words)}. {reason}")
+        if stored_responses:
+            st.caption(f"{len(stored_responses)} of {len(words)} dialogues from the dialogue library")
+
+        # Add the new responses to the start of the list so they appear at the top
+        st.session_state["responses"][:0] = new_responses
 
-        # Limit the number of responses to a specific max value
-        max_responses = 5
+        # Limit the number of responses to a specific max value, but keep every dialogue just created
+        max_responses = max(5, len(new_responses))
         if len(st.session_state["responses"]) > max_responses:
             # Remove the oldest response(s) to maintain only a max number of responses
             st.session_state["responses"] = st.session_state["responses"][
@@ -1,39 +1,100 @@
-import streamlit as st
-
-from word_lists import freq_colored_dict
-from genai_processor import LanguageModelProcessor, ChatGPTProcessor, GeminiProcessor
-
-
-# ColorCoder class definition
-class ColorCoder:
-    def __init__(self, color_dict):
-        self.color_dict = color_dict
-        self.default_color = "#34495E"
-
-    def colorize_text(self, text):
-        words = text.split()  # Split the text into words
-        colored_text = ""
+import uuid
+from functools import partial
 
-        for word in words:
-            uppercase_word = word.upper().strip(
-                ".,!?"
-            )  # Consider stripping punctuation for matching
-            # Check if the word (or its uppercase variant) is in the dictionary
-            if uppercase_word in self.color_dict:
-                # Wrap the word in a span with the color style
-                colored_word = f'<span style="color: {self.color_dict[uppercase_word]};">{word}</span>'
-            else:
-                colored_word = (
-                    f'<span style="color: {self.default_color};">{word}</span>'
-                )
-            colored_text += (
-                colored_word + " "
-            )  # Reconstruct the sentence with colored words
+import streamlit as st
 
-        return colored_text
+from color_coder import iter_paragraphs
+from word_lists import BAND_LABELS, band_id_of
+from genai_processor import (
+    RequestSettings,
+    AUTO_PROVIDER,
+    PROVIDERS,
+    PromptTooLongError,
+    error_message,
+    iter_async,
+)
+from rate_limiter import current_session
+from resources import (
+    get_async_processor,
+    get_color_coder,
+    get_lexical_profiler,
+    get_sentence_simplifier,
+    show_queue_position,
+)
 
+# Built once per process and shared by every session and rerun, see resources.py
+color_coder = get_color_coder()
+profiler = get_lexical_profiler()
+sentence_simplifier = get_sentence_simplifier()
+
+
+def profile_texts(texts):
+    """
+    Works out the lexical profile of each text, as the tables show_profiles displays. Done once when a
+    text is submitted, the tables are kept with the response so reruns don't profile the texts again.
+
+    Parameters:
+    - texts (dict): Column name (e.g. "Original") -> text.
+
+    Returns:
+    - dict: "bands" and "summary" DataFrames, with one row or column per text.
+    """
+    import pandas as pd
+
+    profiles = {name: profiler.profile(text) for name, text in texts.items()}
+
+    # Share of the words in each of the colour coded bands, one stacked bar per text
+    band_shares = {}
+    for name, profile in profiles.items():
+        words = max(profile["words"], 1)
+        shares = dict.fromkeys([*BAND_LABELS, "11K+"], 0.0)
+        for band, count in enumerate(profile["band_counts"][1:], start=1):
+            shares[BAND_LABELS[band_id_of(band)]] += 100 * count / words
+        shares["11K+"] = 100 * profile["off_list_ratio"]
+        band_shares[name] = shares
+
+    def band_label(band):
+        return f"{band}K" if band is not None else "beyond 10K"
+
+    summary = {
+        name: {
+            "Words": f"{profile['words']:,}",
+            "95% coverage": band_label(profile["coverage_95"]),
+            "98% coverage": band_label(profile["coverage_98"]),
+            "Off-list": f"{profile['off_list_ratio']:.1%}",
+            "Sentences": f"{profile['sentences']:,}",
+            "Mean sentence length": f"{profile['mean_sentence_length']:.1f}",
+            "Longest sentence": f"{profile['max_sentence_length']}",
+        }
+        for name, profile in profiles.items()
+    }
+    return {"bands": pd.DataFrame(band_shares).T, "summary": pd.DataFrame(summary)}
+
+
+def show_profiles(profiles):
+    """
+    Shows the lexical profiles worked out by profile_texts side by side.
+    """
+    st.bar_chart(profiles["bands"])
+    st.dataframe(profiles["summary"])
+
+
+def response_html(response, color_coded):
+    """
+    Renders a response as HTML, one div per paragraph. Done once when the response is written, the HTML is
+    kept in the history so reruns don't colour code every stored text again.
+    """
+    if color_coded:
+        # Color code the simplified text
+        paragraphs = color_coder.colorize_paragraphs(response)
+    else:
+        # Display the simplified text without color coding
+        paragraphs = iter_paragraphs(response)
+    return "".join(
+        f'<div style="font-family: Arial, sans-serif; color: #333; line-height: 1.5; margin-bottom: 8px;">{paragraph}</div>'
+        for paragraph in paragraphs
+    )
 
-color_coder = ColorCoder(freq_colored_dict)
 
 st.page_link("Welcome.py", label="Home", icon="🏠")
 
@@ -108,13 +169,14 @@ with st.sidebar:
         # LLM Selection
         llm_choice = st.selectbox(
             "Choose your Language Model",
-            [
-                "Google Gemini-Pro",
-                "OpenAI ChatGPT 4",
-                # "Meta LLama 2",
-            ],  # Add other LLMs as needed
+            [*PROVIDERS, AUTO_PROVIDER],  # Add other LLMs with register_provider
             index=0,  # Default to the first option
-            help="Select the Language Model to generate conversations.",
+            help="Select the Language Model to generate conversations. Auto uses whichever is answering "
+            "fastest.",
+        )
+        hedge_requests = st.toggle(
+            "Back up with the other model",
+            help="If the chosen model is slow or failing, also ask the other one and use whichever answers first.",
         )
         practice_language = st.text_input(
             label="Translation Language", help="Experimental."
@@ -274,62 +336,121 @@ if st.button("Clear All"):
     st.session_state["response_history"] = []  # Reset the list of responses
 
 
-# Ensure consistent use of keys and proper initialization
-if "llm_processor" not in st.session_state:
-    st.session_state["llm_processor"] = LanguageModelProcessor(
-        st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"]
-    )
+# Requests from this session take turns with other sessions' in the rate limiters
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+current_session.set(st.session_state["session_id"])
 
-# Updated to reflect the current settings
+# This session's settings, passed with each request to the processor shared by every session
 current_settings = {
     "practice_language": practice_language,
     "learner_level": learner_level,
 }
-
-# Apply the settings to your processor
-st.session_state["llm_processor"].set_settings(current_settings)
-
-prompt = st.session_state["llm_processor"].create_compre_prompt(orginal_text)
+settings = RequestSettings.from_dict(current_settings)
 
 if "response_history" not in st.session_state:
     st.session_state.response_history = []
 
 
-# Initialize the correct processor based on user choice
-if llm_choice == "Google Gemini-Pro":
-    gemini_processor = GeminiProcessor(
-        st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"]
-    )
-elif llm_choice == "OpenAI ChatGPT 4":
-    chatgpt_processor = ChatGPTProcessor(
-        st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"]
-    )
-
-
 if submitted:
     with st.spinner("Comprehensible-izing"):
         if learner_level != "Keep Orginal Text":
-            if llm_choice == "OpenAI ChatGPT 4":
-                response = chatgpt_processor.simplify_text(prompt)
-            elif llm_choice == "Google Gemini-Pro":
-                response = gemini_processor.simplify_text(prompt)
-        else:
-            response = orginal_text
+            # Only sentences with words above the learner's level need rewriting
+            plan = sentence_simplifier.plan(orginal_text, learner_level)
+            chunks = sentence_simplifier.chunks(plan)
+            to_simplify = sum(part["simplify"] for part in plan)
 
-        if enable_color_coding:
-            # Color code the simplified text
-            final_text = color_coder.colorize_text(response)
+        if learner_level == "Keep Orginal Text":
+            response = orginal_text
+        elif not chunks:
+            response = orginal_text
+            st.caption(f"Every sentence is already within {learner_level.split()[0]} vocabulary")
         else:
-            # Display the simplified text without color coding
-            final_text = response
+            # Only get the processor (and import its SDK) when there is something to simplify
+            processor = get_async_processor(
+                llm_choice, st.secrets["GOOGLE_API_KEY"], st.secrets["OPENAI_API_KEY"], hedge_requests
+            )
+            streamed = chunks == [(0, len(plan))]
+            if streamed:
+                prompts = [processor.create_compre_prompt(orginal_text, settings)]
+            else:
+                prompts = sentence_simplifier.prompts(
+                    plan, chunks, partial(processor.create_compre_passage_prompt, settings=settings)
+                )
 
-        st.session_state.response_history.insert(0, final_text)
+            # Prompts that don't fit in the model's context window are rejected before anything is sent,
+            # rather than some chunks failing and being kept as they were
+            try:
+                for prompt in prompts:
+                    processor.fit_max_tokens(prompt, request="simplify_text", settings=settings)
+            except PromptTooLongError as e:
+                st.error(error_message(e))
+                st.stop()
+
+            queue_status = st.empty()
+            show_position = partial(show_queue_position, queue_status, processor, llm_choice, settings)
+            errors = []  # Of the chunks that failed
+            if streamed:
+                # The whole text fits in one request, so it is streamed word by word
+                deltas = iter_async(
+                    processor.stream_simplify_text(prompts[0], settings=settings), on_wait=show_position
+                )
+            else:
+                # Chunks are simplified in parallel and each is shown once the text before it is ready,
+                # a chunk that fails is kept as it was
+                simplify = partial(processor.simplify_text, settings=settings)
+                deltas = iter_async(
+                    sentence_simplifier.stream(plan, chunks, prompts, simplify, errors),
+                    on_wait=show_position,
+                )
+
+            # Show the simplified text as it is written, it is colour coded below once complete
+            live_response = st.empty()
+            timing = {}
+            error = None
+            try:
+                with live_response.container():
+                    response = st.write_stream(processor.record_stream("simplify_text", deltas, timing))
+            except Exception as e:
+                response, error = None, e
+            live_response.empty()
+            queue_status.empty()
+            if error is not None:
+                st.error(f"The text could not be simplified. {error_message(error)}")
+            elif errors:
+                st.error(
+                    f"{len(errors)} of {len(chunks)} passages were kept as they were. "
+                    f"{error_message(errors[0])}"
+                )
+            elif not response:
+                st.error("The text could not be simplified. The model may be busy, try again in a moment.")
+
+            if to_simplify < len(plan):
+                st.caption(
+                    f"Simplified {to_simplify} of {len(plan)} sentences, the rest are already within "
+                    f"{learner_level.split()[0]} vocabulary"
+                )
+            if timing["time_to_first_token"] is not None:
+                st.caption(
+                    f"First words after {timing['time_to_first_token']:.1f}s, finished in {timing['total_time']:.1f}s"
+                )
+
+        # Keep the rendered text and its profile, so reruns only display them
+        if response:
+            if response == orginal_text:
+                profiles = profile_texts({"Original": orginal_text})
+            else:
+                profiles = profile_texts({"Original": orginal_text, "Simplified": response})
+            html = response_html(response, enable_color_coding)
+            st.session_state.response_history.insert(0, (html, profiles))
 
         # Limit the history to the most recent 5 responses
         st.session_state.response_history = st.session_state.response_history[:5]
 
 # Display each response from the session state
-for response in st.session_state.response_history:
-    # Wrap each response with your styled div
-    text_with_background = f'<div style="background-color: #F5F5F5; padding: 20px; margin: 8px; border-radius: 8px; box-shadow: 0 4px 6px rgba(0,0,0,0.1); font-family: Arial, sans-serif; color: #333; line-height: 1.5;">{response}</div>'
-    st.markdown(text_with_background, unsafe_allow_html=True)
+for html, profiles in st.session_state.response_history:
+    with st.container(border=True):
+        st.markdown(html, unsafe_allow_html=True)
+
+        with st.expander("Lexical profile"):
+            show_profiles(profiles)
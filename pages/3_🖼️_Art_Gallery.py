@@ -1,59 +1,35 @@
 import streamlit as st
-from openai import OpenAI
-import openai
 
+from art_gallery import STYLE_CHARACTERISTICS, GalleryPrefetcher
+from genai_processor import error_message, run_async
+from resources import get_art_gallery, get_gallery_pool, get_image_store
+
+
+def gallery_prefetcher(style, style_characteristics):
+    """
+    The session's GalleryPrefetcher for the style, replacing (and cancelling) one for another style.
+    """
+    prefetcher = st.session_state["gallery_prefetcher"]
+    if prefetcher is None or prefetcher.style != style:
+        if prefetcher is not None:
+            prefetcher.cancel()
+        prefetcher = GalleryPrefetcher(
+            art_gallery,
+            style,
+            style_characteristics,
+            pool=gallery_pool,
+            seen=st.session_state["seen_paintings"],
+        )
+        st.session_state["gallery_prefetcher"] = prefetcher
+    return prefetcher
 
-class ArtGallery:
-    def __init__(self, openai_api_key):
-        self.client = OpenAI(api_key=openai_api_key)
-
-    def generate_image_prompt(self, style):
-        system_instructions = f"Craft Dall-E prompt for easily recognizable paintings in {style} style, for an image description game for English learners. Focus on a clear, simple noun (thing, or animal), avoid people. Use straightforward English and easy vocabulary to aid guessing and understanding, as if explaining the art to someone who hasn't seen it. Follow these steps. Step 1: Provide a descriptive title. Step 2: Provide a simple but comprehensive description of what is happening in the painting in 15 words or less. Do not list steps."
-
-        user_prompt = "Create an art gallery piece scene description."
 
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_instructions,
-                    },
-                    {"role": "user", "content": user_prompt},
-                ],
-                max_tokens=50,
-                temperature=0.9,
-            )
-
-            painting_prompt = response.choices[0].message.content
-
-            return painting_prompt
-
-        except Exception as e:
-            print(f"Error in generating conversation: {e}")
-        return None
-
-    def generate_artwork(self, prompt, style, style_characteristics):
-        try:
-            response = self.client.images.generate(
-                model="dall-e-2",
-                prompt=f"Create an image that clearly and vividly represents the following scene in the style of {style}, "
-                f"which is known for its {style_characteristics}. The scene description is: '{prompt}'. "
-                "Ensure the image is simple enough to be guessed or described by someone learning English, "
-                "focus on the elements in the description only. There should be no words in the image",
-                size="256x256",
-                quality="standard",
-                n=1,
-            )
-
-            image_url = response.data[0].url
-            # print("Generated Image URL:", image_url)
-            return image_url
-
-        except openai.OpenAIError as e:
-            print(e.http_status)
-            print(e.error)
+def show_image(image_key):
+    image = image_store.get(image_key)
+    if image is not None:
+        st.image(image)
+    else:
+        st.caption("This painting is no longer in the gallery's storage.")
 
 
 st.page_link("Welcome.py", label="Home", icon="🏠")
@@ -79,13 +55,16 @@ with st.expander("Instructions"):
     )
 
 
-art_gallery = ArtGallery(st.secrets["OPENAI_API_KEY"])
+art_gallery = get_art_gallery(st.secrets["OPENAI_API_KEY"])
+image_store = get_image_store()
+gallery_pool = get_gallery_pool(st.secrets["OPENAI_API_KEY"])
 
 
 # Check for existing session state or initialize it
 if "gallery_entered" not in st.session_state:
     st.session_state["gallery_entered"] = False
 
+# Keys of the images in the image store, see image_store.py
 if "ai_art_works" not in st.session_state:
     st.session_state["ai_art_works"] = []
 
@@ -98,40 +77,23 @@ if "ai_art_works_descriptions" not in st.session_state:
 if "player_arts_descriptions" not in st.session_state:
     st.session_state["player_arts_descriptions"] = []
 
+# The next paintings of the gallery's style, drawn from the shared pool or generated in the background
+# ahead of the clicks
+if "gallery_prefetcher" not in st.session_state:
+    st.session_state["gallery_prefetcher"] = None
+
+# Image keys of every painting shown to this session, so the pool never shows it the same one twice
+if "seen_paintings" not in st.session_state:
+    st.session_state["seen_paintings"] = set()
+
 
 choosen_style = st.selectbox(
     "Pick a style:",
-    [
-        "Renaissance",
-        "Abstract Expressionism",
-        "Art Deco",
-        "Art Nouveau",
-        "Avant-garde",
-        "Baroque",
-        "Classicism",
-        "Digital Art",
-        "Expressionism",
-        "Futurism",
-        "Harlem Renaissance",
-    ],
+    list(STYLE_CHARACTERISTICS),
     help="Changing style will also change the types of descriptions. Some styles are harder than others.",
 )
 
-style_characteristics = {
-    "Renaissance": "Realistic, detailed, perspective-focused",
-    "Abstract Expressionism": "Spontaneous, emotional, non-representational",
-    "Art Deco": "Geometric, streamlined, decorative",
-    "Art Nouveau": "Flowing, organic, ornamental",
-    "Avant-garde": "Innovative, non-traditional, experimental",
-    "Baroque": "Dramatic, intense, detailed",
-    "Classicism": "Harmonious, proportionate, idealized",
-    "Digital Art": "Pixel-based, computer-generated, versatile",
-    "Expressionism": "Distorted, subjective, emotive",
-    "Futurism": "Dynamic, mechanical, motion-focused",
-    "Harlem Renaissance": "Cultural, vibrant, expressive",
-}
-
-choosen_style_characteristics = style_characteristics[choosen_style]
+choosen_style_characteristics = STYLE_CHARACTERISTICS[choosen_style]
 
 if st.button("Enter New Gallery"):
     st.session_state["gallery_entered"] = True
@@ -140,24 +102,19 @@ if st.button("Enter New Gallery"):
     st.session_state["ai_art_works_descriptions"] = []
     st.session_state["player_arts_descriptions"] = []
 
+    # Served from the shared pool or the paintings prefetched for the session when there are any, the
+    # first gallery of a style no one has visited yet waits for its own
+    prefetcher = gallery_prefetcher(choosen_style, choosen_style_characteristics)
+    new_prompt = image_key = None
     with st.spinner("Curating gallery..."):
-        new_prompt = art_gallery.generate_image_prompt(style=choosen_style)
-        if new_prompt:  # Ensure there's a new prompt
-            st.session_state.ai_art_works_descriptions.append(new_prompt)
-
-    with st.spinner("Hanging up paintings..."):
-        if st.session_state.ai_art_works_descriptions:
-            prompt = st.session_state.ai_art_works_descriptions[
-                -1
-            ]  # Use the latest prompt
-            # Append the new artwork URL to the session state list
-            st.session_state.ai_art_works.append(
-                art_gallery.generate_artwork(
-                    prompt,
-                    style=choosen_style,
-                    style_characteristics=choosen_style_characteristics,
-                )
-            )
+        try:
+            new_prompt, image_key = prefetcher.next_painting()
+        except Exception as e:
+            st.error(f"The gallery could not be curated. {error_message(e)}")
+    if new_prompt:  # Ensure there's a new prompt
+        st.session_state.ai_art_works_descriptions.append(new_prompt)
+    if image_key:
+        st.session_state.ai_art_works.append(image_key)
 
 
 if st.session_state["gallery_entered"]:
@@ -171,12 +128,14 @@ if st.session_state["gallery_entered"]:
         st.subheader("Gallery")
         # Reverse the list for display
         for ai_art_work in reversed(st.session_state.ai_art_works):
-            st.image(ai_art_work)
+            show_image(ai_art_work)
         if not st.session_state.ai_art_works:
             st.write("Waiting for player to generate AI artwork...")
 
         if st.button("Leave this gallery"):
             st.session_state["gallery_entered"] = False
+            if st.session_state["gallery_prefetcher"] is not None:
+                st.session_state["gallery_prefetcher"].cancel()
             st.caption("Are you sure?")
             st.caption("Click again to confirm.")
 
@@ -184,7 +143,7 @@ if st.session_state["gallery_entered"]:
         st.subheader("Your Paintings")
         # Reverse the list for display
         for player_art in reversed(st.session_state.player_arts):
-            st.image(player_art)
+            show_image(player_art)
         if not st.session_state.player_arts:
             st.write("Waiting for player to submit description...")
     
@@ -202,14 +161,16 @@ if st.session_state["gallery_entered"]:
                 prompt = st.session_state.ai_art_works_descriptions[
                     -1
                 ]  # Use the latest prompt
+                prefetcher = gallery_prefetcher(choosen_style, choosen_style_characteristics)
+                image_key = None
+                with st.spinner("Hanging up paintings..."):
+                    try:
+                        image_key = prefetcher.more_like(prompt)
+                    except Exception as e:
+                        st.error(f"No more paintings could be hung. {error_message(e)}")
                 # Append the new artwork URL to the session state list
-                st.session_state.ai_art_works.append(
-                    art_gallery.generate_artwork(
-                        prompt,
-                        style=choosen_style,
-                        style_characteristics=choosen_style_characteristics,
-                    )
-                )
+                if image_key:
+                    st.session_state.ai_art_works.append(image_key)
 
         if st.toggle(
             "Show Gallery Description",
@@ -227,11 +188,17 @@ if st.session_state["gallery_entered"]:
         )
         if st.button("Create Painting"):
             # Append the new artwork to the session state list
-            st.session_state.player_arts.append(
-                art_gallery.generate_artwork(
-                    player_description,
-                    style=choosen_style,
-                    style_characteristics=choosen_style_characteristics,
+            image_key = None
+            try:
+                image_key = run_async(
+                    art_gallery.generate_artwork(
+                        player_description,
+                        style=choosen_style,
+                        style_characteristics=choosen_style_characteristics,
+                    )
                 )
-            )
+            except Exception as e:
+                st.error(f"Your painting could not be created. {error_message(e)}")
+            if image_key:
+                st.session_state.player_arts.append(image_key)
 
@@ -0,0 +1,95 @@
+"""
+Prompt templates with {placeholder} fields, in the same syntax as str.format.
+
+A template is parsed once into a list of literal text and fields, checked against the fields it may use,
+and cached, so rendering it for each word is a single pass over the parsed parts.
+"""
+
+import string
+from functools import lru_cache
+
+_formatter = string.Formatter()
+
+_CONVERSIONS = {"r": repr, "s": str, "a": ascii}
+
+
+class TemplateError(ValueError):
+    """
+    Raised for a template that can't be parsed, uses a field it isn't allowed, or is rendered without a
+    value for one of its fields.
+    """
+
+
+class PromptTemplate:
+    """
+    A parsed template.
+
+    Parameters:
+    - text (str): The template, e.g. "Create a dialogue in {practice_language}". Literal braces are
+      written {{ and }}.
+    - allowed_fields (iterable of str): The fields the template may use, None allows any name.
+    """
+
+    def __init__(self, text, allowed_fields=None):
+        self.text = text
+        try:
+            parsed = list(_formatter.parse(text))
+        except ValueError as e:
+            raise TemplateError(f"{e}. Write literal braces as {{{{ and }}}}.") from None
+
+        self._parts = []  # (literal text, field name or None, conversion, format spec)
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None and not field.isidentifier():
+                raise TemplateError(f"{{{field}}} is not a valid placeholder")
+            if conversion and conversion not in _CONVERSIONS:
+                raise TemplateError(f"{{{field}!{conversion}}} has an unknown conversion")
+            if format_spec and "{" in format_spec:
+                raise TemplateError(f"{{{field}:{format_spec}}} can't have nested placeholders")
+            self._parts.append((literal, field, conversion, format_spec))
+        self.fields = frozenset(field for _, field, _, _ in self._parts if field is not None)
+
+        if allowed_fields is not None:
+            unknown = self.fields - set(allowed_fields)
+            if unknown:
+                raise TemplateError(
+                    "Unknown placeholders: "
+                    + ", ".join(f"{{{field}}}" for field in sorted(unknown))
+                    + ". Use "
+                    + ", ".join(f"{{{field}}}" for field in sorted(allowed_fields))
+                )
+
+    def render(self, values):
+        """
+        Fills in the template.
+
+        Parameters:
+        - values (dict): Field name -> value, may hold fields the template doesn't use.
+
+        Returns:
+        - str: The rendered text.
+        """
+        missing = self.fields - values.keys()
+        if missing:
+            raise TemplateError("No value for " + ", ".join(f"{{{field}}}" for field in sorted(missing)))
+
+        parts = []
+        for literal, field, conversion, format_spec in self._parts:
+            parts.append(literal)
+            if field is not None:
+                value = values[field]
+                if conversion:
+                    value = _CONVERSIONS[conversion](value)
+                parts.append(format(value, format_spec) if format_spec else str(value))
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def _compile(text, allowed_fields):
+    return PromptTemplate(text, allowed_fields)
+
+
+def compile_template(text, allowed_fields=None):
+    """
+    Returns the parsed template for text, parsing it only the first time it is seen.
+    """
+    return _compile(text, frozenset(allowed_fields) if allowed_fields is not None else None)
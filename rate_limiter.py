@@ -0,0 +1,155 @@
+"""
+Client-side rate limiting shared by every session in the process.
+
+Each provider and API key gets a RateLimiter with two token buckets, one for requests per minute and one
+for tokens per minute, set below the provider's limits so bursts queue here instead of coming back as
+429s. Waiting requests are served round-robin across sessions, so one session submitting 50 words
+doesn't hold up everyone else.
+
+The limiters run on the shared background event loop (see genai_processor.background_loop).
+"""
+
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+
+# The session a request is made for, set by the pages and carried onto the background loop by
+# genai_processor.submit_async
+current_session = contextvars.ContextVar("current_session", default=None)
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens, refilled at `per_minute` tokens a minute.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Returns the seconds until amount tokens are available, 0 if they are now.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits with a fair queue across sessions.
+
+    Parameters:
+    - name (str): Shown in errors and metrics, e.g. "openai".
+    - requests_per_minute (int): Most requests sent a minute.
+    - tokens_per_minute (int): Most tokens (prompt and max_tokens) sent a minute.
+    """
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        # session -> deque of (future, tokens, enqueued at), next session first
+        self._queues = OrderedDict()
+        self._dispatcher = None
+        # Copies of the queue for other threads (the pages), which mustn't iterate it while it changes
+        self.order = ()
+        self.depth = 0
+        self.granted = 0
+        self.waits = deque(maxlen=200)  # Seconds recent requests spent queued
+
+    async def acquire(self, tokens=1, session=None):
+        """
+        Waits until a request of `tokens` tokens may be sent.
+
+        Parameters:
+        - tokens (int): The request's prompt tokens plus its max_tokens.
+        - session: Whose request it is, defaults to current_session. Sessions take turns.
+        """
+        if session is None:
+            session = current_session.get()
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, tokens, time.monotonic())
+        self._queues.setdefault(session, deque()).append(waiter)
+        self._changed()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            queue = self._queues.get(session)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    del self._queues[session]
+                self._changed()
+            raise
+
+    async def _dispatch(self):
+        while self._queues:
+            session, queue = next(iter(self._queues.items()))
+            future, tokens, enqueued = queue[0]
+            if future.done():
+                # Cancelled while queued, the session keeps its turn for its next request
+                queue.popleft()
+                if not queue:
+                    del self._queues[session]
+                self._changed()
+                continue
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            queue.popleft()
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.granted += 1
+            self.waits.append(time.monotonic() - enqueued)
+            future.set_result(None)
+
+            # The session goes to the back of the line, or leaves it if it has nothing else waiting
+            del self._queues[session]
+            if queue:
+                self._queues[session] = queue
+            self._changed()
+
+    def _changed(self):
+        self.order = tuple(self._queues)
+        self.depth = sum(len(queue) for queue in self._queues.values())
+
+    def position(self, session=None):
+        """
+        Returns how many sessions' requests go before the session's next one (0 means it is next), or None
+        if the session has nothing queued.
+        """
+        if session is None:
+            session = current_session.get()
+        order = self.order
+        return order.index(session) if session in order else None
+
+    def stats(self):
+        """
+        Returns the queue depth and how long recent requests waited in it, in seconds.
+        """
+        waits = sorted(self.waits.copy())
+        return {
+            "queued": self.depth,
+            "queued_sessions": len(self.order),
+            "granted": self.granted,
+            "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        }
@@ -0,0 +1,421 @@
+"""
+Deadlines, retries, circuit breakers and hedging for calls to model providers.
+
+A RetryPolicy retries rate limits (429), server errors (5xx), timeouts and dropped connections with
+jittered exponential backoff, within an overall deadline. A CircuitBreaker per provider stops sending
+requests for a while after repeated failures, so a provider that is down fails fast instead of tying up
+every session until its deadline. hedged() races a second request against a slow first one.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a provider whose circuit breaker is open.
+    """
+
+
+def status_code(error):
+    """
+    Returns the HTTP status of a provider error (openai errors have status_code, Google API errors an
+    integer code), or None.
+    """
+    for attr in ("status_code", "code"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(error):
+    """
+    Whether a request that failed with error may succeed if it is sent again.
+    """
+    status = status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # SDK and httpx network errors, e.g. APIConnectionError, APITimeoutError, ReadTimeout
+    return type(error).__name__.endswith(("ConnectionError", "TimeoutError", "Timeout"))
+
+
+def retry_after(error):
+    """
+    Returns the seconds a 429 or 503 response asked to wait for in its Retry-After header, or None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold failures in a row, rejecting calls with CircuitOpenError. After
+    reset_timeout seconds a single trial call is let through: if it succeeds the breaker closes, if it
+    fails it opens again.
+
+    Only failures a retry could fix (see is_retryable) count, a provider that rejects a bad request is
+    still up.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or state == "half-open" and self._trial_running:
+                wait = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+                raise CircuitOpenError(
+                    f"{self.name} is failing, requests are paused for another {wait:.0f}s"
+                )
+            if state == "half-open":
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def record_cancelled(self):
+        """
+        Records a call that was cancelled (e.g. it lost a hedge, or its session went away) before it
+        finished. That says nothing about the provider, unless the call was the half-open trial: then it
+        didn't succeed either, and the breaker opens again rather than waiting for a trial that will
+        never report back.
+        """
+        with self._lock:
+            if self._trial_running:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class LatencyTracker:
+    """
+    Sliding window of the outcomes of recent requests: the latency of each one that succeeded, and
+    which ones failed.
+
+    Parameters:
+    - window (int): Number of requests kept.
+    - min_samples (int): Fewer latencies than this are not enough for a percentile.
+    """
+
+    def __init__(self, window=100, min_samples=10):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for each request that failed
+        self.min_samples = min_samples
+
+    def add(self, seconds):
+        self.latencies.append(seconds)
+        self.outcomes.append(False)
+
+    def add_error(self):
+        self.outcomes.append(True)
+
+    def percentile(self, share):
+        """
+        Returns the latency below which `share` of recent requests finished, or None without enough data.
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(share * len(latencies)))]
+
+    def error_rate(self):
+        """
+        Returns the share of recent requests that failed, 0 if there are none.
+        """
+        outcomes = self.outcomes.copy()
+        return sum(outcomes) / len(outcomes) if outcomes else 0.0
+
+
+class RetryPolicy:
+    """
+    Parameters:
+    - max_attempts (int): Attempts per call, including the first.
+    - base_delay (float): Seconds of the first backoff, doubled for each further attempt.
+    - max_delay (float): Longest backoff in seconds.
+    - timeout (float): Seconds an attempt may take (for a stream, until its first delta and then between
+      deltas).
+    - deadline (float): Seconds the call may take altogether, retries included.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, timeout=30.0, deadline=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.deadline = deadline
+
+    def backoff(self, attempt, error):
+        """
+        Seconds to wait before attempt + 1: what the provider asked for, or a random delay of up to
+        base_delay * 2 ** attempt ("full jitter", so retrying sessions don't all come back at once).
+        """
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, self.base_delay * 2**attempt)
+        return min(delay, self.max_delay)
+
+    def _should_retry(self, attempt, error, breaker, deadline):
+        """
+        Records a failed attempt and returns the backoff before the next one, or None to give up.
+        """
+        if not is_retryable(error):
+            # The provider answered (e.g. a bad request), which says it is up
+            if breaker is not None:
+                breaker.record_success()
+            return None
+        if breaker is not None:
+            breaker.record_failure()
+        delay = self.backoff(attempt, error)
+        if attempt + 1 >= self.max_attempts or time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    async def call(self, fn, breaker=None):
+        """
+        Awaits fn() until it succeeds, retrying failures that may be temporary.
+
+        Parameters:
+        - fn (callable): Returns an awaitable for one attempt.
+        - breaker (CircuitBreaker): The provider's breaker, or None.
+
+        Raises:
+        - The last attempt's error, TimeoutError, or CircuitOpenError.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.before_call()
+            timeout = min(self.timeout, deadline - time.monotonic())
+            try:
+                result = await asyncio.wait_for(fn(), timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = TimeoutError(f"No response within {timeout:.1f}s")
+                delay = self._should_retry(attempt, e, breaker, deadline)
+                if delay is None:
+                    raise e
+                await asyncio.sleep(delay)
+            except BaseException:
+                # CancelledError, which isn't an Exception
+                if breaker is not None:
+                    breaker.record_cancelled()
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+
+    async def stream(self, stream, breaker=None):
+        """
+        Async version of call for streams. Attempts are retried until the first delta arrives, after that
+        a failure ends the stream (retrying would repeat what was already yielded).
+
+        Parameters:
+        - stream (callable): Returns an async iterator of deltas for one attempt.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.before_call()
+            deltas = stream()
+            timeout = min(self.timeout, deadline - time.monotonic())
+            try:
+                first = await asyncio.wait_for(deltas.__anext__(), timeout)
+            except StopAsyncIteration:
+                if breaker is not None:
+                    breaker.record_success()
+                return
+            except Exception as e:
+                await _aclose(deltas)
+                if isinstance(e, asyncio.TimeoutError):
+                    e = TimeoutError(f"No response within {timeout:.1f}s")
+                delay = self._should_retry(attempt, e, breaker, deadline)
+                if delay is None:
+                    raise e
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                if breaker is not None:
+                    breaker.record_cancelled()
+                await _aclose(deltas)
+                raise
+
+            if breaker is not None:
+                breaker.record_success()
+            try:
+                yield first
+                while True:
+                    try:
+                        delta = await asyncio.wait_for(deltas.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f"The response stalled for {self.timeout:.0f}s") from None
+                    yield delta
+            finally:
+                await _aclose(deltas)
+
+    def call_sync(self, fn, breaker=None):
+        """
+        Blocking version of call. fn must enforce self.timeout itself (e.g. through the SDK's timeout).
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_attempts):
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._should_retry(attempt, e, breaker, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            except BaseException:
+                # e.g. KeyboardInterrupt
+                if breaker is not None:
+                    breaker.record_cancelled()
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+
+
+async def _aclose(deltas):
+    aclose = getattr(deltas, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def hedged(primary, secondary, delay):
+    """
+    Runs primary() and, if it hasn't returned after delay seconds (or fails sooner), also secondary().
+    Returns the first result, the other request is cancelled.
+
+    Parameters:
+    - primary, secondary (callable): Return an awaitable of the result, which raises if the request fails.
+    - delay (float): Seconds to give primary on its own, None to only run secondary if primary fails.
+
+    Raises:
+    - The error of the request that failed last, if both fail.
+    """
+    first = asyncio.ensure_future(primary())
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done and first.exception() is None:
+            return first.result()
+
+        error = first.exception() if done else None
+        pending.add(asyncio.ensure_future(secondary()))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+        # Let the loser see its cancellation (and record it) before the result is used
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _close_streams(tasks, streams, winner=None):
+    # Cancels the first-delta tasks still running, then closes every stream but the winner
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+    for stream in streams:
+        if stream is not winner:
+            await _aclose(stream)
+
+
+async def _first_delta(deltas):
+    try:
+        return True, await deltas.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def hedged_stream(primary, secondary, delay):
+    """
+    Streaming version of hedged: runs primary() and, if it hasn't yielded a delta after delay seconds (or
+    ends or fails without one sooner), also secondary(). Yields the deltas of whichever stream yields
+    first, the other one is closed before the first delta is yielded (so it doesn't keep its connection
+    and its place in the provider's concurrency limit while the winner streams).
+
+    Parameters:
+    - primary, secondary (callable): Return an async iterator of deltas.
+    - delay (float): Seconds to give primary on its own, None to only run secondary if primary fails.
+
+    Raises:
+    - The error of the stream that failed last, if neither yields a delta and one of them failed.
+    """
+    streams = [primary()]
+    tasks = {asyncio.ensure_future(_first_delta(streams[0])): streams[0]}
+    winner = None
+    error = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        while True:
+            for task in done:
+                stream = tasks.pop(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                elif task.result()[0]:
+                    winner, first = stream, task.result()[1]
+                    break
+            if winner is not None:
+                break
+            if len(streams) == 1:
+                streams.append(secondary())
+                tasks[asyncio.ensure_future(_first_delta(streams[1]))] = streams[1]
+            if not tasks:
+                if error is not None:
+                    raise error
+                return
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        await _close_streams(tasks, streams, winner)
+        yield first
+        async for delta in winner:
+            yield delta
+    finally:
+        await _close_streams(tasks, streams)
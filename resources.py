@@ -0,0 +1,117 @@
+"""
+Objects shared by every page, session and rerun of the app, created once per process with
+st.cache_resource.
+
+Streamlit runs a page's whole script again on every widget change, so anything built at the top of a
+page (a client, a coloured lexicon, a memo) would be built again on every click and lose what it had
+cached. Each getter below builds its object on first use, importing what it needs only then, and returns
+the same object to every later caller. The objects are safe to share between the threads Streamlit runs
+sessions in: they are read-only once built, or only keep memos (plain dicts) and connection pools.
+
+The tokenizers (token_counter.token_counter) and parsed prompt templates (prompt_templates.
+compile_template) are already cached per process in their own modules, so they need no getter here.
+
+show_queue_position, which both model pages show while their requests wait, lives here too.
+"""
+
+import streamlit as st
+
+
+@st.cache_resource
+def get_color_coder():
+    """
+    The ColorCoder for the frequency lists, with its memo of word colours.
+    """
+    from color_coder import ColorCoder
+    from word_lists import freq_colored_dict
+
+    return ColorCoder(freq_colored_dict)
+
+
+@st.cache_resource
+def get_lexical_profiler():
+    from lexical_profile import LexicalProfiler
+
+    return LexicalProfiler()
+
+
+@st.cache_resource
+def get_sentence_simplifier():
+    from sentence_simplifier import SentenceSimplifier
+
+    return SentenceSimplifier(get_lexical_profiler())
+
+
+@st.cache_resource
+def get_async_processor(llm_choice, google_api_key, openai_api_key, hedge=False):
+    """
+    One processor, and so one pool of connections, per provider and API key, shared by every session.
+    With hedge, slow or failing requests are also sent to another provider.
+
+    Parameters:
+    - llm_choice (str): A label from genai_processor.PROVIDERS, or AUTO_PROVIDER.
+    """
+    from genai_processor import AUTO_PROVIDER, PROVIDERS, HedgedProcessor, RoutedProcessor
+
+    if llm_choice == AUTO_PROVIDER:
+        return RoutedProcessor(
+            [get_async_processor(choice, google_api_key, openai_api_key) for choice in PROVIDERS],
+            hedge=hedge,
+        )
+    if hedge:
+        other_choice = next(choice for choice in PROVIDERS if choice != llm_choice)
+        return HedgedProcessor(
+            get_async_processor(llm_choice, google_api_key, openai_api_key),
+            get_async_processor(other_choice, google_api_key, openai_api_key),
+        )
+    return PROVIDERS[llm_choice](google_api_key, openai_api_key)
+
+
+@st.cache_resource
+def get_art_gallery(openai_api_key):
+    """
+    The Art Gallery's ArtGallery for the API key, whose async client runs on the shared background loop.
+    """
+    import openai
+
+    from art_gallery import ArtGallery
+
+    return ArtGallery(openai.AsyncOpenAI(api_key=openai_api_key), get_image_store())
+
+
+@st.cache_resource
+def get_gallery_pool(openai_api_key):
+    """
+    The Art Gallery's paintings shared by every session, see art_gallery.GalleryPool.
+    """
+    from art_gallery import GalleryPool
+
+    return GalleryPool(get_art_gallery(openai_api_key))
+
+
+@st.cache_resource
+def get_image_store():
+    from image_store import ImageStore
+
+    return ImageStore()
+
+
+@st.cache_resource
+def get_dialogue_store():
+    from dialogue_store import DialogueStore
+
+    return DialogueStore()
+
+
+def show_queue_position(placeholder, processor, llm_choice, settings):
+    """
+    While this session's requests wait for the model's rate limit, shows how many sessions are ahead.
+    """
+    position = processor.queue_position(settings)
+    if position is None:
+        placeholder.empty()
+    elif position == 0:
+        placeholder.caption(f"Waiting for {llm_choice}: you're next")
+    else:
+        sessions = "session" if position == 1 else "sessions"
+        placeholder.caption(f"Waiting for {llm_choice}: {position} {sessions} ahead of you")
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Cache of model responses keyed on the provider, model, prompt and sampling parameters of a request.
+
+    Responses are kept in an in-process LRU and, if a path is given, in a SQLite file that outlives the
+    process and can be shared by several. Each key can hold several variants so that sampled requests
+    (e.g. dialogues) still vary once cached.
+
+    Parameters:
+    - max_entries (int): Number of keys kept in memory.
+    - path (str): SQLite file for the on-disk tier. None keeps the cache in memory only.
+    - ttl (float): Seconds before an on-disk response expires. Expired responses are never returned, and
+      are deleted when a response is stored, at most once every expire_interval seconds.
+    - max_disk_entries (int): Number of responses kept on disk, the least recently used are evicted first.
+    """
+
+    # Seconds between deletes of expired responses
+    expire_interval = 3600
+
+    def __init__(self, max_entries=256, path=None, ttl=7 * 24 * 3600, max_disk_entries=10_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()  # key -> list of response variants, least recently used first
+        self._lock = threading.Lock()
+        self._db = None
+        self._expired_at = None  # When expired responses were last deleted
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT, variant INTEGER, response TEXT, created REAL, last_used REAL,"
+                " PRIMARY KEY (key, variant))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(provider, model, prompt, **sampling_params):
+        """
+        Hashes a request into a cache key. Whitespace in the prompt is normalised, so prompts that only
+        differ in indentation or line breaks share a key.
+        """
+        request = {
+            "provider": provider,
+            "model": model,
+            "prompt": " ".join(prompt.split()),
+            "sampling_params": sampling_params,
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key, variants=1):
+        """
+        Returns a cached response for key, or None on a miss.
+
+        A key only counts as a hit once it holds the requested number of variants, so the first
+        `variants` requests for it still go to the model. After that a random variant is returned.
+        """
+        with self._lock:
+            responses = self._memory.get(key)
+            from_disk = False
+            if responses is not None:
+                self._memory.move_to_end(key)
+            elif self._db is not None:
+                responses = self._load(key)
+                if responses:
+                    from_disk = True
+                    self._remember(key, responses)
+
+            if not responses or len(responses) < variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += from_disk
+            return random.choice(responses)
+
+    def add(self, key, response, variants=1):
+        """
+        Stores response for key, keeping up to `variants` responses per key.
+        """
+        if response is None:
+            return
+
+        with self._lock:
+            responses = self._memory.get(key)
+            if responses is None and self._db is not None:
+                responses = self._load(key)
+            responses = list(responses or [])
+            if len(responses) >= variants:
+                responses.pop(0)
+            responses.append(response)
+            self._remember(key, responses)
+
+            if self._db is not None:
+                self._store(key, responses)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._memory),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def _remember(self, key, responses):
+        self._memory[key] = responses
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key):
+        # Expired rows are skipped here and deleted by _expire, so a miss doesn't write to the file
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT response FROM responses WHERE key = ? AND created >= ? ORDER BY variant",
+            (key, now - self.ttl),
+        ).fetchall()
+        if rows:
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return [response for (response,) in rows]
+
+    def _expire(self, now):
+        if self._expired_at is not None and now - self._expired_at < self.expire_interval:
+            return
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._expired_at = now
+
+    def _store(self, key, responses):
+        now = time.time()
+        self._expire(now)
+        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._db.executemany(
+            "INSERT INTO responses VALUES (?, ?, ?, ?, ?)",
+            [(key, variant, response, now, now) for variant, response in enumerate(responses)],
+        )
+        # Evict the least recently used responses once the file is over its size limit
+        self._db.execute(
+            "DELETE FROM responses WHERE rowid IN ("
+            " SELECT rowid FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        self._db.commit()
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import re
+
+from lexical_profile import LexicalProfiler, level_band
+from token_counter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Input tokens per chunk, a few sentences: small enough that chunks finish quickly side by side, large
+# enough that each rewrite has some context of its own
+CHUNK_TOKENS = 300
+
+# A sentence ends at ., ! or ? (and any closing quotes or brackets) followed by whitespace
+_SENTENCE_END = re.compile(r"(?<=[.!?])([\"'”’)\]]*)(\s+)")
+
+# Titles and abbreviations that end in a full stop without ending the sentence (as do initials)
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "jr", "sr", "vs", "etc", "e.g", "i.e", "no"}
+
+
+def split_sentences(text):
+    """
+    Splits text into sentences, keeping the whitespace after each so the text can be put back together
+    exactly (including its paragraph breaks).
+
+    Returns:
+    - list: (sentence, whitespace) tuples, "".join(sentence + whitespace) gives back text.
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        last_word = text[start : match.start()].rsplit(None, 1)[-1].rstrip(".").lower()
+        is_initial = len(last_word) == 1 and last_word.isalpha() and last_word != "i"
+        if last_word in _ABBREVIATIONS or is_initial:
+            continue
+        sentences.append((text[start : match.start(2)], match.group(2)))
+        start = match.end()
+    if start < len(text):
+        sentences.append((text[start:], ""))
+    return sentences
+
+
+class SentenceSimplifier:
+    """
+    Simplifies only the sentences of a text that are above the learner's level. Each sentence is scored
+    against the word lists locally, sentences that already use vocabulary within the learner's band are
+    kept as they are, and runs of the rest are grouped into chunks that are sent to the model in parallel
+    and streamed back in their place.
+
+    Chunks never cross a paragraph break and stay within a token budget, so long documents are never
+    truncated by max_tokens or the context window, and finish in about the time of the slowest chunk.
+
+    Parameters:
+    - profiler (LexicalProfiler): Scores the sentences.
+    - min_coverage (float): Share of a sentence's words that must be within the learner's band for it to
+      be kept as it is. 95% is the usual threshold for reading with little help.
+    - chunk_tokens (int): Input token budget per chunk. Sentences over the budget (or text without
+      sentence punctuation) are split between words.
+    - max_parallel (int): Number of chunks of one text being simplified at once.
+    - context_sentences (int): Number of sentences on each side sent along with a chunk as context.
+    """
+
+    def __init__(
+        self,
+        profiler=None,
+        min_coverage=0.95,
+        chunk_tokens=CHUNK_TOKENS,
+        max_parallel=4,
+        context_sentences=1,
+    ):
+        self.profiler = profiler or LexicalProfiler()
+        self.min_coverage = min_coverage
+        self.chunk_tokens = chunk_tokens
+        self.max_parallel = max_parallel
+        self.context_sentences = context_sentences
+
+    def plan(self, text, learner_level):
+        """
+        Scores each sentence of text against the band of learner_level.
+
+        Returns:
+        - list: One dict per sentence with the keys sentence, whitespace (what follows it), coverage and
+          simplify (whether it is above the learner's level). Nothing is marked for simplifying if
+          learner_level is not a CEFR level.
+        """
+        band = level_band(learner_level)
+        plan = []
+        for sentence, whitespace in self.split_long(split_sentences(text)):
+            coverage = self.profiler.coverage(sentence, band) if band else 1.0
+            plan.append(
+                {
+                    "sentence": sentence,
+                    "whitespace": whitespace,
+                    "coverage": coverage,
+                    "simplify": coverage < self.min_coverage,
+                }
+            )
+        return plan
+
+    def split_long(self, sentences):
+        """
+        Splits (sentence, whitespace) tuples over chunk_tokens between words into pieces within it.
+        """
+        for sentence, whitespace in sentences:
+            if estimate_tokens(sentence) <= self.chunk_tokens:
+                yield sentence, whitespace
+                continue
+
+            words = re.findall(r"\S+\s*", sentence)
+            piece = []
+            tokens = 0
+            for word in words:
+                word_tokens = estimate_tokens(word)
+                if piece and tokens + word_tokens > self.chunk_tokens:
+                    text = "".join(piece)
+                    yield text.rstrip(), text[len(text.rstrip()) :]
+                    piece, tokens = [], 0
+                piece.append(word)
+                tokens += word_tokens
+            yield "".join(piece), whitespace
+
+    def chunks(self, plan):
+        """
+        Groups consecutive sentences marked for simplifying into chunks.
+
+        Returns:
+        - list: (start, end) ranges of plan, in order.
+        """
+        chunks = []
+        start = None
+        tokens = 0
+        for i, part in enumerate(plan):
+            if not part["simplify"]:
+                if start is not None:
+                    chunks.append((start, i))
+                    start = None
+                continue
+
+            sentence_tokens = estimate_tokens(part["sentence"])
+            if start is not None and tokens + sentence_tokens > self.chunk_tokens:
+                chunks.append((start, i))
+                start = None
+            if start is None:
+                start, tokens = i, 0
+            tokens += sentence_tokens
+
+            if "\n" in part["whitespace"]:
+                chunks.append((start, i + 1))
+                start = None
+        if start is not None:
+            chunks.append((start, len(plan)))
+        return chunks
+
+    def prompts(self, plan, chunks, create_prompt):
+        """
+        Renders a prompt for each chunk.
+
+        Parameters:
+        - create_prompt (callable): Takes a passage and its context, e.g.
+          LanguageModelProcessor.create_compre_passage_prompt.
+
+        Returns:
+        - list: One prompt per chunk.
+        """
+        prompts = []
+        for start, end in chunks:
+            around = plan[max(0, start - self.context_sentences) : end + self.context_sentences]
+            context = " ".join(part["sentence"] for part in around)
+            prompts.append(create_prompt(self.join(plan[start:end]).strip(), context))
+        return prompts
+
+    async def stream(self, plan, chunks, prompts, simplify_text, errors=None):
+        """
+        Simplifies every chunk, at most max_parallel at a time, and yields the text in order as soon as
+        each part of it is ready: sentences that are kept straight away, chunks once they and every chunk
+        before them are done.
+
+        Parameters:
+        - simplify_text (callable): Coroutine function that takes a prompt and returns the simplified
+          text, raising if the request fails (e.g. AsyncChatGPTProcessor.simplify_text, which sizes
+          max_tokens to the prompt).
+        - errors (list): Filled in with the error of each chunk that failed, so a caller can say why
+          some of the text was kept.
+
+        Yields:
+        - str: The next part of the text. Chunks that failed (raised or returned nothing) are kept as they
+          were, and their errors logged.
+        """
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def simplify(prompt):
+            async with semaphore:
+                return await simplify_text(prompt)
+
+        tasks = [asyncio.ensure_future(simplify(prompt)) for prompt in prompts]
+        try:
+            position = 0
+            for (start, end), task in zip(chunks, tasks):
+                if position < start:
+                    yield self.join(plan[position:start])
+
+                try:
+                    response = await task
+                except Exception as e:
+                    logger.warning("Could not simplify sentences %d to %d: %r", start, end - 1, e)
+                    if errors is not None:
+                        errors.append(e)
+                    response = None
+                simplified = (response or "").strip()
+                if simplified:
+                    yield simplified + plan[end - 1]["whitespace"]
+                else:
+                    yield self.join(plan[start:end])
+                position = end
+
+            if position < len(plan):
+                yield self.join(plan[position:])
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def simplify(self, plan, chunks, prompts, simplify_text, errors=None):
+        """
+        Non-streaming version of stream, returns the whole text.
+        """
+        parts = self.stream(plan, chunks, prompts, simplify_text, errors)
+        return "".join([part async for part in parts])
+
+    @staticmethod
+    def join(parts):
+        """
+        Puts sentences from a plan back together, with their original whitespace.
+        """
+        return "".join(part["sentence"] + part["whitespace"] for part in parts)
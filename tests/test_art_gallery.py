@@ -0,0 +1,72 @@
+import itertools
+import time
+
+from art_gallery import GalleryPool
+from genai_processor import run_async
+from image_store import ImageStore
+
+
+class FakeGallery:
+    """
+    Paints a new image of a numbered description for every request, without a client.
+    """
+
+    def __init__(self, image_store):
+        self.image_store = image_store
+        self.painted = 0
+        self._numbers = itertools.count()
+
+    async def generate_painting(self, style, style_characteristics):
+        number = next(self._numbers)
+        key = self.image_store.make_key(style, f"painting {number}", "fake", "1x1")
+        self.image_store.add(key, f"image {number}".encode())
+        self.painted += 1
+        return f"painting {number}", key
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def make_pool(tmp_path, **kwargs):
+    gallery = FakeGallery(ImageStore(str(tmp_path / "images")))
+    return GalleryPool(gallery, str(tmp_path / "pool.db"), **kwargs)
+
+
+def paint(pool, style):
+    pool.add(style, *run_async(pool.gallery.generate_painting(style, "")))
+
+
+def test_draws_a_styles_whole_pool_without_repeats(tmp_path):
+    pool = make_pool(tmp_path, depth=5)
+    for _ in range(5):
+        paint(pool, "Baroque")
+
+    seen = set()
+    drawn = [pool.draw("Baroque", seen)[1] for _ in range(5)]
+    assert len(set(drawn)) == 5
+    assert seen == set(drawn)
+    # The style is full, so drawing didn't start any more
+    assert pool.gallery.painted == 5
+    # Every painting was shown, so there is nothing left for the session until the pool is refilled
+    assert pool.draw("Baroque", seen) is None
+    assert pool.stats()["hits"] == 5 and pool.stats()["misses"] == 1
+
+    paint(pool, "Baroque")
+    description, image_key = pool.draw("Baroque", seen)
+    assert description == "painting 5" and image_key not in drawn
+
+
+def test_replenishes_a_style_up_to_its_depth(tmp_path):
+    pool = make_pool(tmp_path, depth=6, concurrency=2)
+
+    assert pool.draw("Baroque", set()) is None
+    wait_for(lambda: pool.count("Baroque") == 6 and not pool._generating["Baroque"])
+    # Each painting that is added starts the next one, and none past the depth
+    time.sleep(0.05)
+    assert pool.count("Baroque") == 6
+    assert pool.gallery.painted == 6
+    assert pool.count("Futurism") == 0
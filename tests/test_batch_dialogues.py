@@ -0,0 +1,152 @@
+import json
+import logging
+
+import pytest
+
+from batch_dialogues import BatchJob, LocalBatchBackend
+from genai_processor import FakeProcessor
+
+
+class ScriptedBackend:
+    """
+    Batch backend whose batches finish when the test says so, and that remembers every request it was
+    sent, like a provider that keeps batches across runs of a job.
+    """
+
+    provider = "scripted"
+    model = "scripted"
+
+    def __init__(self):
+        self.sampling_params = {}
+        self.submitted = []  # Request IDs in the order they were sent
+        self.batches = {}  # batch ID -> request IDs
+        self.statuses = {}  # batch ID -> "pending", "completed" or "failed"
+        self.polled = []
+        self.interrupt_after = None  # Number of batches to accept before the job is interrupted
+
+    def submit(self, requests):
+        if self.interrupt_after is not None and len(self.batches) == self.interrupt_after:
+            raise KeyboardInterrupt
+        batch_id = f"batch_{len(self.batches)}"
+        self.batches[batch_id] = [request["id"] for request in requests]
+        self.statuses[batch_id] = "completed"
+        self.submitted += self.batches[batch_id]
+        return batch_id
+
+    def status(self, batch_id):
+        self.polled.append(batch_id)
+        return self.statuses[batch_id]
+
+    def results(self, batch_id):
+        return {request_id: f"Dialogue {request_id}" for request_id in self.batches[batch_id]}
+
+
+def make_requests(n):
+    return [{"word": f"word{i}", "prompt": f"Prompt {i}"} for i in range(n)]
+
+
+def stored_ids(store_path):
+    with open(store_path, encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+def test_resumes_an_interrupted_job_without_repeating_or_losing_requests(tmp_path):
+    backend = ScriptedBackend()
+    store_path = str(tmp_path / "dialogues.jsonl")
+    requests = make_requests(7)
+    job = BatchJob(backend, store_path, batch_size=3, poll_interval=0)
+    ids = [job.request_id(request) for request in requests]
+
+    # The job stops after submitting its first batch, before checking on it
+    backend.interrupt_after = 1
+    with pytest.raises(KeyboardInterrupt):
+        job.run(requests)
+    assert backend.submitted == ids[:3]
+
+    backend.interrupt_after = None
+    assert BatchJob(backend, store_path, batch_size=3, poll_interval=0).run(requests) == 0
+    # The first batch was polled again rather than resubmitted
+    assert "batch_0" in backend.polled
+    assert backend.submitted == ids
+    assert sorted(stored_ids(store_path)) == sorted(ids)
+
+
+def test_polls_pending_batches_until_they_finish(tmp_path, monkeypatch):
+    backend = ScriptedBackend()
+    store_path = str(tmp_path / "dialogues.jsonl")
+    requests = make_requests(4)
+    job = BatchJob(backend, store_path, batch_size=2, poll_interval=0)
+
+    def finish_batches(seconds):
+        # The batches finish while the job waits
+        for batch_id in backend.statuses:
+            backend.statuses[batch_id] = "completed"
+
+    submit = backend.submit
+
+    def submit_pending(requests):
+        batch_id = submit(requests)
+        backend.statuses[batch_id] = "pending"
+        return batch_id
+
+    backend.submit = submit_pending
+    monkeypatch.setattr("batch_dialogues.time.sleep", finish_batches)
+    assert job.run(requests) == 0
+    assert backend.polled == ["batch_0", "batch_1", "batch_0", "batch_1"]
+    assert len(stored_ids(store_path)) == 4
+
+
+def test_skips_done_rows_and_resubmits_failed_batches(tmp_path):
+    backend = ScriptedBackend()
+    store_path = str(tmp_path / "dialogues.jsonl")
+    requests = make_requests(4)
+    job = BatchJob(backend, store_path, batch_size=2, poll_interval=0)
+    ids = [job.request_id(request) for request in requests]
+
+    submit = backend.submit
+
+    def fail_second_batch(requests):
+        batch_id = submit(requests)
+        if batch_id == "batch_1":
+            backend.statuses[batch_id] = "failed"
+        return batch_id
+
+    backend.submit = fail_second_batch
+    assert job.run(requests) == 2
+    assert stored_ids(store_path) == ids[:2]
+
+    # Only the failed batch's requests are sent again, once
+    backend.submit = submit
+    assert job.run(requests) == 0
+    assert backend.submitted == ids + ids[2:]
+    assert sorted(stored_ids(store_path)) == sorted(ids)
+
+    # Everything is done, so nothing is sent
+    assert job.run(requests) == 0
+    assert backend.submitted == ids + ids[2:]
+
+
+class FlakyProcessor(FakeProcessor):
+    def __init__(self, fail):
+        super().__init__(first_token_delay=0, delay=0)
+        self.fail = fail
+
+    def generate_convo(self, prompt, cache=True, variants=1, settings=None, **sampling_params):
+        if prompt in self.fail:
+            raise RuntimeError("The provider is down")
+        return super().generate_convo(prompt, cache, variants, settings, **sampling_params)
+
+
+def test_local_backend_logs_failed_requests_and_retries_them(tmp_path, caplog):
+    store_path = str(tmp_path / "dialogues.jsonl")
+    requests = make_requests(3)
+    backend = LocalBatchBackend(str(tmp_path / "batches"), FlakyProcessor({"Prompt 1"}))
+    job = BatchJob(backend, store_path, poll_interval=0)
+
+    with caplog.at_level(logging.WARNING, logger="batch_dialogues"):
+        assert job.run(requests) == 1
+    assert "Local batch request" in caplog.text and "The provider is down" in caplog.text
+
+    backend.processor.fail = set()
+    assert job.run(requests) == 0
+    assert sorted(stored_ids(store_path)) == sorted(job.request_id(request) for request in requests)
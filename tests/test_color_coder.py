@@ -0,0 +1,84 @@
+from color_coder import ColorCoder, iter_paragraphs
+
+COLORS = {
+    "THE": "green",
+    "CAT": "green",
+    "SAT": "green",
+    "WELL": "green",
+    "KNOWN": "green",
+    "DO": "blue",
+    "PEOPLE": "blue",
+}
+
+
+def span(color, words):
+    return f'<span style="color: {color};">{words}</span>'
+
+
+def test_iter_paragraphs_splits_on_blank_lines():
+    text = "One.\nStill one.\n\nTwo.\n \t\n\n  Three.  \n\n"
+    assert list(iter_paragraphs(text)) == ["One.\nStill one.", "Two.", "Three."]
+
+
+def test_iter_paragraphs_finds_breaks_split_across_pieces():
+    text = "One.\nStill one.\n\nTwo.\n \t\n\n  Three.  \n\nFour"
+    expected = list(iter_paragraphs(text))
+
+    assert list(iter_paragraphs(iter(text))) == expected
+    pieces = ["One.\nStill one.\n", "\nTwo.\n ", "\t", "\n\n  Three.", "  \n\nFour"]
+    assert list(iter_paragraphs(pieces)) == expected
+
+
+def test_iter_paragraphs_yields_each_paragraph_once_it_ends():
+    pieces = iter(["First", " paragraph.\n", "\nSecond", " paragraph.", "\n\nThird."])
+    paragraphs = iter_paragraphs(pieces)
+
+    assert next(paragraphs) == "First paragraph."
+    assert list(pieces) == [" paragraph.", "\n\nThird."]  # Read no further than the break
+
+
+def test_colorize_text_keeps_punctuation_out_of_the_words():
+    coder = ColorCoder(COLORS)
+
+    assert coder.colorize_text("The cat sat.") == span("green", "The cat sat") + "."
+    assert coder.colorize_text("(cat) sat!") == f"({span('green', 'cat')}) {span('green', 'sat')}!"
+
+
+def test_colorize_text_looks_up_contractions_and_possessives_by_their_base():
+    coder = ColorCoder(COLORS)
+
+    assert coder.colorize_text("Don't, people's cat") == (
+        span("blue", "Don't") + ", " + span("blue", "people's") + " " + span("green", "cat")
+    )
+    assert coder.colorize_text("cat’s") == span("green", "cat’s")
+
+
+def test_colorize_text_colours_hyphenated_words_apart():
+    coder = ColorCoder(COLORS)
+
+    assert coder.colorize_text("well-known") == f"{span('green', 'well')}-{span('green', 'known')}"
+
+
+def test_colorize_text_gives_off_list_words_the_default_colour():
+    coder = ColorCoder(COLORS)
+
+    assert coder.colorize_text("The zebra sat") == (
+        f"{span('green', 'The')} {span(coder.default_color, 'zebra')} {span('green', 'sat')}"
+    )
+
+
+def test_colorize_text_escapes_html_between_words():
+    coder = ColorCoder(COLORS)
+
+    assert coder.colorize_text("<cat> & 3\nthe") == (
+        f"&lt;{span('green', 'cat')}&gt; &amp; 3<br>{span('green', 'the')}"
+    )
+
+
+def test_colorize_many_in_worker_processes_matches_colorize_text():
+    coder = ColorCoder(COLORS)
+    texts = [f"The cat sat {i} times. Don't <cat> the zebra!\n\nWell-known." * (i + 1) for i in range(9)]
+
+    expected = [coder.colorize_text(text) for text in texts]
+    assert coder.colorize_many(texts, max_workers=2, chunksize=2) == expected
+    assert list(coder.colorize_stream(iter(texts), max_workers=2, chunksize=2)) == expected
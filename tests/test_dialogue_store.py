@@ -0,0 +1,111 @@
+import csv
+import json
+import sqlite3
+import zlib
+
+from batch_dialogues import BatchJob, LocalBatchBackend, read_requests
+from dialogue_store import DialogueStore, context_bucket
+from genai_processor import RequestSettings
+
+SETTINGS = RequestSettings(
+    practice_language="Spanish",
+    learner_level="B1",
+    formality="Balanced",
+    conversation_context="Ordering food at a restaurant",
+)
+
+
+def test_context_bucket_ignores_wording():
+    assert context_bucket("Ordering food at a restaurant") == context_bucket("restaurant, ordering FOOD")
+
+
+def test_dialogues_are_not_shared_between_forms_of_a_word(tmp_path):
+    store = DialogueStore(str(tmp_path / "dialogues.db"))
+    store.add("ability", SETTINGS, "A dialogue about ability")
+
+    assert store.get("  Ability ", SETTINGS) == "A dialogue about ability"
+    assert store.get("abilities", SETTINGS) is None
+    assert store.get("unable", SETTINGS) is None
+
+
+def test_dialogues_with_extras_are_kept_apart(tmp_path):
+    store = DialogueStore(str(tmp_path / "dialogues.db"))
+    store.add("run", SETTINGS.replace(translation_on=True), "A dialogue with a translation")
+
+    assert store.get("run", SETTINGS) is None
+    assert store.get("run", SETTINGS.replace(highlight_mistakes_on=True)) is None
+    assert store.get("run", SETTINGS.replace(preferred_language="French", translation_on=True)) is None
+    assert store.get("run", SETTINGS.replace(translation_on=True)) == "A dialogue with a translation"
+
+
+def test_keeps_a_few_variants_per_key(tmp_path):
+    store = DialogueStore(str(tmp_path / "dialogues.db"), variants=2)
+    for i in range(3):
+        store.add("run", SETTINGS, f"Dialogue {i}")
+
+    assert store.stats()["dialogues"] == 2
+    assert store.get("run", SETTINGS) in {"Dialogue 1", "Dialogue 2"}
+
+
+def test_moves_a_store_written_before_the_extras_to_the_current_key(tmp_path):
+    path = str(tmp_path / "dialogues.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE dialogues (word TEXT, practice_language TEXT, learner_level TEXT, formality TEXT,"
+        " context TEXT, variant INTEGER, dialogue BLOB, created REAL)"
+    )
+    key = DialogueStore.make_key("run", SETTINGS)[:5]
+    db.execute(
+        "INSERT INTO dialogues VALUES (?, ?, ?, ?, ?, 0, ?, 1.0)", (*key, zlib.compress(b"A dialogue"))
+    )
+    db.commit()
+    db.close()
+
+    store = DialogueStore(path)
+    assert store.get("run", SETTINGS) == "A dialogue"
+    assert store.get("run", SETTINGS.replace(translation_on=True)) is None
+    tables = store._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    assert tables == [("dialogues",)]
+
+
+def test_keeps_a_store_written_under_a_headword_key_aside(tmp_path, caplog):
+    path = str(tmp_path / "dialogues.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE dialogues (headword TEXT, dialogue BLOB)")
+    db.execute("INSERT INTO dialogues VALUES ('ABLE', 'A dialogue')")
+    db.commit()
+    db.close()
+
+    store = DialogueStore(path)
+    assert "kept in the table" in caplog.text
+    store.add("run", SETTINGS, "A dialogue")
+    assert store.get("run", SETTINGS) == "A dialogue"
+
+    (old_table,) = store._db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name != 'dialogues'"
+    ).fetchone()
+    assert store._db.execute(f"SELECT * FROM {old_table}").fetchall() == [("ABLE", "A dialogue")]
+
+
+def test_imports_batch_dialogues_under_their_extras(tmp_path):
+    csv_path = tmp_path / "words.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["word", "language", "level", "context"])
+        writer.writerow(["run", "Spanish", "B1", "Ordering food at a restaurant"])
+
+    jsonl_path = str(tmp_path / "dialogues.jsonl")
+    requests = read_requests(str(csv_path), {"translation_on": True})
+    job = BatchJob(LocalBatchBackend(str(tmp_path / "batches")), jsonl_path, poll_interval=0)
+    assert job.run(requests) == 0
+
+    store = DialogueStore(str(tmp_path / "dialogues.db"))
+    with open(jsonl_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert store.add_many(records) == 1
+    assert store.get("run", SETTINGS) is None
+    assert store.get("run", SETTINGS.replace(translation_on=True)) is not None
+
+    # Records from before the extras were written can't be told apart, so they are skipped
+    old_record = {key: value for key, value in records[0].items() if key != "translation_on"}
+    assert store.add_many([old_record]) == 0
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+import uuid
+
+import pytest
+
+from genai_processor import (
+    ApiKeyCache,
+    AsyncFakeProcessor,
+    HedgedProcessor,
+    PromptTooLongError,
+    RequestSettings,
+    RoutedProcessor,
+    completed_async,
+    error_message,
+    iter_async,
+    run_async,
+    submit_async,
+    wait_async,
+)
+from resilience import CircuitOpenError, RetryPolicy
+
+
+def fake(**kwargs):
+    # Each test gets providers of its own, latencies and breakers are tracked per provider
+    kwargs.setdefault("first_token_delay", 0)
+    kwargs.setdefault("delay", 0)
+    return AsyncFakeProcessor(provider=f"fake-{uuid.uuid4().hex}", **kwargs)
+
+
+async def collect(deltas):
+    return [delta async for delta in deltas]
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class FailingProcessor(AsyncFakeProcessor):
+    """
+    Fails every request with error, retrying without waiting.
+    """
+
+    retry_policy = RetryPolicy(base_delay=0)
+
+    def __init__(self, error, **kwargs):
+        super().__init__(**kwargs)
+        self.error = error
+
+    async def _complete(self, prompt, api_key, **sampling_params):
+        raise self.error
+
+    async def _stream(self, prompt, api_key, **sampling_params):
+        raise self.error
+        yield
+
+
+def failing(error):
+    return FailingProcessor(error, provider=f"fake-{uuid.uuid4().hex}")
+
+
+def test_generate_convo_answers_and_caches():
+    processor = fake(response="Hola, ¿qué tal?")
+
+    assert run_async(processor.generate_convo("prompt")) == "Hola, ¿qué tal?"
+    assert len(processor.latency.latencies) == 1
+
+    # The second request is served from the response cache, without calling the provider
+    assert run_async(processor.generate_convo("prompt")) == "Hola, ¿qué tal?"
+    assert len(processor.latency.latencies) == 1
+
+
+def test_stream_convo_yields_the_response_word_by_word():
+    processor = fake(response="Uno dos tres")
+
+    deltas = run_async(collect(processor.stream_convo("prompt", cache=False)))
+    assert deltas == ["Uno ", "dos ", "tres"]
+
+
+def test_requests_use_their_own_settings():
+    processor = fake()
+    settings = RequestSettings(practice_language="Spanish", learner_level="A1")
+
+    prompt = processor.create_convo_prompt("comer", settings)
+    assert "Spanish" in prompt and "comer" in prompt
+    assert run_async(processor.generate_convo(prompt, cache=False, settings=settings)) == prompt
+
+
+def test_api_key_cache_keeps_the_most_recently_used_keys_hashed():
+    cache = ApiKeyCache(max_entries=2)
+    first = cache.get_or_create("sk-first", object)
+    cache.get_or_create("sk-second", object)
+    # Scopes (e.g. providers) keep their own object per key
+    assert cache.get("sk-first", "gemini") is None
+
+    assert cache.get_or_create("sk-first", object) is first
+    cache.get_or_create("sk-third", object)
+    assert len(cache) == 2
+    assert cache.get("sk-second") is None and cache.get("sk-first") is first
+    assert not any("sk-" in part for key in cache._entries for part in key)
+
+
+def test_hedged_request_uses_the_faster_processor():
+    slow = fake(response="slow", first_token_delay=5)
+    quick = fake(response="quick")
+    processor = HedgedProcessor(slow, quick, default_delay=0.05)
+
+    start = time.perf_counter()
+    assert run_async(processor.generate_convo("prompt", cache=False)) == "quick"
+    assert time.perf_counter() - start < 1
+
+    deltas = run_async(collect(processor.stream_convo("prompt", cache=False)))
+    assert "".join(deltas) == "quick"
+
+
+def test_unknown_processors_rank_after_healthy_known_ones():
+    known = fake()
+    unknown = fake()
+    for _ in range(known.latency.min_samples):
+        known.latency.add(0.5)
+
+    router = RoutedProcessor([unknown, known], explore=0)
+    assert router.ranked() == [known, unknown]
+
+
+def test_hung_processor_that_loses_a_hedge_is_judged(monkeypatch):
+    monkeypatch.setattr(HedgedProcessor, "default_delay", 0.05)
+    hung = fake(response="hung", first_token_delay=60)
+    quick = fake(response="quick")
+    router = RoutedProcessor([hung, quick], explore=0)
+
+    assert run_async(router.generate_convo("prompt", cache=False)) == "quick"
+    # Cancelled when quick answered, which counts as a failure
+    assert hung.latency.error_rate() == 1.0
+    assert router.ranked() == [quick, hung]
+
+    monkeypatch.setattr(HedgedProcessor, "default_delay", 10.0)
+    start = time.perf_counter()
+    assert run_async(router.generate_convo("prompt", cache=False)) == "quick"
+    assert time.perf_counter() - start < 1
+
+
+def test_streams_cancelled_before_their_first_delta_are_judged(monkeypatch):
+    monkeypatch.setattr(HedgedProcessor, "default_delay", 0.05)
+    hung = fake(response="hung", first_token_delay=60)
+    quick = fake(response="quick")
+    router = RoutedProcessor([hung, quick], explore=0)
+
+    assert "".join(run_async(collect(router.stream_convo("prompt", cache=False)))) == "quick"
+    assert hung.latency.error_rate() == 1.0
+    assert quick.latency.error_rate() == 0.0
+
+
+def test_failed_requests_raise_their_error_and_log_it(caplog):
+    processor = failing(ValueError("bad request"))
+
+    with caplog.at_level(logging.WARNING, logger="genai_processor"):
+        with pytest.raises(ValueError):
+            run_async(processor.generate_convo("prompt", cache=False))
+        with pytest.raises(ValueError):
+            run_async(collect(processor.stream_simplify_text("prompt", cache=False)))
+    assert "bad request" in caplog.text
+    assert processor.latency.error_rate() == 1.0
+
+
+def test_open_circuit_and_long_prompts_raise_typed_errors():
+    processor = failing(ServerError("unavailable"))
+    with pytest.raises(ServerError):
+        run_async(processor.generate_convo("prompt", cache=False))
+    # Two more failed attempts open the breaker (after 5), and the third isn't sent
+    with pytest.raises(CircuitOpenError):
+        run_async(processor.generate_convo("prompt", cache=False))
+
+    small = fake()
+    small.context_window = 150
+    with pytest.raises(PromptTooLongError):
+        run_async(small.simplify_text("word " * 200, cache=False))
+    with pytest.raises(PromptTooLongError):
+        run_async(collect(small.stream_convo("word " * 200, cache=False)))
+
+
+def test_fit_max_tokens_caps_by_the_room_the_prompt_leaves():
+    processor = fake()
+    processor.context_window = 1000
+    processor.max_output_tokens = 500
+    prompt = "word " * 100
+    prompt_tokens = processor.count_tokens(prompt)
+
+    assert processor.fit_max_tokens(prompt, max_tokens=200) == 200
+    assert processor.fit_max_tokens(prompt, max_tokens=800) == 500
+    # Without max_tokens, the expected size of the response
+    expected = processor.expected_output_tokens("simplify_text", prompt)
+    assert processor.fit_max_tokens(prompt, request="simplify_text") == min(expected, 500)
+
+    processor.context_window = prompt_tokens + 300
+    assert processor.fit_max_tokens(prompt, max_tokens=800) == 300
+    processor.context_window = prompt_tokens + processor.min_output_tokens - 1
+    with pytest.raises(PromptTooLongError):
+        processor.fit_max_tokens(prompt, max_tokens=800)
+
+
+def test_requests_log_their_usage(caplog):
+    processor = fake(response="one two three")
+
+    with caplog.at_level(logging.INFO, logger="genai_processor"):
+        run_async(processor.generate_convo("prompt", cache=False))
+    (usage,) = processor.token_usage
+    assert (
+        f"{processor.provider} {processor.model} request: {usage['prompt_tokens']} prompt tokens, "
+        f"{usage['completion_tokens']} completion tokens in "
+    ) in caplog.text
+
+
+def test_hedged_processor_falls_back_on_errors_and_raises_when_both_fail():
+    down = failing(ServerError("unavailable"))
+    processor = HedgedProcessor(down, fake(response="second"), default_delay=10)
+    assert run_async(processor.generate_convo("prompt", cache=False)) == "second"
+    assert "".join(run_async(collect(processor.stream_convo("prompt", cache=False)))) == "second"
+
+    processor = HedgedProcessor(down, failing(TimeoutError()), default_delay=10)
+    with pytest.raises((TimeoutError, CircuitOpenError)):
+        run_async(processor.simplify_text("prompt", cache=False))
+
+
+def test_error_message_tells_the_errors_apart():
+    assert "too long" in error_message(PromptTooLongError("about 5,000 tokens"))
+    assert "not answering" in error_message(CircuitOpenError("openai is failing"))
+    assert "took too long" in error_message(TimeoutError())
+    assert "ServerError: unavailable" in error_message(ServerError("unavailable"))
+
+
+class Rerun(Exception):
+    """
+    Like the exception Streamlit raises in a script that is stopped for a rerun.
+    """
+
+
+def rerun():
+    raise Rerun()
+
+
+def test_on_wait_raising_mid_stream_cancels_the_next_item_and_closes_the_stream():
+    closed = []
+
+    async def words():
+        try:
+            yield "uno"
+            await asyncio.sleep(10)
+            yield "dos"
+        finally:
+            closed.append(True)
+
+    deltas = iter_async(words(), on_wait=rerun, poll_interval=0.01)
+    assert next(deltas) == "uno"
+    with pytest.raises(Rerun):
+        next(deltas)
+    assert closed == [True]
+
+
+def test_on_wait_raising_cancels_the_futures_waited_for():
+    future = submit_async(asyncio.sleep(10))
+    with pytest.raises(Rerun):
+        wait_async(future, on_wait=rerun, poll_interval=0.01)
+    assert future.cancelled()
+
+    futures = [submit_async(asyncio.sleep(0)), submit_async(asyncio.sleep(10))]
+    with pytest.raises(Rerun):
+        list(completed_async(futures, on_wait=rerun, poll_interval=0.01))
+    assert futures[1].cancelled()
@@ -0,0 +1,55 @@
+import itertools
+import os
+
+import pytest
+
+import image_store
+from image_store import ImageStore
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # Every add and get happens a second after the one before, so least recently used is well defined
+    ticks = itertools.count(1)
+    monkeypatch.setattr(image_store.time, "time", lambda: float(next(ticks)))
+
+
+def image(i, size=100):
+    return bytes([i]) * size
+
+
+def test_evicts_the_least_recently_used_images_past_the_byte_cap(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=350)
+    for i in range(3):
+        store.add(f"image-{i}", image(i))
+    # Using the oldest image makes the second one the least recently used
+    assert store.get("image-0") == image(0)
+
+    store.add("image-3", image(3))
+    store.add("image-4", image(4))
+
+    assert "image-1" not in store and "image-2" not in store
+    assert not os.path.exists(store.file_path("image-1"))
+    assert [key for key in (f"image-{i}" for i in range(5)) if key in store] == [
+        "image-0",
+        "image-3",
+        "image-4",
+    ]
+    assert store.stats()["bytes"] == 300 <= store.max_bytes
+    assert store.stats()["memory_bytes"] <= store.max_memory_bytes
+
+
+def test_total_stays_under_the_cap_as_the_store_fills(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000, max_memory_bytes=250)
+    for i in range(50):
+        store.add(f"image-{i}", image(i, size=60 + i))
+        stats = store.stats()
+        assert stats["bytes"] <= store.max_bytes
+        assert stats["memory_bytes"] <= store.max_memory_bytes
+
+    # The newest images are kept, and read back from disk once they have left memory
+    assert store.get("image-49") == image(49, size=109)
+    assert "image-0" not in store and store.get("image-0") is None
+    reopened = ImageStore(str(tmp_path), max_bytes=1000)
+    assert reopened.get("image-45") == image(45, size=105)
+    assert reopened.stats()["disk_hits"] == 1
@@ -0,0 +1,64 @@
+import pytest
+
+from lexical_profile import LexicalProfiler
+from word_lists import Lexicon
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    # Five 1K words, one 2K word and one in the 5K-6K band, whose first list is numeric band 5
+    lines = ["CAT 1K", "MAT 1K", "ON 1K", "SAT 1K", "THE 1K", "DOG 2K", "ZEBRA 5K-6K"]
+    (tmp_path / "lists.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return LexicalProfiler(Lexicon(str(tmp_path / "lists.idx")))
+
+
+def test_profiles_bands_coverage_and_sentences(profiler):
+    profile = profiler.profile("The cat sat on the mat. The dog sat!")
+
+    assert profile["words"] == 9
+    assert profile["band_counts"] == [0, 8, 1, 0, 0, 0, 0, 0, 0, 0, 0]
+    assert profile["coverage"][:2] == [8 / 9, 1.0]
+    # 8/9 of the words are 1K words, short of 95%, so the 2K band is needed for both thresholds
+    assert profile["coverage_95"] == 2 and profile["coverage_98"] == 2
+    assert profile["off_list_ratio"] == 0.0
+    assert profile["sentences"] == 2
+    assert profile["mean_sentence_length"] == 4.5
+    assert profile["median_sentence_length"] == 4.5
+    assert profile["max_sentence_length"] == 6
+
+
+def test_a_threshold_reached_exactly_is_the_lower_band(profiler):
+    profile = profiler.profile("cat " * 19 + "dog.")
+
+    # 19 of 20 words is exactly 95%
+    assert profile["coverage_95"] == 1
+    assert profile["coverage_98"] == 2
+
+
+def test_thresholds_the_lists_never_reach_are_none(profiler):
+    # Numbers are not words, AND, SAW and GNUS are off-list
+    profile = profiler.profile("the cat and the zebra saw 3 gnus")
+
+    assert profile["words"] == 7
+    assert profile["band_counts"] == [3, 3, 0, 0, 0, 1, 0, 0, 0, 0, 0]
+    assert profile["coverage"][-1] == 4 / 7
+    assert profile["coverage_95"] is None and profile["coverage_98"] is None
+    assert profile["off_list_ratio"] == 3 / 7
+    # Without sentence-ending punctuation the whole text is one sentence
+    assert profile["sentences"] == 1
+    assert profile["max_sentence_length"] == profile["mean_sentence_length"] == 7
+
+
+def test_sentences_end_before_closing_quotes(profiler):
+    profile = profiler.profile("“The cat sat.” The dog sat.’ The mat sat.» On the mat.' The cat sat")
+
+    assert profile["words"] == 15
+    assert profile["sentences"] == 5
+    assert profile["max_sentence_length"] == 3
+
+
+def test_empty_text(profiler):
+    profile = profiler.profile("")
+
+    assert profile["words"] == 0 and profile["sentences"] == 0
+    assert profile["coverage_95"] is None and profile["off_list_ratio"] == 0.0
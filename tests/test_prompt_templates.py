@@ -0,0 +1,90 @@
+import pytest
+
+from genai_processor import LanguageModelProcessor, RequestSettings
+from prompt_templates import PromptTemplate, TemplateError, compile_template
+
+SETTINGS = RequestSettings(
+    practice_language="Spanish",
+    learner_level="B1 Intermediate",
+    conversation_context="At the market",
+    formality="Informal",
+    preferred_language="English",
+    translation_on=True,
+    highlight_mistakes_on=True,
+)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Create a dialogue in {practice_language} about '{vocab}'.",
+        "{vocab}{vocab} {{literal braces}} {practice_language!r}",
+        "Level {level:>5}|{ratio:.2f}",
+        "No placeholders at all",
+        "",
+    ],
+)
+def test_render_matches_str_format(text):
+    values = {"practice_language": "Spanish", "vocab": "comer", "level": "B1", "ratio": 0.4567}
+    assert PromptTemplate(text).render(values) == text.format(**values)
+
+
+def test_rejects_bad_and_unknown_placeholders():
+    with pytest.raises(TemplateError):
+        PromptTemplate("An unclosed {brace")
+    with pytest.raises(TemplateError):
+        PromptTemplate("{custom_api_key}", allowed_fields=LanguageModelProcessor.convo_fields)
+    with pytest.raises(TemplateError):
+        PromptTemplate("{vocab}").render({})
+
+
+def test_compiled_templates_are_cached():
+    assert compile_template("{vocab}") is compile_template("{vocab}")
+
+
+def test_compre_prompt_matches_the_old_f_string():
+    processor = LanguageModelProcessor("", "")
+    text = "Some text with {braces} in it."
+    level_prompt = "moderately simple English"
+    practice_language = "Spanish"
+
+    old = f"Simplify this text into {level_prompt} for {practice_language} language learners: {text}"
+    assert processor.create_compre_prompt(text, SETTINGS) == old
+
+
+def test_translation_and_mistakes_requests_match_the_old_f_strings():
+    processor = LanguageModelProcessor("", "")
+    vocab = "comer"
+    preferred_language = "English"
+    values = processor.convo_values(vocab, SETTINGS)
+
+    assert values["translation_request"] == (
+        f"Proivde a translation into the learner's preferred language ({preferred_language}). Emphasize clarity and accuracy in your translation. Where relevant, include brief annotations or explanations to highlight cultural or contextual nuances. These insights should elucidate expressions, idioms, or cultural references that may not directly translate but are crucial for understanding the dialogue's deeper meanings and implications."
+    )
+    assert values["mistakes_request"].strip() == (
+        f"Identify common errors learners might commit when using the vocabulary word '{vocab}'. Illuminate these mistakes by providing a brief explanation of why they are incorrect. Enhance this learning moment by crafting 2-3 model sentences that demonstrate the correct usage of '{vocab}'. These sentences should not only rectify the identified mistakes but also serve as clear examples for learners to emulate, helping them to internalize the correct application of the word in various contexts."
+    )
+
+    plain = processor.convo_values(
+        vocab, SETTINGS.replace(translation_on=False, highlight_mistakes_on=False)
+    )
+    assert plain["translation_request"].startswith("Provide the dialogue with no translations.")
+    assert plain["mistakes_request"] == ""
+
+
+def test_user_template_matches_an_f_string_with_the_same_fields():
+    processor = LanguageModelProcessor("", "")
+    template = "Construct a dialogue in {practice_language} at CEFR level {learner_level} using '{vocab}' ({conversation_context}, {formality}). {mistakes_request} {translation_request}"
+    values = processor.convo_values("comer", SETTINGS)
+
+    assert processor.render_user_template(template, "comer", SETTINGS) == template.format(**values)
+
+
+def test_convo_prompt_shares_its_preamble_between_words():
+    processor = LanguageModelProcessor("", "")
+    preamble = processor.create_convo_preamble(SETTINGS)
+
+    for vocab in ("comer", "beber"):
+        prompt = processor.create_convo_prompt(vocab, SETTINGS)
+        assert prompt.startswith(preamble)
+        assert prompt.rstrip().endswith(f"Target vocabulary word: '{vocab}'")
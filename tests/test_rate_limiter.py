@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from rate_limiter import RateLimiter, TokenBucket
+
+
+def drained_limiter(requests_per_minute=6000):
+    # Nothing to grant right away, so requests queue and are granted one every 10 ms
+    limiter = RateLimiter("fake", requests_per_minute, 1_000_000)
+    limiter.requests.level = 0
+    return limiter
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    # More than the bucket holds waits for a full bucket rather than forever
+    assert bucket.wait_time(1000) == pytest.approx(60.0, abs=0.1)
+
+
+def test_sessions_take_turns():
+    async def main():
+        limiter = drained_limiter()
+        granted = []
+
+        async def request(session, i):
+            await limiter.acquire(session=session)
+            granted.append((session, i))
+
+        tasks = [asyncio.ensure_future(request("a", i)) for i in range(5)]
+        tasks += [asyncio.ensure_future(request("b", i)) for i in range(2)]
+        await asyncio.sleep(0)
+        assert limiter.order == ("a", "b")
+        assert limiter.position("b") == 1
+
+        await asyncio.gather(*tasks)
+        assert [session for session, _ in granted] == ["a", "b", "a", "b", "a", "a", "a"]
+        # Each session's requests keep their order
+        assert [i for session, i in granted if session == "a"] == [0, 1, 2, 3, 4]
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_leaves_the_queue():
+    async def main():
+        limiter = drained_limiter(requests_per_minute=600)
+        first = asyncio.ensure_future(limiter.acquire(session="a"))
+        second = asyncio.ensure_future(limiter.acquire(session="b"))
+        await asyncio.sleep(0)
+        assert limiter.depth == 2
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert limiter.order == ("b",)
+        assert limiter.position("a") is None
+        assert limiter.depth == 1
+
+        await second
+        assert limiter.granted == 1
+        assert limiter.stats()["queued"] == 0
+
+    asyncio.run(main())
+
+
+def test_cancelling_one_of_a_sessions_requests_keeps_its_place():
+    async def main():
+        limiter = drained_limiter(requests_per_minute=600)
+        a1 = asyncio.ensure_future(limiter.acquire(session="a"))
+        a2 = asyncio.ensure_future(limiter.acquire(session="a"))
+        b1 = asyncio.ensure_future(limiter.acquire(session="b"))
+        await asyncio.sleep(0)
+
+        a1.cancel()
+        await asyncio.sleep(0)
+        assert limiter.order == ("a", "b")
+        assert limiter.depth == 2
+
+        await asyncio.gather(a2, b1)
+        assert limiter.granted == 2
+
+    asyncio.run(main())
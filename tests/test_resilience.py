@@ -0,0 +1,204 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, hedged, hedged_stream
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def open_breaker():
+    """
+    Returns a breaker that has opened and is now half-open, waiting for a trial call.
+    """
+    breaker = CircuitBreaker("fake", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+async def wait_half_open(breaker):
+    while breaker.state != "half-open":
+        await asyncio.sleep(0.01)
+
+
+def test_breaker_opens_after_threshold_and_closes_after_a_successful_trial():
+    async def main():
+        breaker = open_breaker()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+        await wait_half_open(breaker)
+
+        async def ok():
+            return "ok"
+
+        assert await RetryPolicy(max_attempts=1).call(ok, breaker) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(main())
+
+
+def test_cancelled_trial_does_not_leave_the_breaker_stuck_half_open():
+    async def main():
+        breaker = open_breaker()
+        await wait_half_open(breaker)
+        started = asyncio.Event()
+
+        async def hangs():
+            started.set()
+            await asyncio.sleep(60)
+
+        trial = asyncio.ensure_future(RetryPolicy(max_attempts=1).call(hangs, breaker))
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        # The trial counts as failed: open again, then a new trial is let through
+        assert breaker.state == "open"
+        await wait_half_open(breaker)
+
+        async def ok():
+            return "ok"
+
+        assert await RetryPolicy(max_attempts=1).call(ok, breaker) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(main())
+
+
+def test_cancelled_stream_trial_does_not_leave_the_breaker_stuck_half_open():
+    async def main():
+        breaker = open_breaker()
+        await wait_half_open(breaker)
+        started = asyncio.Event()
+
+        async def hangs():
+            started.set()
+            await asyncio.sleep(60)
+            yield "never"
+
+        async def consume():
+            return [delta async for delta in RetryPolicy(max_attempts=1).stream(hangs, breaker)]
+
+        trial = asyncio.ensure_future(consume())
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        assert breaker.state == "open"
+        await wait_half_open(breaker)
+        breaker.before_call()
+
+    asyncio.run(main())
+
+
+def test_cancelled_call_while_closed_is_not_a_failure():
+    async def main():
+        breaker = CircuitBreaker("fake", failure_threshold=1)
+
+        async def hangs():
+            await asyncio.sleep(60)
+
+        call = asyncio.ensure_future(RetryPolicy(max_attempts=1).call(hangs, breaker))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        assert breaker.state == "closed"
+
+    asyncio.run(main())
+
+
+def test_retries_server_errors_then_succeeds():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ServerError("unavailable")
+        return "ok"
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+    assert asyncio.run(policy.call(flaky)) == "ok"
+    assert len(attempts) == 3
+
+
+def test_does_not_retry_a_bad_request():
+    attempts = []
+
+    class BadRequest(Exception):
+        status_code = 400
+
+    async def bad():
+        attempts.append(1)
+        raise BadRequest("no")
+
+    with pytest.raises(BadRequest):
+        asyncio.run(RetryPolicy(max_attempts=3, base_delay=0.001).call(bad))
+    assert len(attempts) == 1
+
+
+async def answer(text, delay=0):
+    await asyncio.sleep(delay)
+    return text
+
+
+async def fail(error, delay=0):
+    await asyncio.sleep(delay)
+    raise error
+
+
+async def deltas(text, error=None):
+    if error is not None:
+        raise error
+    for word in text.split():
+        yield word
+
+
+def test_hedged_falls_back_on_an_error_but_not_on_a_falsy_answer():
+    assert (
+        asyncio.run(hedged(lambda: fail(ServerError("down")), lambda: answer("second"), 10)) == "second"
+    )
+    assert asyncio.run(hedged(lambda: answer(""), lambda: answer("second"), 10)) == ""
+
+
+def test_hedged_raises_the_last_error_when_both_fail():
+    with pytest.raises(TimeoutError):
+        asyncio.run(hedged(lambda: fail(ServerError("down")), lambda: fail(TimeoutError(), 0.01), 10))
+
+
+def test_hedged_stream_falls_back_and_raises_when_both_fail():
+    async def collect(stream):
+        return [delta async for delta in stream]
+
+    first = lambda: deltas("", CircuitOpenError("open"))  # noqa: E731
+    assert asyncio.run(collect(hedged_stream(first, lambda: deltas("uno dos"), 10))) == ["uno", "dos"]
+    with pytest.raises(ServerError):
+        asyncio.run(collect(hedged_stream(first, lambda: deltas("", ServerError("down")), 10)))
+
+
+def test_hedged_stream_closes_the_loser_before_streaming_the_winner():
+    events = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+            yield "slow"
+        finally:
+            events.append("loser closed")
+
+    async def quick():
+        yield "uno"
+        yield "dos"
+
+    async def consume():
+        async for delta in hedged_stream(slow, quick, 0.01):
+            events.append(delta)
+
+    asyncio.run(consume())
+    assert events == ["loser closed", "uno", "dos"]
@@ -0,0 +1,106 @@
+import response_cache
+from response_cache import ResponseCache
+
+
+def test_key_depends_on_request_but_not_prompt_whitespace():
+    key = ResponseCache.make_key("openai", "gpt-3.5-turbo", "Simplify  this\n text", temperature=0.7)
+
+    assert key == ResponseCache.make_key(
+        "openai", "gpt-3.5-turbo", "Simplify this text", temperature=0.7
+    )
+    assert key != ResponseCache.make_key(
+        "openai", "gpt-3.5-turbo", "Simplify this text", temperature=0.9
+    )
+    assert key != ResponseCache.make_key(
+        "gemini", "gpt-3.5-turbo", "Simplify this text", temperature=0.7
+    )
+
+
+def test_only_hits_once_a_key_holds_enough_variants():
+    cache = ResponseCache()
+    cache.add("key", "first", variants=2)
+    assert cache.get("key", variants=2) is None
+
+    cache.add("key", "second", variants=2)
+    assert cache.get("key", variants=2) in {"first", "second"}
+
+    # The oldest variant makes room for a new one
+    cache.add("key", "third", variants=2)
+    assert {cache.get("key", variants=2) for _ in range(50)} <= {"second", "third"}
+
+
+def test_evicts_the_least_recently_used_key():
+    cache = ResponseCache(max_entries=2)
+    cache.add("a", "A")
+    cache.add("b", "B")
+    assert cache.get("a") == "A"
+
+    cache.add("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats()["entries"] == 2
+
+
+def test_disk_tier_outlives_the_process(tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(path=path)
+    cache.add("key", "first", variants=2)
+    cache.add("key", "second", variants=2)
+
+    reopened = ResponseCache(path=path)
+    assert reopened.get("key", variants=2) in {"first", "second"}
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.get("other") is None
+
+
+def test_disk_tier_evicts_the_least_recently_used_responses(tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(path=path, max_disk_entries=2)
+    for key in ("a", "b", "c"):
+        cache.add(key, key.upper())
+
+    reopened = ResponseCache(path=path)
+    assert reopened.get("a") is None
+    assert reopened.get("b") == "B"
+    assert reopened.get("c") == "C"
+
+
+def test_disk_responses_expire_after_ttl(tmp_path, monkeypatch):
+    path = str(tmp_path / "responses.db")
+    now = 1_000_000.0
+    monkeypatch.setattr(response_cache.time, "time", lambda: now)
+    ResponseCache(path=path, ttl=60).add("key", "response")
+
+    now += 59
+    assert ResponseCache(path=path, ttl=60).get("key") == "response"
+
+    now += 2
+    assert ResponseCache(path=path, ttl=60).get("key") is None
+
+
+def test_expired_responses_are_deleted_when_storing_at_most_once_per_interval(tmp_path, monkeypatch):
+    path = str(tmp_path / "responses.db")
+    now = 1_000_000.0
+    monkeypatch.setattr(response_cache.time, "time", lambda: now)
+    ResponseCache(path=path, ttl=60).add("old", "response")
+    cache = ResponseCache(path=path, ttl=60)
+
+    def rows():
+        return cache._db.execute("SELECT key FROM responses ORDER BY key").fetchall()
+
+    # Looking up an expired response doesn't write to the file
+    now += 61
+    assert cache.get("old") is None
+    assert rows() == [("old",)]
+
+    # The first store deletes it, later ones within the interval don't look for more
+    cache.add("new", "response")
+    assert rows() == [("new",)]
+    now += 61
+    cache.add("newer", "response")
+    assert rows() == [("new",), ("newer",)]
+
+    now += cache.expire_interval
+    cache.add("newest", "response")
+    assert rows() == [("newest",)]
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from sentence_simplifier import CHUNK_TOKENS, SentenceSimplifier, split_sentences
+from token_counter import estimate_tokens
+
+TEXTS = [
+    "One sentence.",
+    "No punctuation at the end",
+    "Mr. Smith met Dr. Jones at five on St. Mark's Road. They talked!",
+    'She said "Stop!" Then she left. J. R. R. Tolkien wrote it (in 1937.) Did he?',
+    "First paragraph. Still first.\n\nSecond paragraph.\n  Indented line?  Trailing space.  ",
+    "",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_split_sentences_round_trips(text):
+    assert "".join(sentence + whitespace for sentence, whitespace in split_sentences(text)) == text
+
+
+def test_split_sentences_skips_abbreviations_and_initials():
+    sentences = [sentence for sentence, _ in split_sentences(TEXTS[2] + " " + TEXTS[3])]
+    assert sentences == [
+        "Mr. Smith met Dr. Jones at five on St. Mark's Road.",
+        "They talked!",
+        'She said "Stop!"',
+        "Then she left.",
+        "J. R. R. Tolkien wrote it (in 1937.)",
+        "Did he?",
+    ]
+
+
+def test_split_sentences_keeps_paragraph_breaks_as_whitespace():
+    assert split_sentences("One.\n\nTwo.") == [("One.", "\n\n"), ("Two.", "")]
+
+
+def test_plan_marks_only_sentences_above_the_learners_level():
+    text = "The cat is on the table. Ontological epistemology problematizes hermeneutics."
+    plan = SentenceSimplifier().plan(text, "A1 Beginner")
+
+    assert [part["simplify"] for part in plan] == [False, True]
+    assert SentenceSimplifier.join(plan) == text
+
+
+def test_plan_keeps_everything_without_a_level():
+    plan = SentenceSimplifier().plan("Ontological epistemology problematizes hermeneutics.", "")
+    assert not any(part["simplify"] for part in plan)
+
+
+def simplify_all(text, simplifier=None):
+    # A plan with every sentence marked for simplifying
+    simplifier = simplifier or SentenceSimplifier()
+    return [
+        {"sentence": sentence, "whitespace": whitespace, "coverage": 0.0, "simplify": True}
+        for sentence, whitespace in simplifier.split_long(split_sentences(text))
+    ]
+
+
+def test_chunks_stay_within_the_token_budget():
+    assert CHUNK_TOKENS == 300
+    simplifier = SentenceSimplifier()
+    sentence = "This sentence has exactly forty characters in it, more or less. "
+    plan = simplify_all(sentence * 100, simplifier)
+    chunks = simplifier.chunks(plan)
+
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(plan)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(chunks, chunks[1:]))
+    for start, end in chunks:
+        assert sum(estimate_tokens(part["sentence"]) for part in plan[start:end]) <= CHUNK_TOKENS
+    assert len(chunks) > 1
+
+
+def test_chunks_never_cross_a_paragraph_break():
+    simplifier = SentenceSimplifier()
+    plan = simplify_all("One. Two.\n\nThree. Four.\nFive.", simplifier)
+
+    chunks = [simplifier.join(plan[start:end]) for start, end in simplifier.chunks(plan)]
+    assert chunks == ["One. Two.\n\n", "Three. Four.\n", "Five."]
+
+
+def test_chunks_skip_sentences_that_are_kept():
+    simplifier = SentenceSimplifier()
+    plan = simplify_all("One. Two. Three. Four.", simplifier)
+    plan[2]["simplify"] = False
+
+    assert simplifier.chunks(plan) == [(0, 2), (3, 4)]
+
+
+def test_long_sentences_are_split_between_words_within_the_budget():
+    simplifier = SentenceSimplifier(chunk_tokens=10)
+    text = "word " * 100 + "end.\n\nNext."
+    pieces = list(simplifier.split_long(split_sentences(text)))
+
+    assert "".join(sentence + whitespace for sentence, whitespace in pieces) == text
+    assert all(estimate_tokens(sentence) <= 10 for sentence, _ in pieces)
+
+
+def test_stream_puts_chunks_back_in_order_and_keeps_failed_ones():
+    simplifier = SentenceSimplifier(max_parallel=2)
+    plan = simplify_all("One.\nTwo.\nThree.\nFour.", simplifier)
+    plan[1]["simplify"] = False
+    chunks = simplifier.chunks(plan)
+    prompts = [simplifier.join(plan[start:end]).strip() for start, end in chunks]
+    running = []
+
+    async def simplify_text(prompt):
+        running.append(prompt)
+        assert len(running) <= 2
+        await asyncio.sleep(0.01 if prompt == "One." else 0)
+        running.remove(prompt)
+        if prompt == "Three.":
+            raise RuntimeError("provider failed")
+        return prompt.upper()
+
+    errors = []
+    parts = asyncio.run(collect(simplifier.stream(plan, chunks, prompts, simplify_text, errors)))
+    assert "".join(parts) == "ONE.\nTwo.\nThree.\nFOUR."
+    assert [str(error) for error in errors] == ["provider failed"]
+
+
+async def collect(parts):
+    return [part async for part in parts]
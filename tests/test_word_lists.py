@@ -0,0 +1,123 @@
+import os
+import pickle
+import threading
+
+import pytest
+
+import word_lists
+from word_lists import (
+    BAND_LABELS,
+    LISTS_PATH,
+    FrequencyIndex,
+    Lexicon,
+    build_index,
+    freq_colored_dict,
+    lexicon,
+)
+
+
+def write_lists(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def test_looks_up_bands_and_headwords(tmp_path):
+    lists_path, index_path = str(tmp_path / "lists.txt"), str(tmp_path / "lists.idx")
+    write_lists(
+        lists_path,
+        ["# comment", "ABLE 1K", "ABILITY 1K", "ABLY 1K", "BAG 2K", "BAGGAGE 2K", "CAFÉ 2K", "CAT 1K"],
+    )
+    # The lists are found next to the index
+    index = FrequencyIndex(index_path, BAND_LABELS)
+
+    assert index["ABILITY"] == "1K"
+    assert index.band_id("BAGGAGE") == 1
+    assert index.headword("ABLY") == "ABLE"
+    assert "ZEBRA" not in index and index.band_id("ZEBRA") is None
+    assert [] not in index
+    assert index["CAFÉ"] == "2K" and index["CAT"] == "1K"
+    assert list(index) == ["ABILITY", "ABLE", "ABLY", "BAG", "BAGGAGE", "CAFÉ", "CAT"]
+    assert Lexicon(index_path).members("ABLY") == ["ABLE", "ABILITY", "ABLY"]
+    assert pickle.loads(pickle.dumps(index))["BAG"] == "2K"
+
+
+def test_rebuilds_the_index_when_the_lists_change(tmp_path):
+    lists_path, index_path = str(tmp_path / "lists.txt"), str(tmp_path / "lists.idx")
+    write_lists(lists_path, ["ABLE 1K", "BAG 2K"])
+    build_index(lists_path, index_path)
+    write_lists(lists_path, ["ABLE 1K", "BAG 3K-4K", "ZEBRA 9K-10K"])
+
+    index = FrequencyIndex(index_path, BAND_LABELS, lists_path)
+    assert index["BAG"] == "3K-4K"
+    assert index["ZEBRA"] == "9K-10K"
+
+    # An up to date index is used as it is
+    modified = os.path.getmtime(index_path)
+    assert FrequencyIndex(index_path, BAND_LABELS, lists_path)["ZEBRA"] == "9K-10K"
+    assert os.path.getmtime(index_path) == modified
+
+
+def test_uses_the_shipped_index_when_it_cannot_be_rebuilt(tmp_path, monkeypatch):
+    lists_path, index_path = str(tmp_path / "lists.txt"), str(tmp_path / "lists.idx")
+    write_lists(lists_path, ["ABLE 1K", "BAG 2K"])
+    build_index(lists_path, index_path)
+    write_lists(lists_path, ["ABLE 1K", "BAG 3K-4K"])
+
+    def read_only(lists_path, index_path):
+        raise PermissionError(13, "Read-only file system", index_path)
+
+    monkeypatch.setattr(word_lists, "build_index", read_only)
+    assert FrequencyIndex(index_path, BAND_LABELS, lists_path)["BAG"] == "2K"
+
+    # Without an index to fall back on, the error is raised
+    with pytest.raises(PermissionError):
+        FrequencyIndex(str(tmp_path / "missing.idx"), BAND_LABELS, lists_path)["BAG"]
+
+
+def test_threads_load_the_index_once(tmp_path):
+    lists_path, index_path = str(tmp_path / "lists.txt"), str(tmp_path / "lists.idx")
+    write_lists(lists_path, ["ABLE 1K", "BAG 2K"])
+    index = FrequencyIndex(index_path, BAND_LABELS)
+    maps = []
+    load = index._map
+    index._map = lambda: (maps.append(1), load())
+
+    threads = [threading.Thread(target=index.get, args=("BAG",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(maps) == 1 and index["BAG"] == "2K"
+    # The index was written through a temporary file that is gone
+    assert sorted(os.listdir(tmp_path)) == ["lists.idx", "lists.txt"]
+
+
+def test_the_default_lexicon_shares_the_colour_index():
+    assert lexicon.band("ABLE") == 1
+    assert lexicon.words is freq_colored_dict._words
+    assert lexicon.word_ids is freq_colored_dict._positions
+
+
+def test_recovers_word_families_from_the_lists(tmp_path):
+    index = FrequencyIndex(str(tmp_path / "lists.idx"), BAND_LABELS, LISTS_PATH)
+
+    # Forms that sort before their headword or break the order
+    assert index.headword("STUNK") == "STINK"
+    assert index.headword("ABILITY") == "ABLE"
+    assert index.headword("TEETH") == "TOOTH"
+    assert index.headword("BOUGHT") == "BUY"
+    assert index.headword("HAPPINESS") == index.headword("HAPPIER") == index.headword("HAPPY") == "HAPPY"
+    assert index.headword("UNHAPPY") == "HAPPY"
+    assert index.headword("MISUNDERSTOOD") == index.headword("UNDERSTANDABLE") == "UNDERSTAND"
+    assert index.headword("HARBOUR") == "HARBOR"
+
+    # Words that only share letters with the family before them
+    assert index.headword("STOCKING") == "STOCKING"
+    assert index.headword("HAPPEN") == "HAPPEN"
+    assert index.headword("UNDER") == "UNDER"
+    assert index.headword("TODAY") == "TODAY"
+    assert index.headword("TO") == "TO"
+    assert index.headword("CONFESS") == "CONFESS"
+    assert index.headword("INITIATE") == "INITIATE"
+    assert index.headword("INTERNATIONAL") == "INTERNATIONAL"
@@ -0,0 +1,75 @@
+"""
+Local token counts, so prompts can be sized before they are sent and usage tracked without waiting for
+the provider's numbers.
+
+OpenAI models are counted exactly with tiktoken when it is installed (pip install tiktoken) and its
+encoding can be loaded. Everything else uses a heuristic calibrated on English text for the GPT and
+Gemini tokenizers: about 4 characters per token, while characters outside ASCII (accents, other
+scripts) count as a token each, which overestimates rather than underestimates other languages.
+"""
+
+from functools import lru_cache
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """
+    Heuristic token count of text.
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", errors="ignore"))
+    return -(-ascii_chars // CHARS_PER_TOKEN) + len(text) - ascii_chars
+
+
+class TokenCounter:
+    """
+    Counts tokens for one provider and model.
+
+    Parameters:
+    - provider (str): e.g. "openai" or "gemini".
+    - model (str): e.g. "gpt-3.5-turbo".
+    """
+
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = model
+        self._encoding = None
+        self._encoding_loaded = False
+
+    @property
+    def exact(self):
+        """
+        Whether counts come from the model's own tokenizer rather than the heuristic.
+        """
+        return self.encoding is not None
+
+    @property
+    def encoding(self):
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            if self.provider == "openai":
+                try:
+                    import tiktoken
+
+                    self._encoding = tiktoken.encoding_for_model(self.model)
+                except Exception:
+                    # Not installed, an unknown model, or the encoding can't be downloaded
+                    self._encoding = None
+        return self._encoding
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+
+@lru_cache(maxsize=None)
+def token_counter(provider, model):
+    """
+    Returns the shared TokenCounter for a provider and model.
+    """
+    return TokenCounter(provider, model)